@@ -0,0 +1,68 @@
+"""Compare rule-based availability with materialized doctor_slots rows.
+
+Seeds two doctomed.db files in scratch directories with the same doctors and
+bookings: one with a doctor_slots row per bookable hour up to the horizon, one
+with weekly doctor_hours rules and no slot rows. Times bot.get_available_slots
+for random calendar pages and reports how many availability rows each variant
+stores.
+
+    python benchmarks/bench_availability.py --doctors 50 --horizon 180 --bookings 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+
+from common import print_table, seed_database, summarize, timed
+
+import bot
+
+def seed(variant, args):
+    os.chdir(tempfile.mkdtemp(prefix=f'doctomed-availability-{variant}-'))
+    days = args.horizon if variant == 'materialized' else 0
+    doctor_ids, _ = seed_database(doctors=args.doctors, users=500, bookings=args.bookings, days=days, seed=args.seed)
+    conn = sqlite3.connect('doctomed.db')
+    try:
+        c = conn.cursor()
+        if variant == 'rules':
+            c.execute('DELETE FROM doctor_slots')
+            c.executemany('INSERT INTO doctor_hours (doctor_id, weekday, time_slot) VALUES (?, ?, ?)',
+                          [(doctor_id, weekday, time_slot) for doctor_id in doctor_ids
+                           for weekday in range(7) for time_slot in bot.TIME_SLOTS])
+        c.execute("UPDATE bookings SET confirmed = 1 WHERE status = 'approved'")
+        conn.commit()
+        c.execute('SELECT (SELECT COUNT(*) FROM doctor_slots) + (SELECT COUNT(*) FROM doctor_hours) + (SELECT COUNT(*) FROM slot_exceptions)')
+        return doctor_ids, c.fetchone()[0]
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rule-based availability against materialized slot rows.')
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--bookings', type=int, default=50000)
+    parser.add_argument('--horizon', type=int, default=90, help='days patients can book ahead')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    today = date.today()
+    results = []
+    for variant in ('materialized', 'rules'):
+        doctor_ids, rows = seed(variant, args)
+        rng = random.Random(args.seed)
+
+        def week_page():
+            start = today + timedelta(days=rng.randrange(0, args.horizon - bot.CALENDAR_PAGE_DAYS + 1, bot.CALENDAR_PAGE_DAYS))
+            bot.get_available_slots(rng.choice(doctor_ids), start, start + timedelta(days=bot.CALENDAR_PAGE_DAYS))
+
+        row = summarize(timed(week_page, args.iterations))
+        row.update(variant=variant, rows=rows)
+        results.append(row)
+
+    print(f"doctors={args.doctors} bookings={args.bookings} horizon={args.horizon}")
+    print_table(results, ['variant', 'rows', 'n', 'p50', 'p95', 'p99', 'ops_per_sec'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""Offline latency/throughput benchmark for the bot's handlers.
+
+Builds synthetic Updates, routes all Bot API calls through a recording fake
+request backend and runs every flow against a freshly seeded doctomed.db in a
+scratch directory, so no Telegram token or network access is needed. With
+--storage memory the handlers run on a MemoryStorage loaded from that database.
+
+    python benchmarks/bench_handlers.py --users 1000 --bookings 20000 --iterations 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import FAKE_TOKEN, RecordingRequest, UpdateFactory, print_table, seed_database, summarize
+
+import bot
+from telegram.ext import Application
+
+FLOWS = ['start', 'browse', 'booking', 'rebook', 'cancel', 'approve', 'approve_batch', 'broadcast', 'admin_bookings', 'admin_users', 'admin_slots']
+ADMIN_ID = 1
+
+class HandlerBench:
+    def __init__(self, application, request, doctor_ids, user_ids, rng):
+        self.application = application
+        self.request = request
+        self.updates = UpdateFactory(application.bot)
+        self.doctor_ids = doctor_ids
+        self.user_ids = user_ids
+        self.rng = rng
+        conn = sqlite3.connect('doctomed.db', timeout=10)
+        try:
+            c = conn.cursor()
+            c.execute("SELECT id, user_id FROM bookings WHERE status = 'approved'")
+            self.approved = c.fetchall()
+            c.execute("SELECT id, doctor_id FROM bookings WHERE status = 'pending'")
+            self.pending = c.fetchall()
+        finally:
+            conn.close()
+
+    def context(self, update):
+        return bot.ContextTypes.DEFAULT_TYPE.from_update(update, self.application)
+
+    async def callback(self, user_id, data):
+        update = self.updates.callback(user_id, data, self.request.message_with_button(user_id, data))
+        return await bot.button_callback(update, self.context(update))
+
+    async def message(self, user_id, text):
+        update = self.updates.message(user_id, text)
+        return await bot.handle_message(update, self.context(update))
+
+    # Put bookings back in a state a flow starts from, on whichever storage the bot runs on
+    def _reset_bookings(self, ids, status, confirmed):
+        if isinstance(bot.storage, bot.MemoryStorage):
+            bot.storage.set_booking_status(ids, status, confirmed)
+            return
+        conn = sqlite3.connect('doctomed.db', timeout=10)
+        try:
+            conn.execute(f"UPDATE bookings SET status = ?, confirmed = ? WHERE id IN ({','.join('?' * len(ids))})",
+                         (status, int(confirmed), *ids))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # Each flow returns (setup, run, teardown); only run is timed
+    def flow_start(self):
+        user_id = self.rng.choice(self.user_ids)
+        update = self.updates.message(user_id, '/start')
+
+        async def run():
+            await bot.start(update, self.context(update))
+        return None, run, None
+
+    # Menu navigation without booking: open a doctor's calendar, page forward and back, return to the doctors
+    def flow_browse(self):
+        user_id = self.rng.choice(self.user_ids)
+        doctor_id = self.rng.choice(self.doctor_ids)
+
+        async def run():
+            await self.callback(user_id, 'book')
+            await self.callback(user_id, f'doctor_{doctor_id}')
+            for step in (1, -1):
+                pages = [data for data in self.request.buttons(user_id) if data and data.startswith('cal:')]
+                if pages:
+                    await self.callback(user_id, pages[-1] if step > 0 else pages[0])
+            await self.callback(user_id, 'select_doctor')
+        return None, run, None
+
+    def flow_booking(self):
+        user_id = self.rng.choice(self.user_ids)
+        doctor_id = self.rng.choice(self.doctor_ids)
+
+        async def run():
+            await self.callback(user_id, 'book')
+            await self.callback(user_id, f'doctor_{doctor_id}')
+            choices = [data for data in self.request.buttons(user_id) if data and data.startswith('s:')]
+            if not choices:
+                return
+            await self.callback(user_id, choices[0])
+            await self.message(user_id, 'Bench Patient')
+            await self.message(user_id, '1980-01-01')
+        return None, run, None
+
+    # A returning patient taps a saved profile instead of typing the name and date of birth
+    def flow_rebook(self):
+        user_id = self.rng.choice(self.user_ids)
+        doctor_id = self.rng.choice(self.doctor_ids)
+
+        async def run():
+            await self.callback(user_id, 'book')
+            await self.callback(user_id, f'doctor_{doctor_id}')
+            choices = [data for data in self.request.buttons(user_id) if data and data.startswith('s:')]
+            if not choices:
+                return
+            await self.callback(user_id, choices[0])
+            profiles = [data for data in self.request.buttons(user_id) if data and data.startswith('pp:')]
+            if profiles:
+                await self.callback(user_id, profiles[0])
+        return None, run, None
+
+    def flow_cancel(self):
+        booking_id, user_id = self.rng.choice(self.approved)
+
+        async def setup():
+            self._reset_bookings([booking_id], 'approved', True)
+
+        async def run():
+            await self.callback(user_id, 'cancel_booking')
+            choices = [data for data in self.request.buttons(user_id) if data]
+            if choices:
+                await self.callback(user_id, choices[0])
+
+        async def teardown():
+            ids = [row[0] for row in self.approved if row[1] == user_id]
+            self._reset_bookings(ids, 'approved', True)
+        return setup, run, teardown
+
+    def flow_approve(self):
+        booking_id, doctor_id = self.rng.choice(self.pending)
+
+        async def setup():
+            self._reset_bookings([booking_id], 'pending', False)
+
+        async def run():
+            await self.callback(doctor_id, bot.booking_callback('approve', booking_id))
+        return setup, run, None
+
+    # A doctor approves their whole /pending queue in one tap
+    def flow_approve_batch(self):
+        doctor_id = self.rng.choice(self.doctor_ids)
+        ids = [booking_id for booking_id, pending_doctor_id in self.pending if pending_doctor_id == doctor_id]
+
+        async def setup():
+            self._reset_bookings(ids, 'pending', False)
+
+        async def run():
+            update = self.updates.message(doctor_id, '/pending')
+            await bot.pending(update, self.context(update))
+            await self.callback(doctor_id, 'pq:all')
+            await self.callback(doctor_id, 'pq:ok')
+        return setup, run, None
+
+    def flow_broadcast(self):
+        async def setup():
+            self.application.user_data[ADMIN_ID]['state'] = bot.BROADCAST
+
+        async def run():
+            await self.message(ADMIN_ID, 'Benchmark broadcast')
+        return setup, run, None
+
+    def flow_admin_bookings(self):
+        async def run():
+            await self.callback(ADMIN_ID, 'admin_bookings')
+        return None, run, None
+
+    def flow_admin_users(self):
+        async def run():
+            await self.callback(ADMIN_ID, 'admin_users')
+        return None, run, None
+
+    def flow_admin_slots(self):
+        async def run():
+            await self.callback(ADMIN_ID, 'admin_view_slots')
+        return None, run, None
+
+    async def run_flow(self, name, iterations):
+        durations = []
+        api_calls = 0
+        api_bytes = 0
+        new_messages = 0
+        wall_start = time.perf_counter()
+        for _ in range(iterations):
+            setup, run, teardown = getattr(self, f'flow_{name}')()
+            if setup:
+                await setup()
+            self.request.reset()
+            started = time.perf_counter()
+            await run()
+            durations.append(time.perf_counter() - started)
+            # Notifications go through the outbox and the outbound queue; count them once both are empty
+            await bot.outbox_relay.drain()
+            await bot.outbound.drain()
+            api_calls += len(self.request.calls)
+            api_bytes += self.request.bytes_sent
+            new_messages += sum(1 for call in self.request.calls if call[0] == 'sendMessage')
+            if teardown:
+                await teardown()
+        wall_time = time.perf_counter() - wall_start
+        result = summarize(durations, sum(durations))
+        result['flow'] = name
+        result['api_calls'] = api_calls / iterations if iterations else 0.0
+        result['api_bytes'] = api_bytes / iterations if iterations else 0.0
+        result['new_messages'] = new_messages / iterations if iterations else 0.0
+        result['wall_s'] = wall_time
+        return result
+
+async def run_benchmark(args):
+    doctor_ids, user_ids = seed_database(doctors=args.doctors, users=args.users, bookings=args.bookings,
+                                         days=args.days, admin_id=ADMIN_ID, seed=args.seed)
+    if args.storage == 'memory':
+        bot.storage = bot.MemoryStorage.load()
+    request = RecordingRequest()
+    application = Application.builder().token(FAKE_TOKEN).request(request).get_updates_request(RecordingRequest()).build()
+    await application.initialize()
+    await bot.db_writer.start()
+    # The fake API never rate-limits, so the sender runs unthrottled
+    bot.outbound = bot.OutboundSender(global_rate=0, chat_rate=0, workers=8, max_retries=0)
+    await bot.outbound.start(application.bot)
+    await bot.outbox_relay.start()
+    try:
+        bench = HandlerBench(application, request, doctor_ids, user_ids, random.Random(args.seed))
+        results = []
+        for flow in args.flows:
+            iterations = args.broadcast_iterations if flow == 'broadcast' else args.iterations
+            results.append(await bench.run_flow(flow, iterations))
+        return results
+    finally:
+        await bot.outbox_relay.stop()
+        await bot.outbound.stop()
+        await bot.db_writer.stop()
+        bot.db_reader.close()
+        await application.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bot handlers offline against a seeded doctomed.db.')
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=7, help='days of doctor slots to seed from today')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--broadcast-iterations', type=int, default=1,
+                        help='broadcast sends to every seeded user, so it is run fewer times')
+    parser.add_argument('--flows', default=','.join(FLOWS), help=f'comma-separated subset of {",".join(FLOWS)}')
+    parser.add_argument('--storage', choices=['sqlite', 'memory'], default='sqlite',
+                        help='backend the handlers run on; memory is loaded from the seeded database')
+    parser.add_argument('--workdir', help='directory for doctomed.db (default: a fresh temp directory)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+    args.flows = [flow.strip() for flow in args.flows.split(',') if flow.strip()]
+    unknown = [flow for flow in args.flows if flow not in FLOWS]
+    if unknown:
+        parser.error(f"Unknown flows: {', '.join(unknown)}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='doctomed-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    if os.path.exists(os.path.join(workdir, 'doctomed.db')):
+        parser.error(f"{workdir} already contains doctomed.db; use an empty directory")
+    os.chdir(workdir)
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    results = asyncio.run(run_benchmark(args))
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"doctors={args.doctors} users={args.users} bookings={args.bookings} storage={args.storage} workdir={workdir}")
+        print_table(results, ['flow', 'n', 'p50', 'p95', 'p99', 'ops_per_sec', 'api_calls', 'api_bytes', 'new_messages'])
+
+if __name__ == '__main__':
+    main()
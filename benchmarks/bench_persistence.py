@@ -0,0 +1,88 @@
+"""Compare SQLitePersistence with PicklePersistence for many open conversations.
+
+Fills both persistences with --conversations user_data entries shaped like a
+booking in progress, then times persistence passes: --dirty entries change,
+update_user_data is called for them as Application.update_persistence() does
+and the pass ends with flush(). PicklePersistence runs with on_flush=True, so
+each pass writes one pickle of all user_data; SQLitePersistence writes only the
+changed rows. Also reports the startup load time and the size on disk.
+
+    python benchmarks/bench_persistence.py --conversations 100000 --dirty 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from common import print_table, summarize
+
+import bot
+from telegram.ext import PicklePersistence
+
+def user_data(rng, user_id):
+    day = rng.randint(1, 28)
+    return {
+        'language': rng.choice(list(bot.LANGUAGES)),
+        'state': bot.PATIENT_DOB,
+        'selected_slot': rng.choice(bot.TIME_SLOTS),
+        'selected_date': f'2025-05-{day:02d}',
+        'selected_slot_key': bot.to_slot_key(f'2025-05-{day:02d}', '09:00'),
+        'selected_doctor_id': 900000 + rng.randrange(50),
+        'patient_name': f'Patient {user_id}',
+    }
+
+async def measure(name, persistence, args):
+    rng = random.Random(args.seed)
+    user_ids = list(range(100000, 100000 + args.conversations))
+    for user_id in user_ids:
+        await persistence.update_user_data(user_id, user_data(rng, user_id))
+    await persistence.flush()
+
+    durations = []
+    for _ in range(args.passes):
+        started = time.perf_counter()
+        for user_id in rng.sample(user_ids, args.dirty):
+            await persistence.update_user_data(user_id, user_data(rng, user_id))
+        await persistence.flush()
+        durations.append(time.perf_counter() - started)
+    row = summarize(durations)
+    row['persistence'] = name
+    return row
+
+async def load_time(make_persistence):
+    started = time.perf_counter()
+    data = await make_persistence().get_user_data()
+    return (time.perf_counter() - started) * 1000, len(data)
+
+async def run(args):
+    os.chdir(tempfile.mkdtemp(prefix='doctomed-persistence-'))
+    bot.init_db()
+    variants = [
+        ('sqlite', lambda: bot.SQLitePersistence('doctomed.db'), 'doctomed.db'),
+        ('pickle', lambda: PicklePersistence('conversations.pickle', on_flush=True), 'conversations.pickle'),
+    ]
+    results = []
+    for name, make_persistence, path in variants:
+        row = await measure(name, make_persistence(), args)
+        row['load_ms'], loaded = await load_time(make_persistence)
+        assert loaded == args.conversations, (name, loaded)
+        row['size_mb'] = sum(os.path.getsize(f) for f in os.listdir('.') if f.startswith(path)) / 1e6
+        results.append(row)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark persistence flush cost for many open conversations.')
+    parser.add_argument('--conversations', type=int, default=100000)
+    parser.add_argument('--dirty', type=int, default=1000, help='entries changed between two flushes')
+    parser.add_argument('--passes', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"conversations={args.conversations} dirty_per_flush={args.dirty}")
+    print_table(results, ['persistence', 'n', 'p50', 'p95', 'p99', 'load_ms', 'size_mb'])
+
+if __name__ == '__main__':
+    main()
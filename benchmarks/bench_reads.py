@@ -0,0 +1,96 @@
+"""Compare the approve path's lookups on the event loop with the read-only pool.
+
+Seeds doctomed.db in a scratch directory and times the doctor and the two
+language lookups that follow get_booking_by_id when a booking is approved:
+one after another through the per-call-connection getters, and together via
+asyncio.gather on bot.db_reader. Each case runs idle and while a background
+thread keeps committing writes, and with several approvals in flight at once.
+
+    python benchmarks/bench_reads.py --iterations 500 --concurrency 1,8
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from common import print_table, seed_database, summarize
+
+import bot
+
+def keep_writing(stop, user_ids):
+    conn = sqlite3.connect('doctomed.db', timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    i = 0
+    while not stop.is_set():
+        bot.write_support_request(conn.cursor(), user_ids[i % len(user_ids)], f'Background write {i}')
+        conn.commit()
+        i += 1
+    conn.close()
+
+async def sequential(booking):
+    bot.get_doctor_by_id(booking[6])
+    bot.get_user_language(booking[1])
+    bot.get_user_language(booking[6])
+
+async def gathered(booking):
+    await asyncio.gather(bot.db_reader.run(bot.read_doctor, booking[6]),
+                         bot.db_reader.run(bot.read_user_language, booking[1]),
+                         bot.db_reader.run(bot.read_user_language, booking[6]))
+
+async def run_case(fn, bookings, iterations, concurrency, rng):
+    durations = []
+
+    async def worker(count):
+        for _ in range(count):
+            booking = rng.choice(bookings)
+            started = time.perf_counter()
+            await fn(booking)
+            durations.append(time.perf_counter() - started)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker(iterations // concurrency) for _ in range(concurrency)))
+    result = summarize(durations, time.perf_counter() - wall_start)
+    bot.db_reader.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sequential lookups against the read-only connection pool.')
+    parser.add_argument('--bookings', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--concurrency', default='1,8', help='comma-separated numbers of approvals in flight')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='doctomed-reads-'))
+    _, user_ids = seed_database(doctors=20, users=2000, bookings=args.bookings, days=14, seed=args.seed)
+    conn = sqlite3.connect('doctomed.db')
+    bookings = conn.execute('SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, slot_key FROM bookings LIMIT 5000').fetchall()
+    conn.close()
+    rng = random.Random(args.seed)
+
+    results = []
+    for load in ('idle', 'writing'):
+        stop = threading.Event()
+        writer = threading.Thread(target=keep_writing, args=(stop, user_ids)) if load == 'writing' else None
+        if writer:
+            writer.start()
+        try:
+            for concurrency in (int(level) for level in args.concurrency.split(',') if level.strip()):
+                for variant, fn in (('sequential', sequential), ('pool_gather', gathered)):
+                    row = asyncio.run(run_case(fn, bookings, args.iterations, concurrency, rng))
+                    row.update(load=load, concurrency=concurrency, variant=variant)
+                    results.append(row)
+        finally:
+            stop.set()
+            if writer:
+                writer.join()
+
+    print(f"bookings={args.bookings} pool_size={bot.DB_READ_POOL_SIZE}")
+    print_table(results, ['load', 'concurrency', 'variant', 'n', 'p50', 'p95', 'p99', 'ops_per_sec'])
+
+if __name__ == '__main__':
+    main()
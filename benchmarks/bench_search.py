@@ -0,0 +1,96 @@
+"""Compare admin search through the FTS5 indexes with a plain LIKE scan.
+
+Seeds doctomed.db in a scratch directory with bookings and support requests,
+then times one search page (SEARCH_PAGE_SIZE + 1 rows) for random patient-name
+and support-message terms, using bot.search_bookings/search_support_requests
+and the equivalent LIKE '%term%' queries.
+
+    python benchmarks/bench_search.py --bookings 300000 --support 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from common import print_table, seed_database, summarize, timed
+
+import bot
+
+WORDS = ['appointment', 'invoice', 'cancel', 'reschedule', 'prescription', 'insurance', 'results', 'doctor',
+         'payment', 'refund', 'allergy', 'vaccine', 'referral', 'urgent', 'language', 'address']
+SURNAMES = ['Müller', 'Meier', 'Schmid', 'Keller', 'Weber', 'Huber', 'Schneider', 'Rossi', 'Bianchi', 'Dubois',
+            'Martin', 'Bernard', 'Fischer', 'Brunner', 'Baumann', 'Frei', 'Zimmermann', 'Moser', 'Widmer', 'Wyss']
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FTS5 admin search against LIKE scans.')
+    parser.add_argument('--bookings', type=int, default=200000)
+    parser.add_argument('--support', type=int, default=50000, help='number of support requests to seed')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--optimize', action='store_true', help="merge the FTS segments before timing")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='doctomed-search-'))
+    seed_database(doctors=20, users=1000, bookings=args.bookings, days=14, seed=args.seed)
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect('doctomed.db')
+    c = conn.cursor()
+    # Give the seeded patients realistic surnames so name searches have selective hits
+    c.execute('SELECT id FROM bookings')
+    c.executemany('UPDATE bookings SET patient_name = ? WHERE id = ?',
+                  [(f"{rng.choice(['Anna', 'Luca', 'Marie', 'Jonas', 'Elena', 'Noah'])} {rng.choice(SURNAMES)}", row[0])
+                   for row in c.fetchall()])
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    c.executemany('INSERT INTO support_requests (user_id, message, timestamp, status) VALUES (?, ?, ?, ?)',
+                  [(100000 + i % 1000, ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))), timestamp, 'open')
+                   for i in range(args.support)])
+    conn.commit()
+    if args.optimize:
+        c.execute("INSERT INTO bookings_fts (bookings_fts) VALUES ('optimize')")
+        c.execute("INSERT INTO support_requests_fts (support_requests_fts) VALUES ('optimize')")
+        conn.commit()
+    limit = bot.SEARCH_PAGE_SIZE + 1
+
+    def fts_names():
+        bot.search_bookings(rng.choice(SURNAMES), limit)
+
+    def like_names():
+        c.execute('''SELECT id, patient_name, booking_date, time_slot, status FROM bookings
+                     WHERE patient_name LIKE ? LIMIT ?''', (f'%{rng.choice(SURNAMES)}%', limit)).fetchall()
+
+    def fts_support():
+        bot.search_support_requests(f'{rng.choice(WORDS)} {rng.choice(WORDS)}', limit)
+
+    def like_support():
+        c.execute('''SELECT id, user_id, message, timestamp, status FROM support_requests
+                     WHERE message LIKE ? AND message LIKE ? LIMIT ?''',
+                  (f'%{rng.choice(WORDS)}%', f'%{rng.choice(WORDS)}%', limit)).fetchall()
+
+    def fts_miss():
+        bot.search_bookings('Nonexistentname', limit)
+
+    def like_miss():
+        c.execute('SELECT id FROM bookings WHERE patient_name LIKE ? LIMIT ?', ('%Nonexistentname%', limit)).fetchall()
+
+    cases = [
+        ('patient_name', 'fts5', fts_names),
+        ('patient_name', 'like', like_names),
+        ('support_message', 'fts5', fts_support),
+        ('support_message', 'like', like_support),
+        ('no_match', 'fts5', fts_miss),
+        ('no_match', 'like', like_miss),
+    ]
+    results = []
+    for name, variant, fn in cases:
+        row = summarize(timed(fn, args.iterations))
+        row.update(case=name, variant=variant)
+        results.append(row)
+    conn.close()
+
+    print(f"bookings={args.bookings} support_requests={args.support}")
+    print_table(results, ['case', 'variant', 'n', 'p50', 'p95', 'p99', 'ops_per_sec'])
+
+if __name__ == '__main__':
+    main()
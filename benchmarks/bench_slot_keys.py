@@ -0,0 +1,135 @@
+"""Compare TEXT (booking_date, time_slot) matching with integer slot keys.
+
+Seeds doctomed.db in a scratch directory and times the calendar availability
+query, the point lookup used before inserting a booking and the day-name
+rendering in show_calendar, each in the old TEXT form and the slot_key form.
+Both forms run on equivalent (doctor_id, ...) indexes; availability is also
+timed on TEXT columns in the slot_key query's NOT EXISTS shape.
+
+    python benchmarks/bench_slot_keys.py --doctors 50 --bookings 200000 --days 60
+"""
+import argparse
+import calendar
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import date, datetime, timedelta
+
+from common import print_table, seed_database, summarize, timed
+
+import bot
+
+TEXT_AVAILABILITY = '''SELECT ds.booking_date, ds.time_slot, d.name
+                       FROM doctor_slots ds
+                       JOIN doctors d ON ds.doctor_id = d.user_id
+                       WHERE ds.is_available = 1 AND ds.doctor_id = ?
+                       AND ds.booking_date >= ? AND ds.booking_date <= ?
+                       AND (ds.booking_date, ds.time_slot) NOT IN (
+                           SELECT booking_date, time_slot FROM bookings WHERE confirmed = 1 AND doctor_id = ?
+                       )
+                       ORDER BY ds.booking_date, ds.time_slot'''
+
+# The slot_key query's shape on the TEXT columns, so the column type is compared on its own
+TEXT_EXISTS_AVAILABILITY = '''SELECT ds.booking_date, ds.time_slot, d.name
+                              FROM doctor_slots ds
+                              JOIN doctors d ON ds.doctor_id = d.user_id
+                              WHERE ds.doctor_id = ? AND ds.booking_date >= ? AND ds.booking_date <= ?
+                              AND ds.is_available = 1
+                              AND NOT EXISTS (
+                                  SELECT 1 FROM bookings b
+                                  WHERE b.doctor_id = ds.doctor_id AND b.booking_date = ds.booking_date
+                                  AND b.time_slot = ds.time_slot AND b.confirmed = 1
+                              )
+                              ORDER BY ds.booking_date, ds.time_slot'''
+
+KEY_AVAILABILITY = '''SELECT ds.booking_date, ds.time_slot, d.name, ds.slot_key
+                      FROM doctor_slots ds
+                      JOIN doctors d ON ds.doctor_id = d.user_id
+                      WHERE ds.doctor_id = ? AND ds.slot_key >= ? AND ds.slot_key < ?
+                      AND ds.is_available = 1
+                      AND NOT EXISTS (
+                          SELECT 1 FROM bookings b
+                          WHERE b.doctor_id = ds.doctor_id AND b.slot_key = ds.slot_key AND b.confirmed = 1
+                      )
+                      ORDER BY ds.slot_key'''
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TEXT date/time matching against integer slot keys.')
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--bookings', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=30, help='days of slots to seed')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='doctomed-slotkeys-'))
+    doctor_ids, _ = seed_database(doctors=args.doctors, users=500, bookings=args.bookings, days=args.days, seed=args.seed)
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect('doctomed.db')
+    c = conn.cursor()
+    c.execute('UPDATE bookings SET confirmed = 1')
+    # The bot dropped its booking_date indexes along with the TEXT matching; give the TEXT queries the
+    # equivalent of the slot_key indexes so the comparison measures the column type, not a missing index
+    c.execute('CREATE INDEX idx_bench_doctor_slots_doctor_date ON doctor_slots (doctor_id, booking_date, time_slot)')
+    c.execute('CREATE INDEX idx_bench_bookings_doctor_date ON bookings (doctor_id, booking_date, time_slot)')
+    c.execute('ANALYZE')
+    conn.commit()
+
+    today = date.today()
+    start_text, end_text = today.strftime('%Y-%m-%d'), (today + timedelta(days=7)).strftime('%Y-%m-%d')
+    start_key, end_key = bot.day_slot_key(today), bot.day_slot_key(today + timedelta(days=8))
+    c.execute('SELECT booking_date, time_slot, doctor_id, slot_key FROM doctor_slots')
+    slot_rows = c.fetchall()
+
+    def text_availability():
+        doctor_id = rng.choice(doctor_ids)
+        c.execute(TEXT_AVAILABILITY, (doctor_id, start_text, end_text, doctor_id)).fetchall()
+
+    def text_exists_availability():
+        c.execute(TEXT_EXISTS_AVAILABILITY, (rng.choice(doctor_ids), start_text, end_text)).fetchall()
+
+    def key_availability():
+        c.execute(KEY_AVAILABILITY, (rng.choice(doctor_ids), start_key, end_key)).fetchall()
+
+    def text_lookup():
+        booking_date, time_slot, doctor_id, _ = rng.choice(slot_rows)
+        c.execute('SELECT is_available FROM doctor_slots WHERE booking_date = ? AND time_slot = ? AND doctor_id = ?',
+                  (booking_date, time_slot, doctor_id)).fetchone()
+
+    def key_lookup():
+        _, _, doctor_id, slot_key = rng.choice(slot_rows)
+        c.execute('SELECT is_available FROM doctor_slots WHERE doctor_id = ? AND slot_key = ?',
+                  (doctor_id, slot_key)).fetchone()
+
+    sample = slot_rows[:500]
+
+    def text_day_names():
+        for booking_date, _, _, _ in sample:
+            calendar.day_name[datetime.strptime(booking_date, '%Y-%m-%d').weekday()]
+
+    def key_day_names():
+        for _, _, _, slot_key in sample:
+            calendar.day_name[bot.from_slot_key(slot_key).weekday()]
+
+    cases = [
+        ('availability', 'text', text_availability),
+        ('availability', 'text_exists', text_exists_availability),
+        ('availability', 'slot_key', key_availability),
+        ('slot_lookup', 'text', text_lookup),
+        ('slot_lookup', 'slot_key', key_lookup),
+        ('day_names_x500', 'text', text_day_names),
+        ('day_names_x500', 'slot_key', key_day_names),
+    ]
+    results = []
+    for name, variant, fn in cases:
+        row = summarize(timed(fn, args.iterations))
+        row.update(case=name, variant=variant)
+        results.append(row)
+    conn.close()
+
+    print(f"doctors={args.doctors} bookings={args.bookings} slots={len(slot_rows)}")
+    print_table(results, ['case', 'variant', 'n', 'p50', 'p95', 'p99', 'ops_per_sec'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Compare the SQLite and in-memory storage backends method by method.
+
+Seeds doctomed.db in a scratch directory, loads the same data into
+bot.MemoryStorage and times the reads and writes handlers make most often
+against both backends, so the cost of the SQLite layer (connection, query,
+row decoding, the writer's commit) shows up directly next to a plain dict
+lookup. SQLite writes go through the started writer, one at a time.
+
+    python benchmarks/bench_storage.py --bookings 100000 --iterations 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+from common import print_table, seed_database, summarize, timed
+
+import bot
+
+async def time_writes(fn, storage, iterations):
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await fn(storage)
+        durations.append(time.perf_counter() - started)
+    return durations
+
+async def run_writes(cases, backends, iterations):
+    await bot.db_writer.start()
+    try:
+        results = []
+        for name, fn in cases:
+            for backend, storage in backends.items():
+                row = summarize(await time_writes(fn, storage, iterations))
+                row.update(case=name, backend=backend)
+                results.append(row)
+        return results
+    finally:
+        await bot.db_writer.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SQLiteStorage against MemoryStorage.')
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--bookings', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=14, help='days of doctor slots to seed')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='doctomed-storage-'))
+    doctor_ids, user_ids = seed_database(doctors=args.doctors, users=args.users, bookings=args.bookings,
+                                         days=args.days, seed=args.seed)
+    started = time.perf_counter()
+    backends = {'sqlite': bot.SQLiteStorage(), 'memory': bot.MemoryStorage.load('doctomed.db')}
+    load_ms = (time.perf_counter() - started) * 1000
+    rng = random.Random(args.seed)
+    start_key, end_key = bot.day_slot_key(date.today()), bot.day_slot_key(bot.horizon_end())
+
+    cases = [
+        ('get_user_language', lambda storage: storage.get_user_language(rng.choice(user_ids))),
+        ('is_admin', lambda storage: storage.is_admin(rng.choice(user_ids))),
+        ('get_booking', lambda storage: storage.get_booking(rng.randint(1, args.bookings))),
+        ('get_doctor', lambda storage: storage.get_doctor(rng.choice(doctor_ids))),
+        ('get_user_bookings', lambda storage: storage.get_user_bookings(rng.choice(user_ids))),
+        ('get_pending_bookings', lambda storage: storage.get_pending_bookings(rng.choice(doctor_ids), bot.PENDING_QUEUE_SIZE)),
+        ('open_slots_one_doctor', lambda storage: storage.get_open_slots([rng.choice(doctor_ids)], start_key, end_key)),
+        ('open_slots_all_doctors', lambda storage: storage.get_open_slots(None, start_key, end_key)),
+        ('search_bookings', lambda storage: storage.search_bookings(f'patient {rng.randint(1, 999)}', bot.SEARCH_PAGE_SIZE + 1, 0)),
+    ]
+    results = []
+    for name, fn in cases:
+        for backend, storage in backends.items():
+            row = summarize(timed(lambda: fn(storage), args.iterations))
+            row.update(case=name, backend=backend)
+            results.append(row)
+
+    # Pending requests leave their slots open, so every iteration can book a random one
+    open_slots = backends['sqlite'].get_open_slots(None, start_key, end_key)
+
+    def create_booking(storage):
+        slot_key, doctor_id, _ = rng.choice(open_slots)
+        return storage.create_booking(rng.choice(user_ids), 'Benchmark Patient', '1980-01-01', doctor_id, slot_key, None,
+                                      lambda booking_id: [])
+
+    write_cases = [
+        ('set_user_language', lambda storage: storage.set_user_language(rng.choice(user_ids), rng.choice(list(bot.LANGUAGES)))),
+        ('add_support_request', lambda storage: storage.add_support_request(rng.choice(user_ids), 'Benchmark request')),
+        ('create_booking', create_booking),
+    ]
+    results.extend(asyncio.run(run_writes(write_cases, backends, args.iterations)))
+
+    print(f"doctors={args.doctors} users={args.users} bookings={args.bookings} memory_load_ms={load_ms:.0f}")
+    print_table(results, ['case', 'backend', 'n', 'p50', 'p95', 'p99', 'ops_per_sec'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Write throughput of the group-commit DbWriter against one connection per write.
+
+Seeds doctomed.db in a scratch directory, then runs a mix of support-request
+inserts and language updates from N concurrent tasks in three modes:
+inline (a connection and commit per write on the event loop, as before),
+threads (the same on worker threads, contending for the WAL lock) and
+writer (bot.db_writer, one transaction per batch of queued writes).
+
+    python benchmarks/bench_writer.py --concurrency 1,8,64,256 --writes 4000
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from common import print_table, seed_database, summarize
+
+import bot
+
+MODES = ['inline', 'threads', 'writer']
+LANGUAGE_CODES = list(bot.LANGUAGES)
+
+def write_alone(operation, args):
+    conn = sqlite3.connect('doctomed.db', timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    try:
+        operation(conn.cursor(), *args)
+        conn.commit()
+    finally:
+        conn.close()
+
+def workload(user_ids, i):
+    user_id = user_ids[i % len(user_ids)]
+    if i % 2:
+        return bot.store_user_language, (user_id, LANGUAGE_CODES[i % len(LANGUAGE_CODES)])
+    return bot.write_support_request, (user_id, f'Benchmark support request {i}')
+
+async def run_mode(mode, concurrency, writes, user_ids):
+    durations = []
+    counter = iter(range(writes))
+
+    async def submit(operation, args):
+        if mode == 'inline':
+            write_alone(operation, args)
+        elif mode == 'threads':
+            await asyncio.to_thread(write_alone, operation, args)
+        else:
+            await bot.db_writer.submit(operation, *args)
+
+    async def worker():
+        for i in counter:
+            operation, args = workload(user_ids, i)
+            started = time.perf_counter()
+            await submit(operation, args)
+            durations.append(time.perf_counter() - started)
+
+    if mode == 'writer':
+        bot.db_writer = bot.DbWriter(max_batch=bot.DB_WRITER_MAX_BATCH)
+        await bot.db_writer.start()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_time = time.perf_counter() - wall_start
+    commits = writes
+    if mode == 'writer':
+        commits = bot.db_writer.counters['commits']
+        await bot.db_writer.stop()
+    result = summarize(durations, wall_time)
+    result.update(mode=mode, concurrency=concurrency, writes_per_commit=writes / commits if commits else 0.0)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark group-committed writes against per-write commits.')
+    parser.add_argument('--concurrency', default='1,8,64,256', help='comma-separated numbers of concurrent writers')
+    parser.add_argument('--writes', type=int, default=4000, help='writes per mode and concurrency level')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'comma-separated subset of {",".join(MODES)}')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(unknown)}")
+
+    os.chdir(tempfile.mkdtemp(prefix='doctomed-writer-'))
+    _, user_ids = seed_database(doctors=10, users=1000, bookings=10000, days=7, seed=args.seed)
+    results = []
+    for concurrency in levels:
+        for mode in modes:
+            results.append(asyncio.run(run_mode(mode, concurrency, args.writes, user_ids)))
+
+    print(f"writes={args.writes} per run")
+    print_table(results, ['mode', 'concurrency', 'n', 'p50', 'p95', 'p99', 'ops_per_sec', 'writes_per_commit'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from http import HTTPStatus
+
+from telegram.request import BaseRequest
+
+# Make bot.py importable when running scripts from the benchmarks directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+FAKE_TOKEN = '123456:BENCHMARK-TOKEN'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Doctomed', 'username': 'doctomed_bench_bot'}
+
+# Request backend that answers every Bot API call locally and records it
+class RecordingRequest(BaseRequest):
+    def __init__(self):
+        self.calls = []
+        self.last_markup = {}
+        self.messages = {}
+        self._message_id = 1000
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def reset(self):
+        self.calls.clear()
+
+    @property
+    def bytes_sent(self):
+        return sum(call[2] for call in self.calls)
+
+    # Sent messages are kept per chat so edits return the full message, as Telegram does
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 0))
+        message_id = int(params.get('message_id', self._message_id))
+        message = dict(self.messages.get((chat_id, message_id)) or {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        })
+        if 'text' in params or 'message_id' not in params:
+            message['text'] = params.get('text', '')
+        message.pop('reply_markup', None)
+        if 'reply_markup' in params:
+            markup = json.loads(params['reply_markup'])
+            message['reply_markup'] = markup
+            self.last_markup[chat_id] = markup
+        self.messages[(chat_id, message_id)] = message
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.json_parameters if request_data else {}
+        payload = request_data.json_payload if request_data else b''
+        self.calls.append((endpoint, params, len(payload)))
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            result = self._message(params)
+        elif endpoint == 'getUpdates':
+            result = []
+        else:
+            result = True
+        return HTTPStatus.OK, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    # Callback data of every inline button last sent to a chat
+    def buttons(self, chat_id):
+        markup = self.last_markup.get(chat_id, {})
+        return [button.get('callback_data') for row in markup.get('inline_keyboard', []) for button in row]
+
+    # The newest message in a chat that carries a button with this callback data, as the user would tap it
+    def message_with_button(self, chat_id, data):
+        for (message_chat_id, _), message in reversed(self.messages.items()):
+            rows = message.get('reply_markup', {}).get('inline_keyboard', [])
+            if message_chat_id == chat_id and any(button.get('callback_data') == data for row in rows for button in row):
+                return message
+        return None
+
+# Builds synthetic Update payloads the way Telegram would deliver them
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def message_data(self, user_id, text):
+        update_id, message_id = self._next_ids()
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback_data(self, user_id, data, message=None):
+        update_id, message_id = self._next_ids()
+        update = {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self.user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': BOT_USER,
+                    'text': 'menu',
+                },
+            },
+        }
+        if message:
+            update['callback_query']['message'] = message
+        return update
+
+    def message(self, user_id, text):
+        from telegram import Update
+        return Update.de_json(self.message_data(user_id, text), self.bot)
+
+    def callback(self, user_id, data, message=None):
+        from telegram import Update
+        return Update.de_json(self.callback_data(user_id, data, message), self.bot)
+
+# Fill doctomed.db in the current directory with synthetic data
+def seed_database(doctors=10, users=200, bookings=2000, days=7, admin_id=1, seed=42):
+    import bot
+
+    rng = random.Random(seed)
+    bot.init_db()
+    conn = sqlite3.connect('doctomed.db', timeout=10)
+    try:
+        c = conn.cursor()
+        c.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (admin_id,))
+        doctor_ids = [900000 + i for i in range(doctors)]
+        c.executemany('INSERT OR IGNORE INTO doctors (user_id, name) VALUES (?, ?)',
+                      [(doctor_id, f'Dr. Bench {i}') for i, doctor_id in enumerate(doctor_ids)])
+        user_ids = [100000 + i for i in range(users)]
+        c.executemany('INSERT OR IGNORE INTO users (user_id, is_caregiver, linked_patient, language) VALUES (?, ?, ?, ?)',
+                      [(user_id, 0, None, rng.choice(list(bot.LANGUAGES))) for user_id in user_ids])
+        c.executemany('INSERT OR IGNORE INTO users (user_id, is_caregiver, linked_patient, language) VALUES (?, ?, ?, ?)',
+                      [(doctor_id, 0, None, 'en') for doctor_id in doctor_ids])
+        today = date.today()
+        slots = []
+        for doctor_id in doctor_ids:
+            for offset in range(days + 1):
+                booking_date = (today + timedelta(days=offset)).strftime('%Y-%m-%d')
+                for time_slot in bot.TIME_SLOTS:
+                    slots.append((booking_date, time_slot, doctor_id, 1, bot.to_slot_key(booking_date, time_slot)))
+        c.executemany('INSERT INTO doctor_slots (booking_date, time_slot, doctor_id, is_available, slot_key) VALUES (?, ?, ?, ?, ?)', slots)
+        rows = []
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for i in range(bookings):
+            booking_date = (today + timedelta(days=rng.randint(-90, days))).strftime('%Y-%m-%d')
+            status, confirmed = rng.choice([('approved', 1), ('pending', 0), ('cancelled', 0), ('rejected', 0)])
+            time_slot = rng.choice(bot.TIME_SLOTS)
+            rows.append((rng.choice(user_ids), f'Patient {i}', '1980-01-01', time_slot, booking_date,
+                         rng.choice(doctor_ids), status, confirmed, created_at, bot.to_slot_key(booking_date, time_slot)))
+        c.executemany('INSERT INTO bookings (user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, confirmed, created_at, slot_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      rows)
+        # The bot saves a profile with every booking request, so seeded users are returning patients
+        c.executemany('INSERT OR IGNORE INTO patient_profiles (user_id, patient_name, patient_dob, last_used) VALUES (?, ?, ?, ?)',
+                      [(row[0], row[1], row[2], created_at) for row in rows])
+        conn.commit()
+        return doctor_ids, user_ids
+    finally:
+        conn.close()
+
+# Durations in seconds of `iterations` back-to-back calls of fn
+def timed(fn, iterations):
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+# Latency summary in milliseconds plus throughput for a list of durations in seconds
+def summarize(durations, wall_time=None):
+    if not durations:
+        return {'n': 0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'ops_per_sec': 0.0}
+    ms = sorted(d * 1000 for d in durations)
+    if len(ms) > 1:
+        cuts = statistics.quantiles(ms, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ms[0]
+    total = wall_time if wall_time is not None else sum(durations)
+    return {
+        'n': len(ms),
+        'p50': p50,
+        'p95': p95,
+        'p99': p99,
+        'ops_per_sec': len(ms) / total if total else 0.0,
+    }
+
+def print_table(rows, columns):
+    widths = {col: max(len(col), *(len(f"{row[col]:.2f}" if isinstance(row[col], float) else str(row[col])) for row in rows)) for col in columns}
+    print('  '.join(col.ljust(widths[col]) for col in columns))
+    for row in rows:
+        cells = []
+        for col in columns:
+            value = row[col]
+            text = f"{value:.2f}" if isinstance(value, float) else str(value)
+            cells.append(text.ljust(widths[col]))
+        print('  '.join(cells))
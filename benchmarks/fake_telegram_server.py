@@ -0,0 +1,308 @@
+"""Local stand-in for api.telegram.org used by the end-to-end load tests.
+
+Serves getUpdates (long polling) and setWebhook from a scripted update stream,
+accepts sendMessage and the other methods the bot calls, and can inject
+latency and 429 "Too Many Requests" answers with retry_after.
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:8081, or run it
+standalone with a JSONL file of updates:
+
+    python benchmarks/fake_telegram_server.py --port 8081 --script updates.jsonl --chat-rate 1
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlsplit
+
+from common import BOT_USER
+
+INT_PARAMS = ('chat_id', 'offset', 'limit', 'timeout', 'message_id', 'retry_after')
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict', 429: 'Too Many Requests'}
+
+# Token bucket used to decide when the fake API answers 429
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return math.ceil((1 - self.tokens) / self.rate)
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, chat_rate=0.0,
+                 global_rate=0.0, error_rate=0.0, retry_after=1, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.webhook_url = None
+        self.listeners = []
+        self.stats = defaultdict(int)
+        self.max_backlog = 0
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_updates = asyncio.Event()
+        self._chat_buckets = {}
+        self._global_bucket = TokenBucket(global_rate) if global_rate else None
+        self._server = None
+        self._webhook_task = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def backlog(self):
+        return len(self._updates)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._webhook_task:
+            self._webhook_task.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # Queue an update for getUpdates/webhook delivery and return its update_id
+    def push_update(self, update):
+        update = dict(update)
+        if 'update_id' not in update:
+            update['update_id'] = self._next_update_id
+        self._next_update_id = max(self._next_update_id, update['update_id']) + 1
+        self._updates.append(update)
+        self.stats['updates_pushed'] += 1
+        self.max_backlog = max(self.max_backlog, len(self._updates))
+        self._new_updates.set()
+        return update['update_id']
+
+    # Listeners are called with (method, params, result) for every successful send/edit
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _message(self, params):
+        message_id = params.get('message_id')
+        if message_id is None:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        if params.get('reply_markup'):
+            markup = params['reply_markup']
+            message['reply_markup'] = json.loads(markup) if isinstance(markup, str) else markup
+        return message
+
+    def _throttle(self, chat_id):
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return self.retry_after
+        if self._global_bucket:
+            wait = self._global_bucket.take()
+            if wait:
+                return wait
+        if self.chat_rate and chat_id is not None:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+            wait = bucket.take()
+            if wait:
+                return wait
+        return 0
+
+    async def _get_updates(self, params):
+        if self.webhook_url:
+            return 409, {'ok': False, 'error_code': 409,
+                         'description': "Conflict: can't use getUpdates method while webhook is active"}
+        offset = params.get('offset') or 0
+        limit = params.get('limit') or 100
+        timeout = params.get('timeout') or 0
+        if offset:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self._updates[:limit]
+        self.stats['updates_delivered'] += len(batch)
+        return 200, {'ok': True, 'result': batch}
+
+    async def _dispatch(self, method, params):
+        self.stats[f'calls.{method}'] += 1
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method in ('setWebhook', 'deleteWebhook'):
+            self.webhook_url = params.get('url') or None if method == 'setWebhook' else None
+            if params.get('drop_pending_updates') in (True, 'true', 'True'):
+                self._updates.clear()
+            if self.webhook_url and not self._webhook_task:
+                self._webhook_task = asyncio.create_task(self._push_to_webhook())
+            return 200, {'ok': True, 'result': True}
+        if method == 'getWebhookInfo':
+            return 200, {'ok': True, 'result': {'url': self.webhook_url or '', 'has_custom_certificate': False,
+                                                'pending_update_count': len(self._updates)}}
+
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            wait = self._throttle(params.get('chat_id'))
+            if wait:
+                self.stats['rate_limited'] += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {wait}',
+                             'parameters': {'retry_after': wait}}
+            result = self._message(params)
+            self.stats['messages_sent'] += 1
+            for listener in self.listeners:
+                listener(method, params, result)
+            return 200, {'ok': True, 'result': result}
+        return 200, {'ok': True, 'result': True}
+
+    async def _push_to_webhook(self):
+        while self.webhook_url:
+            if not self._updates:
+                self._new_updates.clear()
+                await self._new_updates.wait()
+                continue
+            update = self._updates[0]
+            target = urlsplit(self.webhook_url)
+            body = json.dumps(update).encode('utf-8')
+            try:
+                reader, writer = await asyncio.open_connection(target.hostname, target.port or 80)
+                writer.write((f"POST {target.path or '/'} HTTP/1.1\r\nHost: {target.netloc}\r\n"
+                              f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                              f"Connection: close\r\n\r\n").encode('latin-1') + body)
+                await writer.drain()
+                status_line = await reader.readline()
+                writer.close()
+                if b' 200 ' in status_line:
+                    self._updates.pop(0)
+                    self.stats['updates_delivered'] += 1
+                    continue
+            except OSError:
+                pass
+            self.stats['webhook_failures'] += 1
+            await asyncio.sleep(1)
+
+    @staticmethod
+    def _parse_params(headers, body, query):
+        params = dict(parse_qsl(query))
+        content_type = headers.get('content-type', '')
+        if body and 'application/json' in content_type:
+            params.update(json.loads(body))
+        elif body:
+            params.update(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+        for key in INT_PARAMS:
+            if isinstance(params.get(key), str):
+                try:
+                    params[key] = int(params[key])
+                except ValueError:
+                    pass
+        return params
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+
+                url = urlsplit(target)
+                path = url.path.strip('/')
+                if path == 'stats':
+                    status, payload = 200, {**self.stats, 'backlog': self.backlog, 'max_backlog': self.max_backlog}
+                elif path.startswith('bot') and '/' in path:
+                    method = path.split('/', 1)[1]
+                    if 'multipart/form-data' in headers.get('content-type', ''):
+                        status, payload = 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: file uploads are not supported'}
+                    else:
+                        status, payload = await self._dispatch(method, self._parse_params(headers, body, url.query))
+                else:
+                    status, payload = 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+                data = json.dumps(payload).encode('utf-8')
+                writer.write((f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}\r\nContent-Type: application/json\r\n"
+                              f"Content-Length: {len(data)}\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(args):
+    server = FakeTelegramServer(host=args.host, port=args.port, latency=args.latency_ms / 1000,
+                                jitter=args.jitter_ms / 1000, chat_rate=args.chat_rate,
+                                global_rate=args.global_rate, error_rate=args.error_rate, seed=args.seed)
+    await server.start()
+    print(f"Fake Telegram Bot API listening on {server.url} (stats at {server.url}/stats)")
+    if args.script:
+        with open(args.script, encoding='utf-8') as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+        for update in updates:
+            server.push_update(update)
+            if args.script_rate:
+                await asyncio.sleep(1 / args.script_rate)
+        print(f"Queued {len(updates)} scripted updates")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake Telegram Bot API server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--script', help='JSONL file with one Update per line to serve')
+    parser.add_argument('--script-rate', type=float, default=0.0, help='updates/s to release the script at (0 = all at once)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added latency for every non-polling call')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='random extra latency up to this value')
+    parser.add_argument('--chat-rate', type=float, default=0.0, help='messages/s allowed per chat before 429 (0 = unlimited)')
+    parser.add_argument('--global-rate', type=float, default=0.0, help='messages/s allowed overall before 429 (0 = unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a random 429 on any send')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""End-to-end load test: runs bot.py's main() against the fake Bot API server.
+
+Seeds doctomed.db in a scratch directory, starts FakeTelegramServer in this
+process and bot.py as a subprocess pointed at it via TELEGRAM_API_URL, then
+lets virtual users walk through the booking flow by tapping the buttons the
+bot actually sent them. Reports per-step latency, end-to-end throughput,
+backlog of undelivered updates and how many 429s the bot had to absorb.
+
+    python benchmarks/load_test.py --users 2000 --ramp 20 --chat-rate 1 --latency-ms 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from common import FAKE_TOKEN, ROOT_DIR, UpdateFactory, print_table, seed_database, summarize
+from fake_telegram_server import FakeTelegramServer
+
+import bot
+
+STEPS = ['start', 'book', 'doctor', 'browse', 'slot', 'name', 'dob', 'profile']
+NAME_PROMPTS = {bot.get_message(key, lang) for key in ('patient_name_prompt', 'patient_profile_prompt') for lang in bot.LANGUAGES}
+SLOT_ATTEMPTS = 3
+
+class StepTimeout(Exception):
+    pass
+
+class LoadDriver:
+    def __init__(self, server, timeout, rng):
+        self.server = server
+        self.timeout = timeout
+        self.rng = rng
+        self.updates = UpdateFactory(bot=None)
+        self.inboxes = defaultdict(asyncio.Queue)
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        self.outcomes = defaultdict(int)
+        server.add_listener(self._on_send)
+
+    def _on_send(self, method, params, message):
+        chat_id = params.get('chat_id')
+        if chat_id in self.inboxes:
+            self.inboxes[chat_id].put_nowait(message)
+
+    async def _step(self, name, user_id, update, wants_keyboard=False, accept=None):
+        inbox = self.inboxes[user_id]
+        while not inbox.empty():
+            inbox.get_nowait()
+        started = time.perf_counter()
+        self.server.push_update(update)
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self.timeouts[name] += 1
+                raise StepTimeout(name)
+            try:
+                message = await asyncio.wait_for(inbox.get(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if accept is not None and not accept(message):
+                continue
+            if not wants_keyboard or message.get('reply_markup'):
+                self.latencies[name].append(time.perf_counter() - started)
+                return message
+
+    @staticmethod
+    def _buttons(message):
+        rows = (message.get('reply_markup') or {}).get('inline_keyboard', [])
+        return [button['callback_data'] for row in rows for button in row if button.get('callback_data')]
+
+    def _tap(self, user_id, message, data):
+        update = self.updates.callback_data(user_id, data)
+        update['callback_query']['message'] = message
+        return update
+
+    async def virtual_user(self, user_id):
+        self.inboxes[user_id]
+        try:
+            menu = await self._step('start', user_id, self.updates.message_data(user_id, '/start'), wants_keyboard=True)
+            if any(data.startswith('lang_') for data in self._buttons(menu)):
+                menu = await self._step('start', user_id, self._tap(user_id, menu, 'lang_en'), wants_keyboard=True)
+            doctors = await self._step('book', user_id, self._tap(user_id, menu, 'book'), wants_keyboard=True)
+            doctor_buttons = [data for data in self._buttons(doctors) if data.startswith('doctor_')]
+            if not doctor_buttons:
+                self.outcomes['no_doctors'] += 1
+                return
+            calendar = await self._step('doctor', user_id, self._tap(user_id, doctors, self.rng.choice(doctor_buttons)))
+            # Page forward, back, forward and back again on the same edited message: the repeated taps are
+            # navigation, not double taps, so each one has to get its page back
+            for _ in range(2):
+                for direction in (-1, 0):
+                    pages = [data for data in self._buttons(calendar) if data.startswith('cal:')]
+                    if not pages:
+                        break
+                    calendar = await self._step('browse', user_id, self._tap(user_id, calendar, pages[direction]))
+            slot_buttons = [data for data in self._buttons(calendar) if data.startswith('s:')]
+            if not slot_buttons:
+                self.outcomes['no_slots'] += 1
+                return
+            # A slot held by another patient re-sends the calendar, so pick again
+            for _ in range(SLOT_ATTEMPTS):
+                reply = await self._step('slot', user_id, self._tap(user_id, calendar, self.rng.choice(slot_buttons)),
+                                         accept=lambda m: m.get('text') in NAME_PROMPTS or self._buttons(m))
+                if reply.get('text') in NAME_PROMPTS:
+                    break
+                calendar = reply
+                slot_buttons = [data for data in self._buttons(calendar) if data.startswith('s:')]
+                if not slot_buttons:
+                    self.outcomes['no_slots'] += 1
+                    return
+            else:
+                self.outcomes['slot_held'] += 1
+                return
+            # Returning patients tap a saved profile; everyone else types the name and date of birth
+            profiles = [data for data in self._buttons(reply) if data.startswith('pp:') and data != 'pp:l']
+            if profiles:
+                await self._step('profile', user_id, self._tap(user_id, reply, profiles[0]))
+            else:
+                await self._step('name', user_id, self.updates.message_data(user_id, f'Load Patient {user_id}'))
+                await self._step('dob', user_id, self.updates.message_data(user_id, '1980-01-01'))
+            self.outcomes['completed'] += 1
+        except StepTimeout as e:
+            self.outcomes[f'timeout_{e}'] += 1
+        finally:
+            self.inboxes.pop(user_id, None)
+
+async def wait_for_bot(server, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while server.stats['calls.getUpdates'] == 0:
+        if process.poll() is not None:
+            raise RuntimeError(f"bot.py exited with code {process.returncode} before polling")
+        if time.monotonic() > deadline:
+            raise RuntimeError('bot.py did not start polling in time')
+        await asyncio.sleep(0.1)
+
+async def run_load_test(args, workdir):
+    _, user_ids = seed_database(doctors=args.doctors, users=args.users, bookings=args.bookings, admin_id=1, seed=args.seed)
+    server = FakeTelegramServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, chat_rate=args.chat_rate,
+                                global_rate=args.global_rate, error_rate=args.error_rate, seed=args.seed)
+    await server.start()
+    env = dict(os.environ, TELEGRAM_BOT_TOKEN=FAKE_TOKEN, TELEGRAM_API_URL=server.url, ADMIN_IDS='1')
+    log = open(os.path.join(workdir, 'bot.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'bot.py')], cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    try:
+        await wait_for_bot(server, process)
+        driver = LoadDriver(server, args.timeout, random.Random(args.seed))
+        backlog_samples = []
+
+        async def sample_backlog():
+            while True:
+                backlog_samples.append(server.backlog)
+                await asyncio.sleep(0.25)
+
+        sampler = asyncio.create_task(sample_backlog())
+        started = time.perf_counter()
+        tasks = []
+        for i, user_id in enumerate(user_ids):
+            if args.ramp:
+                delay = started + args.ramp * i / len(user_ids) - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(driver.virtual_user(user_id)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        return driver, server, elapsed, backlog_samples
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            # Keep serving while the bot shuts down; it drains its outbound queue on the way out
+            await asyncio.to_thread(process.wait, 15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test of bot.py against a fake Bot API server.')
+    parser.add_argument('--users', type=int, default=500, help='number of virtual users')
+    parser.add_argument('--ramp', type=float, default=10.0, help='seconds over which virtual users start')
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for each bot reply')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--chat-rate', type=float, default=0.0, help='per-chat messages/s before the fake API answers 429')
+    parser.add_argument('--global-rate', type=float, default=0.0, help='overall messages/s before the fake API answers 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a random 429')
+    parser.add_argument('--workdir', help='directory for doctomed.db and bot.log (default: a fresh temp directory)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='doctomed-load-')
+    os.makedirs(workdir, exist_ok=True)
+    if os.path.exists(os.path.join(workdir, 'doctomed.db')):
+        parser.error(f"{workdir} already contains doctomed.db; use an empty directory")
+    os.chdir(workdir)
+
+    driver, server, elapsed, backlog_samples = asyncio.run(run_load_test(args, workdir))
+    steps = []
+    for step in STEPS:
+        row = summarize(driver.latencies[step], elapsed)
+        row['step'] = step
+        row['timeouts'] = driver.timeouts[step]
+        steps.append(row)
+    summary = {
+        'virtual_users': args.users,
+        'elapsed_s': elapsed,
+        'flows_per_sec': driver.outcomes['completed'] / elapsed if elapsed else 0.0,
+        'updates_per_sec': server.stats['updates_delivered'] / elapsed if elapsed else 0.0,
+        'outcomes': dict(driver.outcomes),
+        'messages_sent': server.stats['messages_sent'],
+        'rate_limited': server.stats['rate_limited'],
+        'max_backlog': server.max_backlog,
+        'avg_backlog': sum(backlog_samples) / len(backlog_samples) if backlog_samples else 0,
+        'workdir': workdir,
+    }
+    if args.json:
+        json.dump({'summary': summary, 'steps': steps}, sys.stdout, indent=2)
+        print()
+        return
+    for key, value in summary.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+    print()
+    print_table(steps, ['step', 'n', 'p50', 'p95', 'p99', 'ops_per_sec', 'timeouts'])
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,95 @@
 import sqlite3
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, ConversationHandler
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, ConversationHandler, TypeHandler, ApplicationHandlerStop, BasePersistence, PersistenceInput
 from telegram.ext.filters import Text, COMMAND
-from datetime import datetime, timedelta, date
+from telegram.error import BadRequest, RetryAfter, NetworkError
+from datetime import datetime, timedelta, date, time as dtime
 import logging
 from dotenv import load_dotenv
 import os
 import calendar
 import uuid
 import asyncio
+import secrets
+import time
+import random
+import json
+import re
+import unicodedata
+import heapq
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby, islice
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 # Load environment variables
 load_dotenv()
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_IDS = os.getenv('ADMIN_IDS', '').split(',')  # Comma-separated admin IDs from .env
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # Optional Bot API server, e.g. a local fake for load tests
+ARCHIVE_INTERVAL_HOURS = float(os.getenv('ARCHIVE_INTERVAL_HOURS', '24'))  # How often history is moved to the archive tables
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))  # Rows moved per archival transaction
+DB_VACUUM_ON_START = os.getenv('DB_VACUUM_ON_START', 'false').lower() in ('1', 'true', 'yes')  # One-time VACUUM at startup to switch an existing doctomed.db to incremental auto-vacuum
+PENDING_TTL_HOURS = float(os.getenv('PENDING_TTL_HOURS', '24'))  # Pending bookings older than this expire
+PENDING_SWEEP_INTERVAL_MINUTES = float(os.getenv('PENDING_SWEEP_INTERVAL_MINUTES', '10'))  # How often the sweeper runs
+PENDING_SWEEP_LIMIT = int(os.getenv('PENDING_SWEEP_LIMIT', '100'))  # Max bookings expired per sweep
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '25'))  # Messages per second across all chats (0 = unlimited)
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))  # Messages per second to a single chat (0 = unlimited)
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '4'))  # Concurrent outbound senders
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))  # Retries for network errors before giving up
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))  # Outbox rows claimed per relay pass
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', '5'))  # Relay poll interval when nobody wakes it
+OUTBOX_RETENTION_DAYS = float(os.getenv('OUTBOX_RETENTION_DAYS', '7'))  # Delivered outbox rows are purged after this
+DOCTOR_DIGEST_TIME = os.getenv('DOCTOR_DIGEST_TIME', '')  # Local HH:MM for the doctors' daily agenda; empty disables it
+BOT_TIMEZONE = os.getenv('BOT_TIMEZONE', '')  # IANA zone for scheduled local-time jobs (e.g. Europe/Zurich); empty uses /etc/localtime
+BOOKING_HORIZON_DAYS = int(os.getenv('BOOKING_HORIZON_DAYS', '7'))  # How many days after today patients can book
+CALENDAR_PAGE_DAYS = 7  # Days shown on one calendar page
+WAITLIST_OFFER_MINUTES = float(os.getenv('WAITLIST_OFFER_MINUTES', '15'))  # How long a freed slot is offered to a waitlisted patient
+SLOT_CACHE_SECONDS = float(os.getenv('SLOT_CACHE_SECONDS', '30'))  # Lifetime of cached and prefetched calendar pages
+PENDING_QUEUE_SIZE = int(os.getenv('PENDING_QUEUE_SIZE', '20'))  # Requests shown in a doctor's /pending queue
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '10'))  # Hits per section on one /search page
+PATIENT_PROFILE_LIMIT = int(os.getenv('PATIENT_PROFILE_LIMIT', '5'))  # Saved patients offered as buttons after a slot is chosen
+DOCTOR_DIGEST_ONLY = os.getenv('DOCTOR_DIGEST_ONLY', 'false').lower() in ('1', 'true', 'yes')  # Skip per-booking approval confirmations to doctors
+SLOT_HOLD_MINUTES = float(os.getenv('SLOT_HOLD_MINUTES', '10'))  # How long a selected slot is kept from other patients
+CALLBACK_TOKEN_TTL_MINUTES = float(os.getenv('CALLBACK_TOKEN_TTL_MINUTES', '30'))  # Lifetime of slot button tokens
+PERSISTENCE_INTERVAL_SECONDS = float(os.getenv('PERSISTENCE_INTERVAL_SECONDS', '10'))  # How often changed conversation state is written to doctomed.db
+CONVERSATION_IDLE_MINUTES = float(os.getenv('CONVERSATION_IDLE_MINUTES', '30'))  # Idle time after which a user's conversation and cached state are dropped
+CONVERSATION_STATE_IDLE_MINUTES = os.getenv('CONVERSATION_STATE_IDLE_MINUTES', 'SELECT_DOCTOR=15,PATIENT_NAME=15,PATIENT_DOB=15')  # Per-state overrides as STATE=minutes pairs
+IDLE_SWEEP_SECONDS = float(os.getenv('IDLE_SWEEP_SECONDS', '30'))  # Tick of the idle conversation sweeper
+DB_WRITER_MAX_BATCH = int(os.getenv('DB_WRITER_MAX_BATCH', '200'))  # Most queued writes committed in one transaction
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))  # Read-only connections (and threads) for queries run off the event loop
+FLOOD_RATE = float(os.getenv('FLOOD_RATE', '1'))  # Sustained updates per second allowed per user
+FLOOD_BURST = int(os.getenv('FLOOD_BURST', '5'))  # Updates a user may send in a quick burst
+FLOOD_DUPLICATE_SECONDS = float(os.getenv('FLOOD_DUPLICATE_SECONDS', '2'))  # Repeated taps on the same button within this window are dropped
+CALLBACK_HANDLED_MINUTES = float(os.getenv('CALLBACK_HANDLED_MINUTES', '10'))  # Approve/reject/cancel/delete buttons that already ran are only acknowledged for this long
 
 # Set up logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Conversation states
-SELECT_DOCTOR, PATIENT_NAME, PATIENT_DOB, CAREGIVER_LINK, CANCEL_BOOKING, ADMIN_ADD, ADMIN_REMOVE, USER_EDIT, BROADCAST, ADMIN_ADD_SLOT, ADMIN_ADD_DOCTOR, SUPPORT_REQUEST, SELECT_LANGUAGE = range(13)
+SELECT_DOCTOR, PATIENT_NAME, PATIENT_DOB, CAREGIVER_LINK, CANCEL_BOOKING, ADMIN_ADD, ADMIN_REMOVE, USER_EDIT, BROADCAST, ADMIN_ADD_SLOT, ADMIN_ADD_DOCTOR, SUPPORT_REQUEST, SELECT_LANGUAGE, ADMIN_SET_HOURS, ADMIN_SLOT_EXCEPTION = range(15)
+STATE_NAMES = {
+    'SELECT_DOCTOR': SELECT_DOCTOR, 'PATIENT_NAME': PATIENT_NAME, 'PATIENT_DOB': PATIENT_DOB, 'CAREGIVER_LINK': CAREGIVER_LINK,
+    'CANCEL_BOOKING': CANCEL_BOOKING, 'ADMIN_ADD': ADMIN_ADD, 'ADMIN_REMOVE': ADMIN_REMOVE, 'USER_EDIT': USER_EDIT,
+    'BROADCAST': BROADCAST, 'ADMIN_ADD_SLOT': ADMIN_ADD_SLOT, 'ADMIN_ADD_DOCTOR': ADMIN_ADD_DOCTOR,
+    'SUPPORT_REQUEST': SUPPORT_REQUEST, 'SELECT_LANGUAGE': SELECT_LANGUAGE, 'ADMIN_SET_HOURS': ADMIN_SET_HOURS,
+    'ADMIN_SLOT_EXCEPTION': ADMIN_SLOT_EXCEPTION,
+}
+
+# Idle timeouts in seconds per conversation state, parsed from CONVERSATION_STATE_IDLE_MINUTES
+def parse_state_idle_timeouts(spec):
+    timeouts = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, minutes = entry.partition('=')
+        try:
+            timeouts[STATE_NAMES[name.strip().upper()]] = float(minutes) * 60
+        except (KeyError, ValueError):
+            logger.error(f"Ignoring invalid CONVERSATION_STATE_IDLE_MINUTES entry {entry!r}")
+    return timeouts
 
 # Booking tuple indices
 BOOKING_FIELDS = {
@@ -31,7 +100,8 @@ BOOKING_FIELDS = {
     'time_slot': 4,
     'booking_date': 5,
     'doctor_id': 6,
-    'status': 7
+    'status': 7,
+    'slot_key': 8
 }
 
 # Translations dictionary
@@ -48,7 +118,7 @@ translations = {
         'select_doctor': "👨‍⚕️ Please select a doctor to view their schedule:",
         'no_slots': "⚠️ No available slots for {doctor_name}. Please try another doctor or contact support.",
         'doctor_not_found': "⚠️ Doctor not found.",
-        'schedule_header': "📅 {doctor_name}'s Schedule (Next 7 Days)\n\n",
+        'schedule_header': "📅 {doctor_name}'s Schedule ({start} – {end})\n\n",
         'select_slot': "Select a slot to book:",
         'back_to_doctors': "Back to Doctors",
         'no_bookings': "You have no active bookings to cancel.",
@@ -66,6 +136,7 @@ translations = {
         'book_self': "For myself",
         'book_caregiver': "For a loved one",
         'patient_name_prompt': "📝 Please provide the patient's full name for the booking.",
+        'patient_profile_prompt': "👤 Who is this booking for? Tap a saved patient or type the full name of a new one.",
         'patient_dob_prompt': "📅 Please provide the patient's date of birth (format: YYYY-MM-DD, e.g., 1980-01-01).",
         'caregiver_patient_prompt': "Please provide the name of the patient you are managing for.",
         'caregiver_registered': "✅ Registered as caregiver for {patient_name}. You can now book calls on their behalf.",
@@ -125,13 +196,59 @@ translations = {
         'booking_rejected': "❌ Your booking for {patient_name} on {date} at {time} was rejected by the doctor. Please select another slot.",
         'booking_approved_admin': "✅ Booking ID {id} approved. User and doctor notified.",
         'booking_rejected_admin': "✅ Booking ID {id} rejected. User notified.",
+        'booking_already_decided': "ℹ️ Booking ID {id} was already handled; nothing was changed.",
+        'action_already_done': "✅ Already done.",
+        'user_not_found': "ℹ️ User ID {id} not found; nothing was deleted.",
         'booking_not_found': "⚠️ Booking not found.",
         'approve': "Approve",
         'reject': "Reject",
         'doctor_notification': "🔔 New booking request:\nPatient: {patient_name}\nDOB: {dob}\nDate: {date} ({day_name})\nTime: {time}\nUser ID: {user_id}\nUsername: {username}\nPlease approve or reject the booking.",
         'doctor_cancel_notification': "🔔 Booking cancelled:\nPatient: {patient_name}\nDate: {date}\nTime: {time}",
         'doctor_approve_notification': "✅ Booking confirmed for {patient_name} on {date} ({day_name}) at {time}.\nPatient: {patient_name}\nDOB: {dob}\nUser ID: {user_id}",
-        'invalid_booking_date': "⚠️ Invalid booking date in database. Please contact support."
+        'invalid_booking_date': "⚠️ Invalid booking date in database. Please contact support.",
+        'booking_expired': "⌛ Your booking request for {patient_name} on {date} at {time} expired because the doctor did not respond in time. Please select another slot.",
+        'doctor_booking_expired': "⌛ Booking request expired without a decision:\nPatient: {patient_name}\nDate: {date}\nTime: {time}",
+        'slot_selection_expired': "⚠️ This schedule has expired. Please select the doctor again to see the current slots.",
+        'too_many_requests': "⏳ You're going too fast. Please wait a moment and try again.",
+        'health_throttle': "🚦 Throttled updates: {dropped}\n🔁 Duplicate taps ignored: {coalesced}",
+        'broadcast_queued': "📤 Broadcast queued for {count} users. You will get a summary when it has been sent.",
+        'health_outbound': "📤 Outbound queue: {queued}\n✉️ Sent: {sent}, failed: {failed}, retry-after: {retry_after}\n⏱️ Send latency p50/p95: {p50:.0f}/{p95:.0f} ms",
+        'doctor_digest_header': "📋 Your agenda for {date} ({day_name})\n",
+        'doctor_digest_line': "{icon} {time} – {patient_name} (DOB: {dob})",
+        'doctor_digest_footer': "\n✅ Confirmed: {approved}  ⏳ Pending: {pending}",
+        'search_usage': "🔎 Usage: /search <patient name or words from a support request>",
+        'search_no_results': "🔎 No bookings or support requests match \"{query}\".",
+        'search_results': "🔎 Results for \"{query}\" (page {page})",
+        'search_support_header': "💬 Support requests:",
+        'search_bookings_header': "📅 Bookings:",
+        'search_prev': "◀️ Previous",
+        'search_next': "Next ▶️",
+        'no_slots_week': "No free slots this week.",
+        'calendar_prev_week': "◀️ Previous week",
+        'calendar_next_week': "Next week ▶️",
+        'waitlist_hint': "🔔 Fully booked day? Tap it below to join the waitlist and we'll offer you the first slot that frees up.",
+        'waitlist_joined': "🔔 You're on the waitlist for {doctor_name} on {date}. We'll message you as soon as a slot frees up.",
+        'waitlist_already': "🔔 You're already on the waitlist for {doctor_name} on {date}.",
+        'waitlist_offer': "🎉 A slot with {doctor_name} just freed up: {date} at {time}.\nIt's offered to you for the next {minutes} minutes.",
+        'waitlist_offer_button': "Book {time}",
+        'waitlist_offer_expired': "⌛ This offer has expired or the slot is no longer available.",
+        'admin_set_hours': "Set Weekly Hours",
+        'admin_slot_exception': "Add Day Off / Extra Hour",
+        'admin_set_hours_prompt': "Enter weekly hours (format: doctor_id,days,times)\nDays: 1 = Monday … 7 = Sunday, e.g. 1-5 or 1 3 5\nTimes: any of {time_slots} separated by spaces, * for all or - for none\nExample: 987654321,1-5,09:00 10:00 14:00",
+        'hours_set': "✅ Weekly hours for Doctor ID {doctor_id} on {days}: {times}",
+        'invalid_hours_format': "Invalid format. Use: doctor_id,days,times (e.g., 987654321,1-5,09:00 10:00 14:00)",
+        'admin_slot_exception_prompt': "Enter an exception (format: doctor_id,date,off|extra[,time])\nExamples:\n987654321,2025-04-23,off – day off\n987654321,2025-04-23,off,09:00 – one hour off\n987654321,2025-04-23,extra,17:00 – extra hour",
+        'exception_added': "✅ Saved for Doctor ID {doctor_id} on {date}: {kind} ({time})",
+        'invalid_exception_format': "Invalid format. Use: doctor_id,date,off|extra[,time] (e.g., 987654321,2025-04-23,off)",
+        'whole_day': "whole day",
+        'pending_queue': "📋 Pending requests ({count}). Tap requests to select them, then approve or reject the selection.",
+        'pending_queue_empty': "✅ No pending requests.",
+        'pending_select_all': "Select all / none",
+        'pending_approve_selected': "✅ Approve ({count})",
+        'pending_reject_selected': "❌ Reject ({count})",
+        'pending_none_selected': "Select at least one request first.",
+        'pending_approved': "✅ Approved {count} request(s), skipped {skipped} (already decided or slot taken).",
+        'pending_rejected': "❌ Rejected {count} request(s), skipped {skipped} (already decided)."
     },
     'de': {
         'welcome_user': "👋 Willkommen beim Doctomed Call Service – professionelle Beratung per Telefon.\n📞 Dieser Dienst nutzt eine Schweizer Premium-Nummer: 0900 0900 90\nMöchten Sie einen Anruf buchen?",
@@ -145,7 +262,7 @@ translations = {
         'select_doctor': "👨‍⚕️ Bitte wählen Sie einen Arzt, um dessen Zeitplan einzusehen:",
         'no_slots': "⚠️ Keine verfügbaren Termine für {doctor_name}. Bitte wählen Sie einen anderen Arzt oder kontaktieren Sie den Support.",
         'doctor_not_found': "⚠️ Arzt nicht gefunden.",
-        'schedule_header': "📅 Zeitplan von {doctor_name} (nächste 7 Tage)\n\n",
+        'schedule_header': "📅 Zeitplan von {doctor_name} ({start} – {end})\n\n",
         'select_slot': "Wählen Sie einen Termin zum Buchen:",
         'back_to_doctors': "Zurück zu den Ärzten",
         'no_bookings': "Sie haben keine aktiven Buchungen zum Stornieren.",
@@ -163,6 +280,7 @@ translations = {
         'book_self': "Für mich selbst",
         'book_caregiver': "Für eine andere Person",
         'patient_name_prompt': "📝 Bitte geben Sie den vollständigen Namen des Patienten für die Buchung an.",
+        'patient_profile_prompt': "👤 Für wen ist diese Buchung? Tippen Sie auf einen gespeicherten Patienten oder geben Sie den vollständigen Namen eines neuen ein.",
         'patient_dob_prompt': "📅 Bitte geben Sie das Geburtsdatum des Patienten an (Format: JJJJ-MM-TT, z.B. 1980-01-01).",
         'caregiver_patient_prompt': "Bitte geben Sie den Namen des Patienten ein, für den Sie die Buchung verwalten.",
         'caregiver_registered': "✅ Als Betreuer für {patient_name} registriert. Sie können nun Anrufe im Namen dieser Person buchen.",
@@ -222,13 +340,59 @@ translations = {
         'booking_rejected': "❌ Ihre Buchung für {patient_name} am {date} um {time} wurde vom Arzt abgelehnt. Bitte wählen Sie einen anderen Termin.",
         'booking_approved_admin': "✅ Buchungs-ID {id} genehmigt. Benutzer und Arzt benachrichtigt.",
         'booking_rejected_admin': "✅ Buchungs-ID {id} abgelehnt. Benutzer benachrichtigt.",
+        'booking_already_decided': "ℹ️ Buchungs-ID {id} wurde bereits bearbeitet; es wurde nichts geändert.",
+        'action_already_done': "✅ Bereits erledigt.",
+        'user_not_found': "ℹ️ Benutzer-ID {id} nicht gefunden; es wurde nichts gelöscht.",
         'booking_not_found': "⚠️ Buchung nicht gefunden.",
         'approve': "Genehmigen",
         'reject': "Ablehnen",
         'doctor_notification': "🔔 Neue Buchungsanfrage:\nPatient: {patient_name}\nGeburtsdatum: {dob}\nDatum: {date} ({day_name})\nZeit: {time}\nBenutzer-ID: {user_id}\nBenutzername: {username}\nBitte genehmigen oder lehnen Sie die Buchung ab.",
         'doctor_cancel_notification': "🔔 Buchung storniert:\nPatient: {patient_name}\nDatum: {date}\nZeit: {time}",
         'doctor_approve_notification': "✅ Buchung bestätigt für {patient_name} am {date} ({day_name}) um {time}.\nPatient: {patient_name}\nGeburtsdatum: {dob}\nBenutzer-ID: {user_id}",
-        'invalid_booking_date': "⚠️ Ungültiges Buchungsdatum in der Datenbank. Bitte kontaktieren Sie den Support."
+        'invalid_booking_date': "⚠️ Ungültiges Buchungsdatum in der Datenbank. Bitte kontaktieren Sie den Support.",
+        'booking_expired': "⌛ Ihre Buchungsanfrage für {patient_name} am {date} um {time} ist abgelaufen, da der Arzt nicht rechtzeitig geantwortet hat. Bitte wählen Sie einen anderen Termin.",
+        'doctor_booking_expired': "⌛ Buchungsanfrage ohne Entscheidung abgelaufen:\nPatient: {patient_name}\nDatum: {date}\nZeit: {time}",
+        'slot_selection_expired': "⚠️ Dieser Zeitplan ist abgelaufen. Bitte wählen Sie den Arzt erneut, um die aktuellen Termine zu sehen.",
+        'too_many_requests': "⏳ Sie sind zu schnell. Bitte warten Sie einen Moment und versuchen Sie es erneut.",
+        'health_throttle': "🚦 Gedrosselte Anfragen: {dropped}\n🔁 Ignorierte Doppelklicks: {coalesced}",
+        'broadcast_queued': "📤 Rundsendung für {count} Benutzer eingereiht. Sie erhalten eine Zusammenfassung, sobald sie versendet wurde.",
+        'health_outbound': "📤 Ausgangswarteschlange: {queued}\n✉️ Gesendet: {sent}, fehlgeschlagen: {failed}, Retry-After: {retry_after}\n⏱️ Sendelatenz p50/p95: {p50:.0f}/{p95:.0f} ms",
+        'doctor_digest_header': "📋 Ihre Termine am {date} ({day_name})\n",
+        'doctor_digest_line': "{icon} {time} – {patient_name} (Geb.: {dob})",
+        'doctor_digest_footer': "\n✅ Bestätigt: {approved}  ⏳ Ausstehend: {pending}",
+        'search_usage': "🔎 Verwendung: /search <Patientenname oder Wörter aus einer Supportanfrage>",
+        'search_no_results': "🔎 Keine Buchungen oder Supportanfragen passen zu \"{query}\".",
+        'search_results': "🔎 Ergebnisse für \"{query}\" (Seite {page})",
+        'search_support_header': "💬 Supportanfragen:",
+        'search_bookings_header': "📅 Buchungen:",
+        'search_prev': "◀️ Zurück",
+        'search_next': "Weiter ▶️",
+        'no_slots_week': "Keine freien Termine in dieser Woche.",
+        'calendar_prev_week': "◀️ Vorherige Woche",
+        'calendar_next_week': "Nächste Woche ▶️",
+        'waitlist_hint': "🔔 Tag ausgebucht? Tippen Sie unten darauf, um sich auf die Warteliste zu setzen – wir bieten Ihnen den ersten frei werdenden Termin an.",
+        'waitlist_joined': "🔔 Sie stehen auf der Warteliste für {doctor_name} am {date}. Wir melden uns, sobald ein Termin frei wird.",
+        'waitlist_already': "🔔 Sie stehen bereits auf der Warteliste für {doctor_name} am {date}.",
+        'waitlist_offer': "🎉 Bei {doctor_name} ist ein Termin frei geworden: {date} um {time}.\nEr wird Ihnen für die nächsten {minutes} Minuten angeboten.",
+        'waitlist_offer_button': "{time} buchen",
+        'waitlist_offer_expired': "⌛ Dieses Angebot ist abgelaufen oder der Termin ist nicht mehr verfügbar.",
+        'admin_set_hours': "Wochenzeiten festlegen",
+        'admin_slot_exception': "Freier Tag / Zusatzstunde",
+        'admin_set_hours_prompt': "Geben Sie die Wochenzeiten ein (Format: Arzt-ID,Tage,Zeiten)\nTage: 1 = Montag … 7 = Sonntag, z. B. 1-5 oder 1 3 5\nZeiten: beliebige aus {time_slots}, durch Leerzeichen getrennt, * für alle oder - für keine\nBeispiel: 987654321,1-5,09:00 10:00 14:00",
+        'hours_set': "✅ Wochenzeiten für Arzt-ID {doctor_id} am {days}: {times}",
+        'invalid_hours_format': "Ungültiges Format. Verwenden Sie: Arzt-ID,Tage,Zeiten (z. B. 987654321,1-5,09:00 10:00 14:00)",
+        'admin_slot_exception_prompt': "Geben Sie eine Ausnahme ein (Format: Arzt-ID,Datum,off|extra[,Zeit])\nBeispiele:\n987654321,2025-04-23,off – freier Tag\n987654321,2025-04-23,off,09:00 – eine Stunde frei\n987654321,2025-04-23,extra,17:00 – Zusatzstunde",
+        'exception_added': "✅ Gespeichert für Arzt-ID {doctor_id} am {date}: {kind} ({time})",
+        'invalid_exception_format': "Ungültiges Format. Verwenden Sie: Arzt-ID,Datum,off|extra[,Zeit] (z. B. 987654321,2025-04-23,off)",
+        'whole_day': "ganzer Tag",
+        'pending_queue': "📋 Offene Anfragen ({count}). Tippen Sie auf Anfragen, um sie auszuwählen, und bestätigen oder lehnen Sie die Auswahl ab.",
+        'pending_queue_empty': "✅ Keine offenen Anfragen.",
+        'pending_select_all': "Alle / keine auswählen",
+        'pending_approve_selected': "✅ Bestätigen ({count})",
+        'pending_reject_selected': "❌ Ablehnen ({count})",
+        'pending_none_selected': "Bitte wählen Sie zuerst mindestens eine Anfrage aus.",
+        'pending_approved': "✅ {count} Anfrage(n) bestätigt, {skipped} übersprungen (bereits entschieden oder Termin vergeben).",
+        'pending_rejected': "❌ {count} Anfrage(n) abgelehnt, {skipped} übersprungen (bereits entschieden)."
     },
     'fr': {
         'welcome_user': "👋 Bienvenue chez Doctomed Call Service – soins professionnels par téléphone.\n📞 Ce service utilise un numéro premium suisse : 0900 0900 90\nSouhaitez-vous réserver un appel ?",
@@ -242,7 +406,7 @@ translations = {
         'select_doctor': "👨‍⚕️ Veuillez sélectionner un médecin pour voir son planning :",
         'no_slots': "⚠️ Aucun créneau disponible pour {doctor_name}. Veuillez choisir un autre médecin ou contacter le support.",
         'doctor_not_found': "⚠️ Médecin non trouvé.",
-        'schedule_header': "📅 Planning de {doctor_name} (7 prochains jours)\n\n",
+        'schedule_header': "📅 Planning de {doctor_name} ({start} – {end})\n\n",
         'select_slot': "Sélectionnez un créneau pour réserver :",
         'back_to_doctors': "Retour aux médecins",
         'no_bookings': "Vous n'avez aucune réservation active à annuler.",
@@ -260,6 +424,7 @@ translations = {
         'book_self': "Pour moi-même",
         'book_caregiver': "Pour un proche",
         'patient_name_prompt': "📝 Veuillez fournir le nom complet du patient pour la réservation.",
+        'patient_profile_prompt': "👤 Pour qui est cette réservation ? Touchez un patient enregistré ou saisissez le nom complet d'un nouveau patient.",
         'patient_dob_prompt': "📅 Veuillez fournir la date de naissance du patient (format : AAAA-MM-JJ, ex. 1980-01-01).",
         'caregiver_patient_prompt': "Veuillez fournir le nom du patient pour lequel vous effectuez la réservation.",
         'caregiver_registered': "✅ Enregistré en tant que soignant pour {patient_name}. Vous pouvez maintenant réserver des appels en son nom.",
@@ -319,13 +484,59 @@ translations = {
         'booking_rejected': "❌ Votre réservation pour {patient_name} le {date} à {time} a été rejetée par le médecin. Veuillez sélectionner un autre créneau.",
         'booking_approved_admin': "✅ ID de réservation {id} approuvée. Utilisateur et médecin notifiés.",
         'booking_rejected_admin': "✅ ID de réservation {id} rejetée. Utilisateur notifié.",
+        'booking_already_decided': "ℹ️ La réservation {id} a déjà été traitée ; rien n'a été modifié.",
+        'action_already_done': "✅ Déjà fait.",
+        'user_not_found': "ℹ️ ID utilisateur {id} introuvable ; rien n'a été supprimé.",
         'booking_not_found': "⚠️ Réservation non trouvée.",
         'approve': "Approuver",
         'reject': "Rejeter",
         'doctor_notification': "🔔 Nouvelle demande de réservation :\nPatient : {patient_name}\nDate de naissance : {dob}\nDate : {date} ({day_name})\nHeure : {time}\nID utilisateur : {user_id}\nNom d'utilisateur : {username}\nVeuillez approuver ou rejeter la réservation.",
         'doctor_cancel_notification': "🔔 Réservation annulée :\nPatient : {patient_name}\nDate : {date}\nHeure : {time}",
         'doctor_approve_notification': "✅ Réservation confirmée pour {patient_name} le {date} ({day_name}) à {time}.\nPatient : {patient_name}\nDate de naissance : {dob}\nID utilisateur : {user_id}",
-        'invalid_booking_date': "⚠️ Date de réservation invalide dans la base de données. Veuillez contacter le support."
+        'invalid_booking_date': "⚠️ Date de réservation invalide dans la base de données. Veuillez contacter le support.",
+        'booking_expired': "⌛ Votre demande de réservation pour {patient_name} le {date} à {time} a expiré car le médecin n'a pas répondu à temps. Veuillez sélectionner un autre créneau.",
+        'doctor_booking_expired': "⌛ Demande de réservation expirée sans décision :\nPatient : {patient_name}\nDate : {date}\nHeure : {time}",
+        'slot_selection_expired': "⚠️ Ce planning a expiré. Veuillez sélectionner à nouveau le médecin pour voir les créneaux actuels.",
+        'too_many_requests': "⏳ Vous allez trop vite. Veuillez patienter un instant et réessayer.",
+        'health_throttle': "🚦 Requêtes limitées : {dropped}\n🔁 Doubles clics ignorés : {coalesced}",
+        'broadcast_queued': "📤 Diffusion mise en file pour {count} utilisateurs. Vous recevrez un résumé une fois l'envoi terminé.",
+        'health_outbound': "📤 File d'envoi : {queued}\n✉️ Envoyés : {sent}, échecs : {failed}, retry-after : {retry_after}\n⏱️ Latence d'envoi p50/p95 : {p50:.0f}/{p95:.0f} ms",
+        'doctor_digest_header': "📋 Votre agenda du {date} ({day_name})\n",
+        'doctor_digest_line': "{icon} {time} – {patient_name} (né(e) le : {dob})",
+        'doctor_digest_footer': "\n✅ Confirmés : {approved}  ⏳ En attente : {pending}",
+        'search_usage': "🔎 Utilisation : /search <nom du patient ou mots d'une demande d'assistance>",
+        'search_no_results': "🔎 Aucune réservation ni demande d'assistance ne correspond à \"{query}\".",
+        'search_results': "🔎 Résultats pour \"{query}\" (page {page})",
+        'search_support_header': "💬 Demandes d'assistance :",
+        'search_bookings_header': "📅 Réservations :",
+        'search_prev': "◀️ Précédent",
+        'search_next': "Suivant ▶️",
+        'no_slots_week': "Aucun créneau libre cette semaine.",
+        'calendar_prev_week': "◀️ Semaine précédente",
+        'calendar_next_week': "Semaine suivante ▶️",
+        'waitlist_hint': "🔔 Journée complète ? Touchez-la ci-dessous pour rejoindre la liste d'attente : nous vous proposerons le premier créneau libéré.",
+        'waitlist_joined': "🔔 Vous êtes sur la liste d'attente de {doctor_name} pour le {date}. Nous vous écrirons dès qu'un créneau se libère.",
+        'waitlist_already': "🔔 Vous êtes déjà sur la liste d'attente de {doctor_name} pour le {date}.",
+        'waitlist_offer': "🎉 Un créneau avec {doctor_name} vient de se libérer : {date} à {time}.\nIl vous est proposé pendant les {minutes} prochaines minutes.",
+        'waitlist_offer_button': "Réserver {time}",
+        'waitlist_offer_expired': "⌛ Cette offre a expiré ou le créneau n'est plus disponible.",
+        'admin_set_hours': "Définir les horaires hebdomadaires",
+        'admin_slot_exception': "Jour de congé / heure supplémentaire",
+        'admin_set_hours_prompt': "Entrez les horaires hebdomadaires (format : id_médecin,jours,heures)\nJours : 1 = lundi … 7 = dimanche, p. ex. 1-5 ou 1 3 5\nHeures : parmi {time_slots}, séparées par des espaces, * pour toutes ou - pour aucune\nExemple : 987654321,1-5,09:00 10:00 14:00",
+        'hours_set': "✅ Horaires hebdomadaires du médecin ID {doctor_id} le {days} : {times}",
+        'invalid_hours_format': "Format invalide. Utilisez : id_médecin,jours,heures (p. ex. 987654321,1-5,09:00 10:00 14:00)",
+        'admin_slot_exception_prompt': "Entrez une exception (format : id_médecin,date,off|extra[,heure])\nExemples :\n987654321,2025-04-23,off – jour de congé\n987654321,2025-04-23,off,09:00 – une heure libre\n987654321,2025-04-23,extra,17:00 – heure supplémentaire",
+        'exception_added': "✅ Enregistré pour le médecin ID {doctor_id} le {date} : {kind} ({time})",
+        'invalid_exception_format': "Format invalide. Utilisez : id_médecin,date,off|extra[,heure] (p. ex. 987654321,2025-04-23,off)",
+        'whole_day': "toute la journée",
+        'pending_queue': "📋 Demandes en attente ({count}). Touchez les demandes pour les sélectionner, puis approuvez ou refusez la sélection.",
+        'pending_queue_empty': "✅ Aucune demande en attente.",
+        'pending_select_all': "Tout / rien sélectionner",
+        'pending_approve_selected': "✅ Approuver ({count})",
+        'pending_reject_selected': "❌ Refuser ({count})",
+        'pending_none_selected': "Sélectionnez d'abord au moins une demande.",
+        'pending_approved': "✅ {count} demande(s) approuvée(s), {skipped} ignorée(s) (déjà traitée(s) ou créneau pris).",
+        'pending_rejected': "❌ {count} demande(s) refusée(s), {skipped} ignorée(s) (déjà traitée(s))."
     },
     'it': {
         'welcome_user': "👋 Benvenuto al Doctomed Call Service – assistenza professionale tramite telefono.\n📞 Questo servizio utilizza un numero premium svizzero: 0900 0900 90\nDesideri prenotare una chiamata?",
@@ -339,7 +550,7 @@ translations = {
         'select_doctor': "👨‍⚕️ Seleziona un medico per visualizzare il suo programma:",
         'no_slots': "⚠️ Nessun appuntamento disponibile per {doctor_name}. Prova con un altro medico o contatta il supporto.",
         'doctor_not_found': "⚠️ Medico non trovato.",
-        'schedule_header': "📅 Programma di {doctor_name} (prossimi 7 giorni)\n\n",
+        'schedule_header': "📅 Programma di {doctor_name} ({start} – {end})\n\n",
         'select_slot': "Seleziona un appuntamento per prenotare:",
         'back_to_doctors': "Torna ai medici",
         'no_bookings': "Non hai prenotazioni attive da annullare.",
@@ -357,6 +568,7 @@ translations = {
         'book_self': "Per me stesso",
         'book_caregiver': "Per una persona cara",
         'patient_name_prompt': "📝 Fornisci il nome completo del paziente per la prenotazione.",
+        'patient_profile_prompt': "👤 Per chi è questa prenotazione? Tocca un paziente salvato o scrivi il nome completo di uno nuovo.",
         'patient_dob_prompt': "📅 Fornisci la data di nascita del paziente (formato: AAAA-MM-GG, es. 1980-01-01).",
         'caregiver_patient_prompt': "Fornisci il nome del paziente per cui stai gestendo la prenotazione.",
         'caregiver_registered': "✅ Registrato come caregiver per {patient_name}. Ora puoi prenotare chiamate per suo conto.",
@@ -416,13 +628,59 @@ translations = {
         'booking_rejected': "❌ La tua prenotazione per {patient_name} il {date} alle {time} è stata rifiutata dal medico. Seleziona un altro appuntamento.",
         'booking_approved_admin': "✅ ID Prenotazione {id} approvata. Utente e medico notificati.",
         'booking_rejected_admin': "✅ ID Prenotazione {id} rifiutata. Utente notificato.",
+        'booking_already_decided': "ℹ️ La prenotazione {id} è già stata gestita; non è stato modificato nulla.",
+        'action_already_done': "✅ Già fatto.",
+        'user_not_found': "ℹ️ ID Utente {id} non trovato; non è stato eliminato nulla.",
         'booking_not_found': "⚠️ Prenotazione non trovata.",
         'approve': "Approva",
         'reject': "Rifiuta",
         'doctor_notification': "🔔 Nuova richiesta di prenotazione:\nPaziente: {patient_name}\nData di nascita: {dob}\nData: {date} ({day_name})\nOra: {time}\nID Utente: {user_id}\nNome utente: {username}\nApprova o rifiuta la prenotazione.",
         'doctor_cancel_notification': "🔔 Prenotazione annullata:\nPaziente: {patient_name}\nData: {date}\nOra: {time}",
         'doctor_approve_notification': "✅ Prenotazione confermata per {patient_name} il {date} ({day_name}) alle {time}.\nPaziente: {patient_name}\nData di nascita: {dob}\nID Utente: {user_id}",
-        'invalid_booking_date': "⚠️ Data di prenotazione non valida nel database. Contatta il supporto."
+        'invalid_booking_date': "⚠️ Data di prenotazione non valida nel database. Contatta il supporto.",
+        'booking_expired': "⌛ La tua richiesta di prenotazione per {patient_name} il {date} alle {time} è scaduta perché il medico non ha risposto in tempo. Seleziona un altro appuntamento.",
+        'doctor_booking_expired': "⌛ Richiesta di prenotazione scaduta senza decisione:\nPaziente: {patient_name}\nData: {date}\nOra: {time}",
+        'slot_selection_expired': "⚠️ Questo programma è scaduto. Seleziona di nuovo il medico per vedere gli appuntamenti attuali.",
+        'too_many_requests': "⏳ Stai andando troppo veloce. Attendi un momento e riprova.",
+        'health_throttle': "🚦 Richieste limitate: {dropped}\n🔁 Doppi tocchi ignorati: {coalesced}",
+        'broadcast_queued': "📤 Trasmissione in coda per {count} utenti. Riceverai un riepilogo al termine dell'invio.",
+        'health_outbound': "📤 Coda di invio: {queued}\n✉️ Inviati: {sent}, falliti: {failed}, retry-after: {retry_after}\n⏱️ Latenza di invio p50/p95: {p50:.0f}/{p95:.0f} ms",
+        'doctor_digest_header': "📋 La tua agenda per il {date} ({day_name})\n",
+        'doctor_digest_line': "{icon} {time} – {patient_name} (Data di nascita: {dob})",
+        'doctor_digest_footer': "\n✅ Confermati: {approved}  ⏳ In attesa: {pending}",
+        'search_usage': "🔎 Uso: /search <nome del paziente o parole di una richiesta di supporto>",
+        'search_no_results': "🔎 Nessuna prenotazione o richiesta di supporto corrisponde a \"{query}\".",
+        'search_results': "🔎 Risultati per \"{query}\" (pagina {page})",
+        'search_support_header': "💬 Richieste di supporto:",
+        'search_bookings_header': "📅 Prenotazioni:",
+        'search_prev': "◀️ Precedente",
+        'search_next': "Successivo ▶️",
+        'no_slots_week': "Nessun appuntamento libero questa settimana.",
+        'calendar_prev_week': "◀️ Settimana precedente",
+        'calendar_next_week': "Settimana successiva ▶️",
+        'waitlist_hint': "🔔 Giorno al completo? Toccalo qui sotto per entrare in lista d'attesa: ti offriremo il primo appuntamento che si libera.",
+        'waitlist_joined': "🔔 Sei in lista d'attesa per {doctor_name} il {date}. Ti scriveremo appena si libera un appuntamento.",
+        'waitlist_already': "🔔 Sei già in lista d'attesa per {doctor_name} il {date}.",
+        'waitlist_offer': "🎉 Si è liberato un appuntamento con {doctor_name}: {date} alle {time}.\nTi viene offerto per i prossimi {minutes} minuti.",
+        'waitlist_offer_button': "Prenota {time}",
+        'waitlist_offer_expired': "⌛ Questa offerta è scaduta o l'appuntamento non è più disponibile.",
+        'admin_set_hours': "Imposta orari settimanali",
+        'admin_slot_exception': "Giorno libero / ora extra",
+        'admin_set_hours_prompt': "Inserisci gli orari settimanali (formato: id_medico,giorni,orari)\nGiorni: 1 = lunedì … 7 = domenica, ad es. 1-5 o 1 3 5\nOrari: tra {time_slots}, separati da spazi, * per tutti o - per nessuno\nEsempio: 987654321,1-5,09:00 10:00 14:00",
+        'hours_set': "✅ Orari settimanali del medico ID {doctor_id} il {days}: {times}",
+        'invalid_hours_format': "Formato non valido. Usa: id_medico,giorni,orari (ad es. 987654321,1-5,09:00 10:00 14:00)",
+        'admin_slot_exception_prompt': "Inserisci un'eccezione (formato: id_medico,data,off|extra[,ora])\nEsempi:\n987654321,2025-04-23,off – giorno libero\n987654321,2025-04-23,off,09:00 – un'ora libera\n987654321,2025-04-23,extra,17:00 – ora extra",
+        'exception_added': "✅ Salvato per il medico ID {doctor_id} il {date}: {kind} ({time})",
+        'invalid_exception_format': "Formato non valido. Usa: id_medico,data,off|extra[,ora] (ad es. 987654321,2025-04-23,off)",
+        'whole_day': "giornata intera",
+        'pending_queue': "📋 Richieste in sospeso ({count}). Tocca le richieste per selezionarle, poi approva o rifiuta la selezione.",
+        'pending_queue_empty': "✅ Nessuna richiesta in sospeso.",
+        'pending_select_all': "Seleziona tutto / niente",
+        'pending_approve_selected': "✅ Approva ({count})",
+        'pending_reject_selected': "❌ Rifiuta ({count})",
+        'pending_none_selected': "Seleziona prima almeno una richiesta.",
+        'pending_approved': "✅ {count} richiesta/e approvata/e, {skipped} saltata/e (già decisa/e o appuntamento occupato).",
+        'pending_rejected': "❌ {count} richiesta/e rifiutata/e, {skipped} saltata/e (già decisa/e)."
     }
 }
 
@@ -443,10 +701,20 @@ def get_message(key, lang='en', **kwargs):
         logger.warning(f"Missing format key in translation for key {key}, lang {lang}: {e}")
         return message
 
+# Add a column to an existing table; returns True if it had to be created
+def add_column_if_missing(c, table, column, definition):
+    c.execute(f'PRAGMA table_info({table})')
+    if column in [row[1] for row in c.fetchall()]:
+        return False
+    c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return True
+
 # Initialize database
 def init_db():
     try:
         conn = sqlite3.connect('doctomed.db', timeout=10)
+        # Takes effect on a new database only, so it has to come before the first table is created
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
         conn.execute('PRAGMA journal_mode=WAL')  # Enable Write-Ahead Logging
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS bookings 
@@ -463,6 +731,126 @@ def init_db():
                      (user_id INTEGER PRIMARY KEY, name TEXT)''')
         c.execute('''CREATE TABLE IF NOT EXISTS support_requests 
                      (id INTEGER PRIMARY KEY, user_id INTEGER, message TEXT, timestamp TEXT, status TEXT)''')
+        # Archive tables keep finished bookings and past slots out of the hot tables
+        c.execute('''CREATE TABLE IF NOT EXISTS bookings_archive
+                     (id INTEGER PRIMARY KEY, user_id INTEGER, patient_name TEXT,
+                      patient_dob TEXT, time_slot TEXT, booking_date TEXT, doctor_id INTEGER,
+                      status TEXT, confirmed INTEGER, archived_at TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS doctor_slots_archive
+                     (id INTEGER PRIMARY KEY, booking_date TEXT, time_slot TEXT, doctor_id INTEGER, is_available INTEGER,
+                      archived_at TEXT)''')
+        # created_at lets stale pending requests be expired; older rows get the migration time
+        if add_column_if_missing(c, 'bookings', 'created_at', 'TEXT'):
+            c.execute('UPDATE bookings SET created_at = ? WHERE created_at IS NULL',
+                      (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+        add_column_if_missing(c, 'bookings_archive', 'created_at', 'TEXT')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_bookings_status_created_at ON bookings (status, created_at)')
+        # Integer slot keys replace string matching on (booking_date, time_slot); the TEXT columns stay for display
+        for table in ('bookings', 'doctor_slots', 'bookings_archive', 'doctor_slots_archive'):
+            if add_column_if_missing(c, table, 'slot_key', 'INTEGER'):
+                c.execute(f'''UPDATE {table} SET slot_key = CAST(strftime('%s', booking_date || ' ' || time_slot) AS INTEGER) / 60
+                              WHERE slot_key IS NULL''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_doctor_slots_doctor_slot_key ON doctor_slots (doctor_id, slot_key)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_bookings_doctor_slot_key ON bookings (doctor_id, slot_key)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_bookings_user_slot_key ON bookings (user_id, slot_key)')
+        c.execute('DROP INDEX IF EXISTS idx_bookings_booking_date')
+        c.execute('DROP INDEX IF EXISTS idx_doctor_slots_booking_date')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_bookings_slot_key ON bookings (slot_key)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_doctor_slots_slot_key ON doctor_slots (slot_key)')
+        # Notifications written in the same transaction as the change they announce
+        c.execute('''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedup_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            kind TEXT,
+            booking_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_priority ON outbox (status, priority, id)')
+        # Availability rules: weekly hours per doctor (weekday 0 = Monday) plus dated exceptions.
+        # 'off' closes a whole day (time_slot NULL) or one hour, 'extra' opens an hour and wins over 'off'.
+        # doctor_slots rows are still honoured as one-off open slots.
+        c.execute('''CREATE TABLE IF NOT EXISTS doctor_hours (
+            doctor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            time_slot TEXT NOT NULL,
+            PRIMARY KEY (doctor_id, weekday, time_slot)
+        ) WITHOUT ROWID''')
+        c.execute('''CREATE TABLE IF NOT EXISTS slot_exceptions (
+            id INTEGER PRIMARY KEY,
+            doctor_id INTEGER NOT NULL,
+            day_key INTEGER NOT NULL,
+            time_slot TEXT,
+            kind TEXT NOT NULL
+        )''')
+        c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_slot_exceptions_doctor_day
+                     ON slot_exceptions (doctor_id, day_key, kind, IFNULL(time_slot, ''))''')
+        # Patients waiting for a fully booked doctor/day; day_key is the slot key of midnight, lower ids are served first
+        c.execute('''CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            day_key INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'waiting',
+            created_at TEXT NOT NULL,
+            offer_slot_key INTEGER,
+            offer_expires_at TEXT
+        )''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_waitlist_doctor_day ON waitlist (doctor_id, day_key, status)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_waitlist_status_expires ON waitlist (status, offer_expires_at)')
+        # Conversation state and user_data kept across restarts by SQLitePersistence, one JSON document per entry
+        c.execute('''CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID''')
+        # Patients a user has booked for, offered again on their next booking; new tables start from past bookings
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_profiles'")
+        profiles_are_new = c.fetchone() is None
+        c.execute('''CREATE TABLE IF NOT EXISTS patient_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            patient_name TEXT NOT NULL,
+            patient_dob TEXT NOT NULL,
+            last_used TEXT NOT NULL,
+            UNIQUE (user_id, patient_name, patient_dob)
+        )''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_patient_profiles_user_last_used ON patient_profiles (user_id, last_used)')
+        if profiles_are_new:
+            c.execute('''INSERT OR IGNORE INTO patient_profiles (user_id, patient_name, patient_dob, last_used)
+                         SELECT user_id, patient_name, patient_dob, MAX(COALESCE(created_at, ''))
+                         FROM bookings WHERE patient_name IS NOT NULL AND patient_dob IS NOT NULL
+                         GROUP BY user_id, patient_name, patient_dob''')
+        # Full-text indexes for admin search; external content, kept in sync by triggers
+        for table, column in (('bookings', 'patient_name'), ('support_requests', 'message')):
+            try:
+                c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f'{table}_fts',))
+                is_new = c.fetchone() is None
+                c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5
+                              ({column}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')''')
+                c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                                  INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column});
+                              END''')
+                c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                                  INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                              END''')
+                c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {column} ON {table} BEGIN
+                                  INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                                  INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column});
+                              END''')
+                if is_new:
+                    c.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Full-text search on {table} unavailable (SQLite built without FTS5?): {e}")
         # Populate admins from ADMIN_IDS
         for admin_id in ADMIN_IDS:
             try:
@@ -471,6 +859,15 @@ def init_db():
             except ValueError:
                 logger.warning(f"Invalid admin ID in ADMIN_IDS: {admin_id}")
         conn.commit()
+        # Incremental auto-vacuum lets archival hand freed pages back to the OS. Existing databases need a
+        # VACUUM for the mode to take effect, which rewrites the whole file, so it only runs when asked for
+        c.execute('PRAGMA auto_vacuum')
+        if c.fetchone()[0] != 2:
+            if DB_VACUUM_ON_START:
+                logger.info("Enabling incremental auto-vacuum on doctomed.db")
+                conn.execute('VACUUM')
+            else:
+                logger.warning("doctomed.db does not use incremental auto-vacuum; start once with DB_VACUUM_ON_START=1 to convert it")
     except sqlite3.Error as e:
         logger.error(f"Database initialization error: {e}")
     finally:
@@ -478,408 +875,3041 @@ def init_db():
 
 # Available time slots
 TIME_SLOTS = ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00"]
+SLOT_BUTTONS_PER_ROW = 3
 
-# Check if user is admin
-def is_admin(user_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT user_id FROM admins WHERE user_id = ?', (user_id,))
-        result = c.fetchone()
-        return result is not None
-    except sqlite3.Error as e:
-        logger.error(f"Error checking admin status for user {user_id}: {e}")
-        return False
-    finally:
-        conn.close()
+# Slot keys are minutes since 1970-01-01 00:00 of the local wall-clock slot time
+SLOT_EPOCH = datetime(1970, 1, 1)
 
-# Get user's language preference
-def get_user_language(user_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
-        result = c.fetchone()
-        return result[0] if result and result[0] in LANGUAGES else 'en'
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching language for user {user_id}: {e}")
-        return 'en'
-    finally:
-        conn.close()
+def to_slot_key(booking_date, time_slot):
+    slot_dt = datetime.strptime(f"{booking_date} {time_slot}", '%Y-%m-%d %H:%M')
+    return int((slot_dt - SLOT_EPOCH).total_seconds()) // 60
 
-# Set user's language preference
-def set_user_language(user_id, language):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('UPDATE users SET language = ? WHERE user_id = ?', (language, user_id))
-        if c.rowcount == 0:
-            c.execute('INSERT INTO users (user_id, language) VALUES (?, ?)', (user_id, language))
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error setting language for user {user_id}: {e}")
-    finally:
-        conn.close()
+def from_slot_key(slot_key):
+    return SLOT_EPOCH + timedelta(minutes=slot_key)
 
-# Get available doctor slots for a specific doctor
-def get_available_slots(doctor_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        today = date.today()
-        end_date = today + timedelta(days=7)
-        c.execute('''SELECT ds.booking_date, ds.time_slot, d.name 
-                     FROM doctor_slots ds 
-                     JOIN doctors d ON ds.doctor_id = d.user_id
-                     WHERE ds.is_available = 1 AND ds.doctor_id = ?
-                     AND ds.booking_date >= ? AND ds.booking_date <= ?
-                     AND (ds.booking_date, ds.time_slot) NOT IN (
-                         SELECT booking_date, time_slot FROM bookings WHERE confirmed = 1 AND doctor_id = ?
-                     )
-                     ORDER BY ds.booking_date, ds.time_slot''', 
-                     (doctor_id, today.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), doctor_id))
-        slots = c.fetchall()
-        return slots
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching slots for doctor {doctor_id}: {e}")
-        return []
-    finally:
-        conn.close()
+# Slot key of midnight on the given date
+def day_slot_key(day):
+    return (day - SLOT_EPOCH.date()).days * 1440
 
-# Get all doctors
-def get_all_doctors():
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT user_id, name FROM doctors')
-        doctors = c.fetchall()
-        return doctors
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching doctors: {e}")
-        return []
-    finally:
-        conn.close()
+# First day after the booking horizon
+def horizon_end(today=None):
+    return (today or date.today()) + timedelta(days=BOOKING_HORIZON_DAYS + 1)
 
-# Get doctor by ID
-def get_doctor_by_id(doctor_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT user_id, name FROM doctors WHERE user_id = ?', (doctor_id,))
-        doctor = c.fetchone()
-        return doctor
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching doctor {doctor_id}: {e}")
-        return None
-    finally:
-        conn.close()
+# (first day, day after last) of a calendar page, or None past the horizon
+def calendar_page_range(page, today=None):
+    today = today or date.today()
+    start = today + timedelta(days=page * CALENDAR_PAGE_DAYS)
+    end = min(start + timedelta(days=CALENDAR_PAGE_DAYS), horizon_end(today))
+    return (start, end) if page >= 0 and start < end else None
 
-# Get user bookings
-def get_user_bookings(user_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status FROM bookings WHERE user_id = ? AND confirmed = 1', (user_id,))
-        bookings = c.fetchall()
-        return bookings
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching bookings for user {user_id}: {e}")
-        return []
-    finally:
-        conn.close()
+# Short-lived cache of calendar pages keyed by (doctor_id, first day); filled on demand and by prefetch
+class SlotPageCache:
+    def __init__(self, ttl_seconds, max_size=2000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._pages = OrderedDict()
+        # Bumped by invalidate(); a prefetch that read the database before the bump must not store its page
+        self._generations = Counter()
 
-# Get all bookings
-def get_all_bookings():
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status FROM bookings WHERE confirmed = 1')
-        bookings = c.fetchall()
-        return bookings
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching all bookings: {e}")
-        return []
-    finally:
-        conn.close()
+    def get(self, doctor_id, start_day):
+        entry = self._pages.get((doctor_id, start_day))
+        if not entry or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
 
-# Get booking by ID
-def get_booking_by_id(booking_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status FROM bookings WHERE id = ?', (booking_id,))
-        booking = c.fetchone()
-        return booking
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching booking {booking_id}: {e}")
-        return None
-    finally:
-        conn.close()
+    def generation(self, doctor_id):
+        return self._generations[doctor_id]
 
-# Get all users
-def get_all_users():
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT user_id, is_caregiver, linked_patient, language FROM users')
-        users = c.fetchall()
-        return users
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching users: {e}")
-        return []
-    finally:
-        conn.close()
+    def put(self, doctor_id, start_day, slots, generation=None):
+        if generation is not None and generation != self._generations[doctor_id]:
+            return
+        self._pages[(doctor_id, start_day)] = (time.monotonic() + self.ttl_seconds, slots)
+        self._pages.move_to_end((doctor_id, start_day))
+        while len(self._pages) > self.max_size:
+            self._pages.popitem(last=False)
 
-# Get user by ID
-def get_user_by_id(user_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT user_id, is_caregiver, linked_patient, language FROM users WHERE user_id = ?', (user_id,))
-        user = c.fetchone()
-        return user
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching user {user_id}: {e}")
-        return None
-    finally:
-        conn.close()
+    def invalidate(self, doctor_id):
+        self._generations[doctor_id] += 1
+        for key in [key for key in self._pages if key[0] == doctor_id]:
+            del self._pages[key]
 
-# Get available slots for all doctors
-def get_available_slots_for_all_doctors():
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        today = date.today()
-        end_date = today + timedelta(days=7)
-        c.execute('''SELECT ds.booking_date, ds.time_slot, d.name 
-                     FROM doctor_slots ds 
-                     JOIN doctors d ON ds.doctor_id = d.user_id
-                     WHERE ds.is_available = 1 
-                     AND ds.booking_date >= ? AND ds.booking_date <= ?
-                     ORDER BY ds.booking_date, ds.time_slot''', 
-                     (today.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
-        slots = c.fetchall()
-        return slots
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching all doctor slots: {e}")
-        return []
-    finally:
-        conn.close()
+slot_page_cache = SlotPageCache(SLOT_CACHE_SECONDS)
 
-# Delete user
-def delete_user(user_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-        c.execute('UPDATE bookings SET confirmed = 0 WHERE user_id = ?', (user_id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error deleting user {user_id}: {e}")
-    finally:
-        conn.close()
+async def prefetch_calendar_page(doctor_id, start_day, end_day):
+    if slot_page_cache.get(doctor_id, start_day) is None:
+        generation = slot_page_cache.generation(doctor_id)
+        slots = await asyncio.to_thread(get_available_slots, doctor_id, start_day, end_day)
+        slot_page_cache.put(doctor_id, start_day, slots, generation)
 
-# Get all admins
-def get_all_admins():
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT user_id FROM admins')
-        admins = c.fetchall()
-        return admins
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching admins: {e}")
-        return []
-    finally:
-        conn.close()
+# Fire-and-forget work from handlers. Goes through the application once it is running so shutdown
+# awaits it; before that (or in the benchmarks, which never start it) it is a plain loop task
+# kept referenced in background_tasks until it finishes.
+background_tasks = set()
 
-# Add admin
-def add_admin(admin_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (admin_id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error adding admin {admin_id}: {e}")
-    finally:
-        conn.close()
+def create_background_task(application, coroutine):
+    if application.running:
+        return application.create_task(coroutine)
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
-# Remove admin
-def remove_admin(admin_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('DELETE FROM admins WHERE user_id = ?', (admin_id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error removing admin {admin_id}: {e}")
-    finally:
-        conn.close()
+# Waiting patients per (doctor_id, day_key) as min-heaps of (waitlist_id, user_id), so the next
+# waiter for a freed slot is found in O(log n). Loaded from the waitlist table on first use.
+# Offers pop from the database writer's thread while handlers push from the loop, hence the lock.
+class WaitlistQueue:
+    def __init__(self):
+        self.loaded = False
+        self._heaps = {}
+        self._lock = threading.Lock()
 
-# Cancel booking
-def cancel_booking(booking_id):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        c.execute('SELECT booking_date, time_slot, doctor_id, status, confirmed, patient_name, user_id FROM bookings WHERE id = ?', (booking_id,))
-        booking = c.fetchone()
-        if not booking:
-            logger.error(f"Booking ID {booking_id} not found")
-            return False, "Booking not found."
-        if booking[4] == 0 or booking[3] == 'cancelled':
-            logger.warning(f"Booking ID {booking_id} is already cancelled")
-            return False, "Booking is already cancelled."
-        
-        c.execute('UPDATE bookings SET confirmed = 0, status = ? WHERE id = ?', ('cancelled', booking_id))
-        c.execute('UPDATE doctor_slots SET is_available = 1 WHERE booking_date = ? AND time_slot = ? AND doctor_id = ?',
-                  (booking[0], booking[1], booking[2]))
-        conn.commit()
-        return True, booking
-    except sqlite3.Error as e:
-        logger.error(f"Error cancelling booking {booking_id}: {e}")
-        return False, str(e)
-    finally:
-        conn.close()
+    def load(self, rows):
+        for waitlist_id, user_id, doctor_id, day_key in rows:
+            self.push(doctor_id, day_key, waitlist_id, user_id)
+        self.loaded = True
 
-# Log support request
-def log_support_request(user_id, message):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
-    try:
-        c = conn.cursor()
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        c.execute('INSERT INTO support_requests (user_id, message, timestamp, status) VALUES (?, ?, ?, ?)',
-                  (user_id, message, timestamp, 'open'))
-        conn.commit()
+    def push(self, doctor_id, day_key, waitlist_id, user_id):
+        with self._lock:
+            heapq.heappush(self._heaps.setdefault((doctor_id, day_key), []), (waitlist_id, user_id))
+
+    def pop(self, doctor_id, day_key):
+        with self._lock:
+            heap = self._heaps.get((doctor_id, day_key))
+            if not heap:
+                return None
+            entry = heapq.heappop(heap)
+            if not heap:
+                del self._heaps[(doctor_id, day_key)]
+            return entry
+
+    def has_waiters(self, doctor_id, day_key):
+        return bool(self._heaps.get((doctor_id, day_key)))
+
+    def discard_before(self, day_key):
+        with self._lock:
+            for key in [key for key in self._heaps if key[1] < day_key]:
+                del self._heaps[key]
+
+    def __len__(self):
+        return sum(len(heap) for heap in self._heaps.values())
+
+waitlist_queue = WaitlistQueue()
+
+# Server-side tokens for callback buttons whose payload must not come from the client.
+# Tokens are issued in expiry order, so expired ones are always at the front.
+class CallbackTokenStore:
+    def __init__(self, ttl_seconds, max_size=100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._tokens = OrderedDict()
+
+    def _evict(self, now):
+        while self._tokens:
+            expires_at, _, _ = next(iter(self._tokens.values()))
+            if expires_at > now and len(self._tokens) < self.max_size:
+                break
+            self._tokens.popitem(last=False)
+
+    def issue(self, user_id, payload):
+        now = time.monotonic()
+        self._evict(now)
+        token = secrets.token_urlsafe(6)
+        while token in self._tokens:
+            token = secrets.token_urlsafe(6)
+        self._tokens[token] = (now + self.ttl_seconds, user_id, payload)
+        return token
+
+    def resolve(self, user_id, token):
+        entry = self._tokens.get(token)
+        if not entry or entry[0] <= time.monotonic() or entry[1] != user_id:
+            return None
+        return entry[2]
+
+callback_tokens = CallbackTokenStore(CALLBACK_TOKEN_TTL_MINUTES * 60)
+
+# Short-lived in-memory holds on slots a patient has selected but not booked yet. One booking hold per user,
+# plus one hold per open waitlist offer kept apart from it, so an offer never replaces the slot a patient is
+# typing details for. Expiries sit in a heap so lapsed holds are dropped without scanning.
+class SlotHoldStore:
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._holds = {}
+        self._by_doctor = {}
+        self._by_user = {}
+        self._by_offer = {}
+        self._expiries = []
+
+    def _evict(self, now):
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, key, user_id = heapq.heappop(self._expiries)
+            if self._holds.get(key, ())[:2] == (expires_at, user_id):
+                self._drop(key)
+
+    def _add(self, key, expires_at, user_id, waitlist_id=None):
+        self._holds[key] = (expires_at, user_id, waitlist_id)
+        self._by_doctor.setdefault(key[0], set()).add(key[1])
+        if waitlist_id is None:
+            self._by_user[user_id] = key
+        else:
+            self._by_offer[waitlist_id] = key
+        heapq.heappush(self._expiries, (expires_at, key, user_id))
+
+    def _drop(self, key):
+        _, user_id, waitlist_id = self._holds.pop(key)
+        if waitlist_id is None:
+            self._by_user.pop(user_id, None)
+        else:
+            self._by_offer.pop(waitlist_id, None)
+        doctor_holds = self._by_doctor[key[0]]
+        doctor_holds.discard(key[1])
+        if not doctor_holds:
+            del self._by_doctor[key[0]]
+
+    # False if another user holds the slot; replaces the user's previous booking hold
+    def hold(self, user_id, doctor_id, slot_key):
+        now = time.monotonic()
+        self._evict(now)
+        key = (doctor_id, slot_key)
+        current = self._holds.get(key)
+        if current and current[1] != user_id:
+            return False
+        self.release(user_id)
+        # The user's own waitlist offer already keeps the slot until it is booked or lapses
+        if not (current and current[2] is not None):
+            self._add(key, now + self.ttl_seconds, user_id)
         return True
-    except sqlite3.Error as e:
-        logger.error(f"Error logging support request for user {user_id}: {e}")
-        return False
-    finally:
-        conn.close()
 
-# Get system stats
-def get_system_stats():
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
+    # Keep an offered slot for the waitlisted user without touching their booking hold; False if already held
+    def hold_offer(self, waitlist_id, user_id, doctor_id, slot_key, ttl_seconds):
+        now = time.monotonic()
+        self._evict(now)
+        key = (doctor_id, slot_key)
+        if key in self._holds:
+            return False
+        self._add(key, now + ttl_seconds, user_id, waitlist_id)
+        return True
+
+    def release(self, user_id):
+        key = self._by_user.get(user_id)
+        if key:
+            self._drop(key)
+
+    def release_offer(self, waitlist_id):
+        key = self._by_offer.get(waitlist_id)
+        if key:
+            self._drop(key)
+
+    def holder(self, doctor_id, slot_key):
+        self._evict(time.monotonic())
+        current = self._holds.get((doctor_id, slot_key))
+        return current[1] if current else None
+
+    def is_held_by_other(self, doctor_id, slot_key, user_id):
+        holder = self.holder(doctor_id, slot_key)
+        return holder is not None and holder != user_id
+
+    # Slot keys of the doctor held by anyone but user_id
+    def held_by_others(self, doctor_id, user_id):
+        self._evict(time.monotonic())
+        return {slot_key for slot_key in self._by_doctor.get(doctor_id, ())
+                if self._holds[(doctor_id, slot_key)][1] != user_id}
+
+    def __len__(self):
+        self._evict(time.monotonic())
+        return len(self._holds)
+
+slot_holds = SlotHoldStore(SLOT_HOLD_MINUTES * 60)
+
+# Compact callback data for booking buttons: '<action code>:<base-36 booking id>'
+BOOKING_CALLBACK_CODES = {'cancel': 'c', 'approve': 'ba', 'reject': 'br', 'admin_view': 'ab', 'admin_cancel': 'ac'}
+BOOKING_CALLBACK_ACTIONS = {code: action for action, code in BOOKING_CALLBACK_CODES.items()}
+# Formats used before compact callbacks; still accepted for buttons already sent
+LEGACY_BOOKING_CALLBACKS = {'approve_booking_': 'approve', 'reject_booking_': 'reject', 'admin_booking_': 'admin_view',
+                            'admin_cancel_': 'admin_cancel', 'cancel_': 'cancel'}
+
+def to_base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    encoded = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        encoded = digits[remainder] + encoded
+        if not number:
+            return encoded
+
+def booking_callback(action, booking_id):
+    return f"{BOOKING_CALLBACK_CODES[action]}:{to_base36(booking_id)}"
+
+# Returns (action, booking_id), or (None, None) if data is not a booking button
+def parse_booking_callback(data):
+    code, sep, encoded = data.partition(':')
     try:
-        c = conn.cursor()
-        c.execute('SELECT COUNT(*) FROM bookings WHERE confirmed = 1')
-        total_bookings = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM users')
-        active_users = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM admins')
-        total_admins = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM doctors')
-        total_doctors = c.fetchone()[0]
-        return {
-            'total_bookings': total_bookings,
-            'active_users': active_users,
-            'total_admins': total_admins,
-            'total_doctors': total_doctors
-        }
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching system stats: {e}")
-        return {'total_bookings': 0, 'active_users': 0, 'total_admins': 0, 'total_doctors': 0}
-    finally:
-        conn.close()
+        if sep and code in BOOKING_CALLBACK_ACTIONS:
+            return BOOKING_CALLBACK_ACTIONS[code], int(encoded, 36)
+        for prefix, action in LEGACY_BOOKING_CALLBACKS.items():
+            if data.startswith(prefix):
+                return action, int(data[len(prefix):])
+    except ValueError:
+        pass
+    return None, None
 
-# Language selection command
-async def language(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    logger.info(f"User {user_id} issued /language command")
-    keyboard = [[InlineKeyboardButton(name, callback_data=f'lang_{code}')] for code, name in LANGUAGES.items()]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    lang = context.user_data.get('language', get_user_language(user_id))
-    await update.message.reply_text(
-        get_message('select_language', lang),
-        reply_markup=reply_markup
-    )
-    return SELECT_LANGUAGE
+# Single writer for the hot write paths. Operations are plain functions taking a cursor; whatever is queued
+# while a transaction runs is committed together in the next one (group commit), so a burst pays for one
+# WAL lock and one fsync instead of one per write. Each operation runs inside its own SAVEPOINT, so one that
+# raises is rolled back alone and only its caller sees the error. Before start() (scripts, benchmarks)
+# submit() runs the operation in its own transaction on a worker thread.
+class DbWriter:
+    def __init__(self, path='doctomed.db', max_batch=200):
+        self.path = path
+        self.max_batch = max_batch
+        self.counters = Counter()
+        self._conn = None
+        self._queue = None
+        self._task = None
+        self._stopping = False
 
-# Start command
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    logger.info(f"User {user_id} started the bot")
-    context.user_data.clear()  # Reset state on /start
+    def _connect(self):
+        # Only the writer task touches this connection, one transaction at a time, from worker threads
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    async def start(self):
+        self._conn = await asyncio.to_thread(self._connect)
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    # Commits everything submitted so far, then closes the connection
+    async def stop(self):
+        if not self._task or self._stopping:
+            return
+        # Nothing queued behind the sentinel would ever run, so later submits go straight to the database
+        self._stopping = True
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        self._conn.close()
+        self._conn = None
+
+    async def submit(self, operation, *args):
+        if not self._task or self._stopping:
+            return await asyncio.to_thread(self._execute_alone, operation, args)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, args, future))
+        return await future
+
+    def _execute_alone(self, operation, args):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                result = operation(c, *args)
+                c.execute('COMMIT')
+                return result
+            except BaseException:
+                c.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            stopping = None in batch
+            batch = [entry for entry in batch if entry is not None]
+            if not batch:
+                continue
+            try:
+                outcomes = await asyncio.to_thread(self._commit, batch)
+            except Exception as e:
+                outcomes = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    # Runs on a worker thread; returns (ok, result or exception) per operation
+    def _commit(self, batch):
+        c = self._conn.cursor()
+        started = time.perf_counter()
+        c.execute('BEGIN IMMEDIATE')
+        outcomes = []
+        try:
+            for operation, args, _ in batch:
+                c.execute('SAVEPOINT op')
+                try:
+                    outcomes.append((True, operation(c, *args)))
+                    c.execute('RELEASE op')
+                except Exception as e:
+                    c.execute('ROLLBACK TO op')
+                    c.execute('RELEASE op')
+                    outcomes.append((False, e))
+            c.execute('COMMIT')
+        except sqlite3.Error as e:
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            if self._conn.in_transaction:
+                c.execute('ROLLBACK')
+            return [(False, e)] * len(batch)
+        self.counters['commits'] += 1
+        self.counters['writes'] += len(batch)
+        logger.debug(f"Committed {len(batch)} writes in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return outcomes
+
+db_writer = DbWriter(max_batch=DB_WRITER_MAX_BATCH)
+
+# Read-only connections, one per thread of a bounded executor. Queries are functions taking a cursor, like
+# DbWriter operations; independent ones can be awaited together with asyncio.gather, and under WAL they read
+# a snapshot instead of waiting for the writer. sqlite3.Error propagates to the caller.
+class ReadPool:
+    def __init__(self, path='doctomed.db', size=4):
+        self.path = path
+        self.size = size
+        self._executor = None
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=10, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, query, args):
+        c = self._connection().cursor()
+        try:
+            return query(c, *args)
+        finally:
+            c.close()
+
+    async def run(self, query, *args):
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='db-read')
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, query, args)
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+db_reader = ReadPool(size=DB_READ_POOL_SIZE)
+
+# Cursor-level queries and writes used by SQLiteStorage and run on db_reader or db_writer
+def read_user_language(c, user_id):
+    c.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
+    result = c.fetchone()
+    return result[0] if result and result[0] in LANGUAGES else 'en'
+
+def store_user_language(c, user_id, language):
+    c.execute('UPDATE users SET language = ? WHERE user_id = ?', (language, user_id))
+    if c.rowcount == 0:
+        c.execute('INSERT INTO users (user_id, language) VALUES (?, ?)', (user_id, language))
+
+def store_admin(c, admin_id):
+    c.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (admin_id,))
+
+def delete_admin(c, admin_id):
+    c.execute('DELETE FROM admins WHERE user_id = ?', (admin_id,))
+
+def store_user(c, user_id, is_caregiver, linked_patient, language):
+    c.execute('INSERT OR REPLACE INTO users (user_id, is_caregiver, linked_patient, language) VALUES (?, ?, ?, ?)',
+              (user_id, is_caregiver, linked_patient, language))
+
+def store_user_details(c, user_id, is_caregiver, linked_patient):
+    c.execute('UPDATE users SET is_caregiver = ?, linked_patient = ? WHERE user_id = ?', (is_caregiver, linked_patient, user_id))
+
+# True if the user existed; their bookings stop counting as confirmed
+def delete_user_rows(c, user_id):
+    c.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+    deleted = c.rowcount > 0
+    c.execute('UPDATE bookings SET confirmed = 0 WHERE user_id = ?', (user_id,))
+    return deleted
+
+def store_doctor(c, doctor_id, name):
+    c.execute('INSERT OR IGNORE INTO doctors (user_id, name) VALUES (?, ?)', (doctor_id, name))
+
+# Replaces the hours of the given weekdays
+def store_doctor_hours(c, doctor_id, weekdays, time_slots):
+    c.execute(f"DELETE FROM doctor_hours WHERE doctor_id = ? AND weekday IN ({','.join('?' * len(weekdays))})",
+              (doctor_id, *weekdays))
+    c.executemany('INSERT INTO doctor_hours (doctor_id, weekday, time_slot) VALUES (?, ?, ?)',
+                  [(doctor_id, weekday, time_slot) for weekday in weekdays for time_slot in set(time_slots)])
+
+def store_slot_exception(c, doctor_id, day_key, time_slot, kind):
+    c.execute('INSERT OR IGNORE INTO slot_exceptions (doctor_id, day_key, time_slot, kind) VALUES (?, ?, ?, ?)',
+              (doctor_id, day_key, time_slot, kind))
+
+# Minutes after midnight of an 'HH:MM' slot
+def time_slot_minutes(time_slot):
+    hours, minutes = time_slot.split(':')
+    return int(hours) * 60 + int(minutes)
+
+# Slot keys a doctor works in [start_key, end_key), from the weekly hours, the exceptions and legacy
+# doctor_slots rows, booked or not; nothing is materialized per day
+def scheduled_slot_keys(c, doctor_id, start_key, end_key):
+    first_day = start_key - start_key % 1440
+    c.execute('SELECT weekday, time_slot FROM doctor_hours WHERE doctor_id = ?', (doctor_id,))
+    hours = {}
+    for weekday, time_slot in c.fetchall():
+        hours.setdefault(weekday, []).append(time_slot_minutes(time_slot))
+    open_keys = set()
+    if hours:
+        for day_key in range(first_day, end_key, 1440):
+            for minutes in hours.get(from_slot_key(day_key).weekday(), ()):
+                open_keys.add(day_key + minutes)
+    c.execute('SELECT slot_key FROM doctor_slots WHERE doctor_id = ? AND slot_key >= ? AND slot_key < ? AND is_available = 1',
+              (doctor_id, start_key, end_key))
+    open_keys.update(row[0] for row in c.fetchall())
+    c.execute('SELECT day_key, time_slot, kind FROM slot_exceptions WHERE doctor_id = ? AND day_key >= ? AND day_key < ?',
+              (doctor_id, first_day, end_key))
+    exceptions = c.fetchall()
+    days_off = {day_key for day_key, time_slot, kind in exceptions if kind == 'off' and time_slot is None}
+    if days_off:
+        open_keys = {slot_key for slot_key in open_keys if slot_key - slot_key % 1440 not in days_off}
+    open_keys.difference_update(day_key + time_slot_minutes(time_slot) for day_key, time_slot, kind in exceptions
+                                if kind == 'off' and time_slot is not None)
+    open_keys.update(day_key + time_slot_minutes(time_slot) for day_key, time_slot, kind in exceptions if kind == 'extra')
+    return {slot_key for slot_key in open_keys if start_key <= slot_key < end_key}
+
+# Open slot keys of a doctor in [start_key, end_key): the scheduled ones without a confirmed booking
+def open_slot_keys(c, doctor_id, start_key, end_key):
+    open_keys = scheduled_slot_keys(c, doctor_id, start_key, end_key)
+    c.execute('SELECT slot_key FROM bookings WHERE doctor_id = ? AND slot_key >= ? AND slot_key < ? AND confirmed = 1',
+              (doctor_id, start_key, end_key))
+    open_keys.difference_update(row[0] for row in c.fetchall())
+    return sorted(open_keys)
+
+# Same rules as open_slot_keys for a single slot, using the caller's cursor so it can run inside a transaction
+def slot_is_open(c, doctor_id, slot_key):
+    params = {'doctor_id': doctor_id, 'slot_key': slot_key, 'day_key': slot_key - slot_key % 1440,
+              'weekday': from_slot_key(slot_key).weekday(), 'time_slot': from_slot_key(slot_key).strftime('%H:%M')}
+    c.execute('''SELECT (EXISTS (SELECT 1 FROM slot_exceptions WHERE doctor_id = :doctor_id AND day_key = :day_key
+                                 AND kind = 'extra' AND time_slot = :time_slot)
+                         OR ((EXISTS (SELECT 1 FROM doctor_hours WHERE doctor_id = :doctor_id AND weekday = :weekday
+                                      AND time_slot = :time_slot)
+                              OR EXISTS (SELECT 1 FROM doctor_slots WHERE doctor_id = :doctor_id AND slot_key = :slot_key
+                                         AND is_available = 1))
+                             AND NOT EXISTS (SELECT 1 FROM slot_exceptions WHERE doctor_id = :doctor_id AND day_key = :day_key
+                                             AND kind = 'off' AND (time_slot IS NULL OR time_slot = :time_slot))))
+                    AND NOT EXISTS (SELECT 1 FROM bookings WHERE doctor_id = :doctor_id AND slot_key = :slot_key
+                                    AND confirmed = 1)''', params)
+    return bool(c.fetchone()[0])
+
+def read_doctor(c, doctor_id):
+    c.execute('SELECT user_id, name FROM doctors WHERE user_id = ?', (doctor_id,))
+    return c.fetchone()
+
+def read_booking(c, booking_id):
+    c.execute('SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, slot_key FROM bookings WHERE id = ?', (booking_id,))
+    return c.fetchone()
+
+# With user_id only that user's booking can be cancelled; someone else's is reported as not found.
+# With notify_doctor the doctor's notice is queued in the outbox in the same transaction.
+def write_cancel_booking(c, booking_id, user_id=None, notify_doctor=False):
+    owner_filter, params = ('', (booking_id,)) if user_id is None else (' AND user_id = ?', (booking_id, user_id))
+    c.execute(f'SELECT booking_date, time_slot, doctor_id, status, confirmed, patient_name, user_id, slot_key FROM bookings WHERE id = ?{owner_filter}', params)
+    booking = c.fetchone()
+    if not booking:
+        logger.error(f"Booking ID {booking_id} not found" + (f" for user {user_id}" if user_id is not None else ""))
+        return False, "Booking not found."
+    if booking[4] == 0 or booking[3] == 'cancelled':
+        logger.warning(f"Booking ID {booking_id} is already cancelled")
+        return False, "Booking is already cancelled."
     
-    # Check if user exists and has a language preference
-    user = get_user_by_id(user_id)
-    if user and user[3]:  # user[3] is the language column
-        context.user_data['language'] = user[3]
-        await show_main_menu(update, context)
-    else:
-        # Prompt for language selection
-        keyboard = [[InlineKeyboardButton(name, callback_data=f'lang_{code}')] for code, name in LANGUAGES.items()]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            get_message('select_language', 'en'),
-            reply_markup=reply_markup
-        )
-        return SELECT_LANGUAGE
+    c.execute(f'UPDATE bookings SET confirmed = 0, status = ? WHERE id = ?{owner_filter}', ('cancelled', *params))
+    c.execute('UPDATE doctor_slots SET is_available = 1 WHERE doctor_id = ? AND slot_key = ?',
+              (booking[2], booking[7]))
+    if notify_doctor:
+        enqueue_outbox_batch(c, [cancel_notice(booking_id, booking[2], read_user_language(c, booking[2]), booking[5], booking[0], booking[1])])
+    return True, booking
+
+# Saved patients as (id, patient_name, patient_dob), most recently booked first. A caregiver's linked patient
+# that has not been booked yet follows as (None, linked_patient, None), since its date of birth is unknown.
+def read_patient_profiles(c, user_id):
+    c.execute('''SELECT id, patient_name, patient_dob FROM patient_profiles WHERE user_id = ?
+                 ORDER BY last_used DESC, id DESC LIMIT ?''', (user_id, PATIENT_PROFILE_LIMIT))
+    profiles = c.fetchall()
+    c.execute('SELECT linked_patient FROM users WHERE user_id = ?', (user_id,))
+    row = c.fetchone()
+    if row and row[0] and len(profiles) < PATIENT_PROFILE_LIMIT and all(profile[1] != row[0] for profile in profiles):
+        profiles.append((None, row[0], None))
+    return profiles
+
+def read_patient_profile(c, user_id, profile_id):
+    c.execute('SELECT patient_name, patient_dob FROM patient_profiles WHERE id = ? AND user_id = ?', (profile_id, user_id))
+    return c.fetchone()
+
+def store_patient_profile(c, user_id, patient_name, patient_dob):
+    c.execute('''INSERT INTO patient_profiles (user_id, patient_name, patient_dob, last_used) VALUES (?, ?, ?, ?)
+                 ON CONFLICT (user_id, patient_name, patient_dob) DO UPDATE SET last_used = excluded.last_used''',
+              (user_id, patient_name, patient_dob, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+# A booking request: the open-slot check, the insert, the saved patient and notices(booking_id) share one
+# transaction. With waitlist_id the user's offer for the slot must still be live. Returns the booking id,
+# or None if the slot or the offer is gone.
+def write_booking(c, user_id, patient_name, patient_dob, doctor_id, slot_key, waitlist_id, notices):
+    if not slot_is_open(c, doctor_id, slot_key):
+        return None
+    # An offer that lapsed while the patient was typing may already belong to the next waiter
+    if waitlist_id:
+        c.execute('''UPDATE waitlist SET status = 'booked'
+                     WHERE id = ? AND user_id = ? AND offer_slot_key = ? AND status = 'offered' AND offer_expires_at > ?''',
+                  (waitlist_id, user_id, slot_key, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        if c.rowcount == 0:
+            return None
+    c.execute('INSERT INTO bookings (user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, confirmed, created_at, slot_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+              (user_id, patient_name, patient_dob, from_slot_key(slot_key).strftime('%H:%M'), from_slot_key(slot_key).strftime('%Y-%m-%d'),
+               doctor_id, 'pending', 0, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), slot_key))
+    booking_id = c.lastrowid
+    store_patient_profile(c, user_id, patient_name, patient_dob)
+    enqueue_outbox_batch(c, notices(booking_id))
+    return booking_id
+
+# Approve or reject one booking with its notices; False if it was no longer pending, so a second tap changes nothing
+def write_booking_decision(c, booking_id, approve, notices):
+    status, confirmed = ('approved', 1) if approve else ('rejected', 0)
+    c.execute("UPDATE bookings SET status = ?, confirmed = ? WHERE id = ? AND status = 'pending' RETURNING doctor_id, slot_key",
+              (status, confirmed, booking_id))
+    decided = c.fetchall()
+    if not decided:
+        return False
+    if approve:
+        c.execute('UPDATE doctor_slots SET is_available = 0 WHERE doctor_id = ? AND slot_key = ?', decided[0])
+    enqueue_outbox_batch(c, notices)
+    return True
+
+# Data access for admins, users, doctors, slots, bookings, support requests, the waitlist and the outbox.
+# Module-level functions such as get_booking_by_id delegate to `storage`, so handlers do not depend on how the
+# data is stored. Reads log errors and return an empty result, like the functions they back. Writes are
+# coroutines; the ones a handler reports on raise, the rest log and return an empty result too. Writes that
+# queue notifications take or build outbox messages (see outbox_message) and store them in the same
+# transaction. SQLiteStorage is what the bot runs on; MemoryStorage keeps the same data in dicts.
+class Storage(ABC):
+    # Admins
+    @abstractmethod
+    def is_admin(self, user_id): ...
+
+    @abstractmethod
+    def get_admins(self): ...
+
+    @abstractmethod
+    async def add_admin(self, admin_id): ...
+
+    @abstractmethod
+    async def remove_admin(self, admin_id): ...
+
+    # Users as (user_id, is_caregiver, linked_patient, language)
+    @abstractmethod
+    def get_user(self, user_id): ...
+
+    @abstractmethod
+    def get_users(self): ...
+
+    @abstractmethod
+    async def save_user(self, user_id, is_caregiver, linked_patient, language): ...
+
+    @abstractmethod
+    async def update_user(self, user_id, is_caregiver, linked_patient): ...
+
+    # True if the user existed
+    @abstractmethod
+    async def delete_user(self, user_id): ...
+
+    @abstractmethod
+    def get_user_language(self, user_id): ...
+
+    @abstractmethod
+    def get_user_languages(self, user_ids): ...
+
+    @abstractmethod
+    async def set_user_language(self, user_id, language): ...
+
+    # Saved patients, see read_patient_profiles; they are stored with each booking request
+    @abstractmethod
+    def get_patient_profiles(self, user_id): ...
+
+    # (patient_name, patient_dob) of one of the user's saved patients, or None
+    @abstractmethod
+    def get_patient_profile(self, user_id, profile_id): ...
+
+    # Doctors as (user_id, name)
+    @abstractmethod
+    def get_doctors(self): ...
+
+    @abstractmethod
+    def get_doctor(self, doctor_id): ...
+
+    @abstractmethod
+    def get_doctor_id_by_name(self, name): ...
+
+    @abstractmethod
+    async def add_doctor(self, doctor_id, name): ...
+
+    # Open slots in [start_key, end_key) as (slot_key, doctor_id, doctor_name), by slot and name;
+    # doctor_ids=None means every doctor
+    @abstractmethod
+    def get_open_slots(self, doctor_ids, start_key, end_key): ...
+
+    # Day numbers (slot_key // 1440) in [start_key, end_key) on which the doctor has any slot, booked or not
+    @abstractmethod
+    def get_working_days(self, doctor_id, start_key, end_key): ...
+
+    # Replaces the hours of the given weekdays
+    @abstractmethod
+    async def set_doctor_hours(self, doctor_id, weekdays, time_slots): ...
+
+    @abstractmethod
+    async def add_slot_exception(self, doctor_id, day_key, time_slot, kind): ...
+
+    # Bookings as (id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, slot_key)
+    @abstractmethod
+    def get_booking(self, booking_id): ...
+
+    @abstractmethod
+    def get_user_bookings(self, user_id): ...
+
+    @abstractmethod
+    def get_confirmed_bookings(self): ...
+
+    # (id, patient_name, booking_date, time_slot), earliest slot first
+    @abstractmethod
+    def get_pending_bookings(self, doctor_id, limit): ...
+
+    # Every word of `text` must match a word of the patient name as a prefix; newest first as
+    # (id, patient_name, booking_date, time_slot, status)
+    @abstractmethod
+    def search_bookings(self, text, limit, offset): ...
+
+    # A pending request for an open slot, see write_booking; the booking id, or None if the slot or the offer is gone
+    @abstractmethod
+    async def create_booking(self, user_id, patient_name, patient_dob, doctor_id, slot_key, waitlist_id, notices): ...
+
+    # Approve or reject a pending booking with its notices; False if it was already decided
+    @abstractmethod
+    async def decide_booking(self, booking_id, approve, notices): ...
+
+    # Several of a doctor's pending bookings at once, see write_decisions; None on error
+    @abstractmethod
+    async def decide_bookings(self, doctor_id, booking_ids, approve): ...
+
+    # (True, (booking_date, time_slot, doctor_id, status, confirmed, patient_name, user_id, slot_key)) or (False, reason);
+    # user_id restricts it to that user's booking, notify_doctor queues the doctor's notice with the cancellation
+    @abstractmethod
+    async def cancel_booking(self, booking_id, user_id=None, notify_doctor=False): ...
+
+    # Expire pending bookings created before cutoff with notices to both sides, oldest first; the expired rows as
+    # (id, user_id, patient_name, time_slot, booking_date, doctor_id, user_language, doctor_language)
+    @abstractmethod
+    async def expire_pending_bookings(self, cutoff, limit): ...
+
+    # Queue the agenda of every doctor with approved or pending bookings on `day`; the number of doctors
+    @abstractmethod
+    async def queue_doctor_digests(self, day): ...
+
+    # Archive finished bookings and past slots; drop old outbox rows and past waitlist entries and exceptions.
+    # Returns the counts as {'bookings': ..., 'slots': ..., 'outbox': ...}
+    @abstractmethod
+    async def archive_history(self, batch_size): ...
+
+    # Support requests as (id, user_id, message, timestamp, status), searched like bookings
+    @abstractmethod
+    def search_support_requests(self, text, limit, offset): ...
+
+    @abstractmethod
+    async def add_support_request(self, user_id, message): ...
+
+    # {'total_bookings': confirmed bookings, 'active_users': ..., 'total_admins': ..., 'total_doctors': ...}
+    @abstractmethod
+    def get_system_stats(self): ...
+
+    # Waiting entries from day_key on as (id, user_id, doctor_id, day_key); None on error
+    @abstractmethod
+    def get_waitlist(self, day_key): ...
+
+    # (waitlist_id, joined); joined is False if the user was already waiting
+    @abstractmethod
+    async def add_waitlist_entry(self, user_id, doctor_id, day_key): ...
+
+    # Offer an open slot to the next entry of waitlist_queue and queue the offer; (waitlist_id, user_id) or None
+    @abstractmethod
+    async def offer_waitlist_slot(self, doctor_id, slot_key): ...
+
+    # (doctor_id, slot_key) of a live offer for user_id whose slot is still open, else None
+    @abstractmethod
+    def get_waitlist_offer(self, waitlist_id, user_id): ...
+
+    # Expire lapsed offers and waiting entries before today; (waitlist_id, user_id, doctor_id, slot_key) of the offers
+    @abstractmethod
+    async def expire_waitlist_offers(self): ...
+
+    # Outbox for OutboxRelay: rows left in 'sending' go back to 'pending' at start (the count is returned);
+    # claimed rows are (id, chat_id, text, reply_markup JSON, priority, kind, booking_id), highest priority first
+    @abstractmethod
+    async def reset_outbox(self): ...
+
+    @abstractmethod
+    async def claim_outbox(self, limit): ...
+
+    # Marks a claimed row sent, or failed with the error
+    @abstractmethod
+    async def finish_outbox(self, outbox_id, error): ...
+
+    # A doctor notification failed for good: queue notices to the patient and the admins
+    @abstractmethod
+    async def report_outbox_failure(self, booking_id, doctor_id, error): ...
+
+    # Rows still pending or being sent
+    @abstractmethod
+    def count_pending_outbox(self): ...
+
+    # Run a read method where it does not block the event loop, so independent reads can be gathered
+    async def fetch(self, method, *args):
+        return getattr(self, method)(*args)
+
+class SQLiteStorage(Storage):
+    # Reads that run on the read-only connection pool, by method name
+    POOL_QUERIES = {'get_booking': read_booking, 'get_doctor': read_doctor, 'get_user_language': read_user_language,
+                    'get_patient_profiles': read_patient_profiles, 'get_patient_profile': read_patient_profile}
+
+    def __init__(self, path='doctomed.db'):
+        self.path = path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    # Run a cursor function on a connection of its own; sqlite3.Error propagates
+    def _read(self, query, *args):
+        conn = self._connect()
+        try:
+            return query(conn.cursor(), *args)
+        finally:
+            conn.close()
+
+    # Run a cursor function on the writer, in a group commit with other writes; sqlite3.Error propagates
+    async def _write(self, operation, *args):
+        return await db_writer.submit(operation, *args)
+
+    def is_admin(self, user_id):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT user_id FROM admins WHERE user_id = ?', (user_id,))
+            result = c.fetchone()
+            return result is not None
+        except sqlite3.Error as e:
+            logger.error(f"Error checking admin status for user {user_id}: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def get_admins(self):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT user_id FROM admins')
+            admins = c.fetchall()
+            return admins
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching admins: {e}")
+            return []
+        finally:
+            conn.close()
+
+    async def add_admin(self, admin_id):
+        try:
+            await self._write(store_admin, admin_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error adding admin {admin_id}: {e}")
+
+    async def remove_admin(self, admin_id):
+        try:
+            await self._write(delete_admin, admin_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error removing admin {admin_id}: {e}")
+
+    def get_user(self, user_id):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT user_id, is_caregiver, linked_patient, language FROM users WHERE user_id = ?', (user_id,))
+            user = c.fetchone()
+            return user
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching user {user_id}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_users(self):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT user_id, is_caregiver, linked_patient, language FROM users')
+            users = c.fetchall()
+            return users
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching users: {e}")
+            return []
+        finally:
+            conn.close()
+
+    async def save_user(self, user_id, is_caregiver, linked_patient, language):
+        await self._write(store_user, user_id, is_caregiver, linked_patient, language)
+
+    async def update_user(self, user_id, is_caregiver, linked_patient):
+        await self._write(store_user_details, user_id, is_caregiver, linked_patient)
+
+    async def delete_user(self, user_id):
+        try:
+            return await self._write(delete_user_rows, user_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting user {user_id}: {e}")
+            return False
+
+    def get_user_language(self, user_id):
+        conn = self._connect()
+        try:
+            return read_user_language(conn.cursor(), user_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching language for user {user_id}: {e}")
+            return 'en'
+        finally:
+            conn.close()
+
+    def get_user_languages(self, user_ids):
+        languages = {user_id: 'en' for user_id in user_ids}
+        if not languages:
+            return languages
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute(f"SELECT user_id, language FROM users WHERE user_id IN ({','.join('?' * len(languages))})",
+                      list(languages))
+            for user_id, language in c.fetchall():
+                if language in LANGUAGES:
+                    languages[user_id] = language
+            return languages
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching languages for users {list(languages)}: {e}")
+            return languages
+        finally:
+            conn.close()
+
+    async def set_user_language(self, user_id, language):
+        try:
+            await self._write(store_user_language, user_id, language)
+        except sqlite3.Error as e:
+            logger.error(f"Error setting language for user {user_id}: {e}")
+
+    def get_patient_profiles(self, user_id):
+        conn = self._connect()
+        try:
+            return read_patient_profiles(conn.cursor(), user_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching patient profiles for user {user_id}: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_patient_profile(self, user_id, profile_id):
+        conn = self._connect()
+        try:
+            return read_patient_profile(conn.cursor(), user_id, profile_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching patient profile {profile_id} for user {user_id}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_doctors(self):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT user_id, name FROM doctors')
+            doctors = c.fetchall()
+            return doctors
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching doctors: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_doctor(self, doctor_id):
+        conn = self._connect()
+        try:
+            return read_doctor(conn.cursor(), doctor_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching doctor {doctor_id}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_doctor_id_by_name(self, name):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT user_id FROM doctors WHERE name = ?', (name,))
+            doctor = c.fetchone()
+            return doctor[0] if doctor else None
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching doctor by name {name}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    async def add_doctor(self, doctor_id, name):
+        await self._write(store_doctor, doctor_id, name)
+
+    def get_open_slots(self, doctor_ids, start_key, end_key):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            if doctor_ids is None:
+                c.execute('SELECT user_id, name FROM doctors')
+            else:
+                c.execute(f"SELECT user_id, name FROM doctors WHERE user_id IN ({','.join('?' * len(doctor_ids))})", list(doctor_ids))
+            slots = []
+            for doctor_id, name in c.fetchall():
+                slots.extend((slot_key, doctor_id, name) for slot_key in open_slot_keys(c, doctor_id, start_key, end_key))
+            slots.sort(key=lambda slot: (slot[0], slot[2]))
+            return slots
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching slots for doctors {doctor_ids or 'all'}: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_working_days(self, doctor_id, start_key, end_key):
+        conn = self._connect()
+        try:
+            return {slot_key // 1440 for slot_key in scheduled_slot_keys(conn.cursor(), doctor_id, start_key, end_key)}
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching working days of doctor {doctor_id}: {e}")
+            return set()
+        finally:
+            conn.close()
+
+    async def set_doctor_hours(self, doctor_id, weekdays, time_slots):
+        await self._write(store_doctor_hours, doctor_id, weekdays, time_slots)
+
+    async def add_slot_exception(self, doctor_id, day_key, time_slot, kind):
+        await self._write(store_slot_exception, doctor_id, day_key, time_slot, kind)
+
+    def get_booking(self, booking_id):
+        conn = self._connect()
+        try:
+            return read_booking(conn.cursor(), booking_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching booking {booking_id}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_user_bookings(self, user_id):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, slot_key FROM bookings WHERE user_id = ? AND confirmed = 1 ORDER BY slot_key', (user_id,))
+            bookings = c.fetchall()
+            return bookings
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching bookings for user {user_id}: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_confirmed_bookings(self):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, slot_key FROM bookings WHERE confirmed = 1 ORDER BY slot_key')
+            bookings = c.fetchall()
+            return bookings
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching all bookings: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_pending_bookings(self, doctor_id, limit):
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('''SELECT id, patient_name, booking_date, time_slot FROM bookings
+                         WHERE doctor_id = ? AND status = 'pending'
+                         ORDER BY slot_key, id LIMIT ?''', (doctor_id, limit))
+            return c.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching pending bookings for doctor {doctor_id}: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def search_bookings(self, text, limit, offset):
+        try:
+            return self._read(read_booking_search, text, limit, offset)
+        except sqlite3.Error as e:
+            logger.error(f"Error searching bookings for {text!r}: {e}")
+            return []
+
+    async def create_booking(self, user_id, patient_name, patient_dob, doctor_id, slot_key, waitlist_id, notices):
+        return await self._write(write_booking, user_id, patient_name, patient_dob, doctor_id, slot_key, waitlist_id, notices)
+
+    async def decide_booking(self, booking_id, approve, notices):
+        return await self._write(write_booking_decision, booking_id, approve, notices)
+
+    async def decide_bookings(self, doctor_id, booking_ids, approve):
+        try:
+            return await self._write(write_decisions, doctor_id, booking_ids, approve)
+        except sqlite3.Error as e:
+            logger.error(f"Error deciding bookings {booking_ids} for doctor {doctor_id}: {e}")
+            return None
+
+    async def cancel_booking(self, booking_id, user_id=None, notify_doctor=False):
+        try:
+            return await self._write(write_cancel_booking, booking_id, user_id, notify_doctor)
+        except sqlite3.Error as e:
+            logger.error(f"Error cancelling booking {booking_id}: {e}")
+            return False, str(e)
+
+    async def expire_pending_bookings(self, cutoff, limit):
+        try:
+            return await self._write(write_pending_expiry, cutoff, limit)
+        except sqlite3.Error as e:
+            logger.error(f"Error expiring stale bookings: {e}")
+            return []
+
+    async def queue_doctor_digests(self, day):
+        try:
+            return await self._write(write_doctor_digests, day)
+        except sqlite3.Error as e:
+            logger.error(f"Error building doctor digests for {day}: {e}")
+            return 0
+
+    # One writer operation per batch, so the writer is never held for a whole sweep
+    async def archive_history(self, batch_size):
+        archived = {'bookings': 0, 'slots': 0, 'outbox': 0}
+        try:
+            today_key = day_slot_key(date.today())
+            archived_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for kind, operation in (('bookings', write_bookings_archive_batch), ('slots', write_slots_archive_batch)):
+                while True:
+                    moved = await self._write(operation, today_key, archived_at, batch_size)
+                    archived[kind] += moved
+                    if moved < batch_size:
+                        break
+            outbox_cutoff = (datetime.now() - timedelta(days=OUTBOX_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+            archived['outbox'] = await self._write(write_history_cleanup, today_key, outbox_cutoff)
+            if archived['bookings'] or archived['slots'] or archived['outbox']:
+                await self._write(write_incremental_vacuum)
+            for table in ('bookings', 'support_requests'):
+                try:
+                    await self._write(write_fts_optimize, table)
+                except sqlite3.OperationalError as e:
+                    logger.debug(f"Skipping full-text optimize for {table}: {e}")
+            return archived
+        except sqlite3.Error as e:
+            logger.error(f"Error archiving history: {e}")
+            return archived
+
+    def search_support_requests(self, text, limit, offset):
+        try:
+            return self._read(read_support_request_search, text, limit, offset)
+        except sqlite3.Error as e:
+            logger.error(f"Error searching support requests for {text!r}: {e}")
+            return []
+
+    async def add_support_request(self, user_id, message):
+        try:
+            await self._write(write_support_request, user_id, message)
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error logging support request for user {user_id}: {e}")
+            return False
+
+    def get_system_stats(self):
+        try:
+            return self._read(read_system_stats)
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching system stats: {e}")
+            return {'total_bookings': 0, 'active_users': 0, 'total_admins': 0, 'total_doctors': 0}
+
+    def get_waitlist(self, day_key):
+        try:
+            return self._read(read_waitlist, day_key)
+        except sqlite3.Error as e:
+            logger.error(f"Error loading waitlist: {e}")
+            return None
+
+    async def add_waitlist_entry(self, user_id, doctor_id, day_key):
+        try:
+            return await self._write(write_waitlist_entry, user_id, doctor_id, day_key)
+        except sqlite3.Error as e:
+            logger.error(f"Error adding user {user_id} to the waitlist of doctor {doctor_id}: {e}")
+            return None, False
+
+    async def offer_waitlist_slot(self, doctor_id, slot_key):
+        try:
+            return await self._write(write_waitlist_offer, doctor_id, slot_key)
+        except sqlite3.Error as e:
+            logger.error(f"Error offering slot {slot_key} of doctor {doctor_id} to the waitlist: {e}")
+            return None
+
+    def get_waitlist_offer(self, waitlist_id, user_id):
+        try:
+            return self._read(read_waitlist_offer, waitlist_id, user_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching waitlist offer {waitlist_id}: {e}")
+            return None
+
+    async def expire_waitlist_offers(self):
+        try:
+            return await self._write(write_waitlist_expiry)
+        except sqlite3.Error as e:
+            logger.error(f"Error expiring waitlist offers: {e}")
+            return []
+
+    async def reset_outbox(self):
+        try:
+            return await self._write(write_outbox_reset)
+        except sqlite3.Error as e:
+            logger.error(f"Error resetting outbox: {e}")
+            return 0
+
+    async def claim_outbox(self, limit):
+        try:
+            return await self._write(write_outbox_claim, limit)
+        except sqlite3.Error as e:
+            logger.error(f"Error claiming outbox rows: {e}")
+            return []
+
+    async def finish_outbox(self, outbox_id, error):
+        try:
+            await self._write(write_outbox_result, outbox_id, error)
+        except sqlite3.Error as e:
+            logger.error(f"Error updating outbox row {outbox_id}: {e}")
+
+    async def report_outbox_failure(self, booking_id, doctor_id, error):
+        try:
+            await self._write(write_outbox_failure, booking_id, doctor_id, error)
+        except sqlite3.Error as e:
+            logger.error(f"Error reporting failed notification for booking {booking_id}: {e}")
+
+    def count_pending_outbox(self):
+        try:
+            return self._read(read_pending_outbox_count)
+        except sqlite3.Error as e:
+            logger.error(f"Error counting outbox rows: {e}")
+            return 0
+
+    async def fetch(self, method, *args):
+        query = self.POOL_QUERIES.get(method)
+        if query:
+            return await db_reader.run(query, *args)
+        return await asyncio.to_thread(getattr(self, method), *args)
+
+# The bot's data in dicts and sets, with the indexes the queries need. It answers the same reads and makes the
+# same writes as SQLiteStorage, queueing the same outbox messages, so handlers and benchmarks can run without
+# SQLite; nothing is persisted, load() starts it from an SQLite database.
+class MemoryStorage(Storage):
+    def __init__(self):
+        self._admins = set()
+        self._users = {}
+        self._doctors = {}
+        self._hours = {}
+        self._legacy_slots = {}
+        self._exceptions = {}
+        self._bookings = {}
+        self._booking_created_at = {}
+        self._bookings_by_user = {}
+        self._pending_by_doctor = {}
+        self._confirmed_slots = {}
+        self._patient_profiles = {}
+        self._support_requests = {}
+        self._waitlist = {}
+        # Outbox rows by id; _outbox_queue holds (priority, id) of pending rows, _outbox_open the pending or sending ids
+        self._outbox = {}
+        self._outbox_keys = set()
+        self._outbox_queue = []
+        self._outbox_open = set()
+        self._bookings_archive = {}
+        self._slots_archive = []
+        self._last_ids = Counter()
+        # Search tokens by text, and the ids of the rows containing each token, per searchable table
+        self._search_words = {}
+        self._word_index = {'bookings': {}, 'support_requests': {}}
+
+    # Copy every table from an SQLite database
+    @classmethod
+    def load(cls, path='doctomed.db'):
+        storage = cls()
+        conn = sqlite3.connect(path, timeout=10)
+        try:
+            c = conn.cursor()
+            storage._admins.update(row[0] for row in c.execute('SELECT user_id FROM admins'))
+            for user_id, is_caregiver, linked_patient, language in c.execute('SELECT user_id, is_caregiver, linked_patient, language FROM users'):
+                storage._users[user_id] = (user_id, is_caregiver, linked_patient, language)
+            storage._doctors.update(c.execute('SELECT user_id, name FROM doctors'))
+            for doctor_id, weekday, time_slot in c.execute('SELECT doctor_id, weekday, time_slot FROM doctor_hours'):
+                storage._hours.setdefault(doctor_id, {}).setdefault(weekday, set()).add(time_slot_minutes(time_slot))
+            # Duplicate rows for a slot are open if any of them is, as in scheduled_slot_keys
+            for doctor_id, slot_key, is_available in c.execute('SELECT doctor_id, slot_key, is_available FROM doctor_slots'):
+                slots = storage._legacy_slots.setdefault(doctor_id, {})
+                slots[slot_key] = slots.get(slot_key, False) or bool(is_available)
+            for doctor_id, day_key, time_slot, kind in c.execute('SELECT doctor_id, day_key, time_slot, kind FROM slot_exceptions'):
+                storage._add_slot_exception(doctor_id, day_key, time_slot, kind)
+            for row in c.execute('''SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, slot_key, confirmed,
+                                           created_at FROM bookings'''):
+                storage._add_booking(row[:9], row[9])
+                storage._booking_created_at[row[0]] = row[10]
+                storage._index_words('bookings', row[0], row[2])
+            for profile_id, user_id, patient_name, patient_dob, last_used in c.execute(
+                    'SELECT id, user_id, patient_name, patient_dob, last_used FROM patient_profiles'):
+                storage._patient_profiles.setdefault(user_id, {})[(patient_name, patient_dob)] = (profile_id, last_used)
+            for row in c.execute('SELECT id, user_id, message, timestamp, status FROM support_requests'):
+                storage._support_requests[row[0]] = row
+                storage._index_words('support_requests', row[0], row[2])
+            for row in c.execute('SELECT id, user_id, doctor_id, day_key, status, created_at, offer_slot_key, offer_expires_at FROM waitlist'):
+                storage._waitlist[row[0]] = dict(zip(('id', 'user_id', 'doctor_id', 'day_key', 'status', 'created_at',
+                                                      'offer_slot_key', 'offer_expires_at'), row))
+            for row in c.execute('''SELECT id, dedup_key, chat_id, text, reply_markup, priority, kind, booking_id, status, attempts,
+                                           last_error, created_at, sent_at FROM outbox'''):
+                storage._store_outbox_row(dict(zip(('id', 'dedup_key', 'chat_id', 'text', 'reply_markup', 'priority', 'kind', 'booking_id',
+                                                    'status', 'attempts', 'last_error', 'created_at', 'sent_at'), row)))
+            for table in ('bookings', 'support_requests', 'waitlist', 'outbox', 'patient_profiles'):
+                c.execute(f'SELECT MAX(id) FROM {table}')
+                storage._last_ids[table] = c.fetchone()[0] or 0
+            c.execute('SELECT MAX(id) FROM bookings_archive')
+            storage._last_ids['bookings'] = max(storage._last_ids['bookings'], c.fetchone()[0] or 0)
+        finally:
+            conn.close()
+        return storage
+
+    def _new_id(self, table):
+        self._last_ids[table] += 1
+        return self._last_ids[table]
+
+    def _add_booking(self, booking, confirmed):
+        booking_id, user_id, doctor_id, slot_key = booking[0], booking[1], booking[6], booking[8]
+        self._bookings[booking_id] = (tuple(booking), bool(confirmed))
+        self._bookings_by_user.setdefault(user_id, set()).add(booking_id)
+        if booking[7] == 'pending':
+            bisect.insort(self._pending_by_doctor.setdefault(doctor_id, []), (slot_key, booking_id))
+        if confirmed:
+            self._confirmed_slots.setdefault(doctor_id, Counter())[slot_key] += 1
+
+    # Takes a booking out of every index; returns (booking, confirmed)
+    def _remove_booking(self, booking_id):
+        booking, confirmed = self._bookings.pop(booking_id)
+        user_id, doctor_id, slot_key = booking[1], booking[6], booking[8]
+        self._bookings_by_user[user_id].discard(booking_id)
+        if booking[7] == 'pending':
+            self._pending_by_doctor[doctor_id].remove((slot_key, booking_id))
+        if confirmed:
+            self._confirmed_slots[doctor_id][slot_key] -= 1
+        return booking, confirmed
+
+    def _update_booking(self, booking_id, status, confirmed):
+        booking, _ = self._remove_booking(booking_id)
+        self._add_booking(booking[:7] + (status,) + booking[8:], confirmed)
+
+    # Test and benchmark setup: set the status of bookings without notices
+    def set_booking_status(self, booking_ids, status, confirmed):
+        for booking_id in booking_ids:
+            if booking_id in self._bookings:
+                self._update_booking(booking_id, status, confirmed)
+
+    def _add_slot_exception(self, doctor_id, day_key, time_slot, kind):
+        exceptions = self._exceptions.setdefault(doctor_id, {}).setdefault(day_key, [])
+        if (time_slot, kind) not in exceptions:
+            exceptions.append((time_slot, kind))
+
+    # Legacy doctor_slots rows follow the bookings, like the UPDATEs on SQLite; slots without a row stay without one
+    def _set_legacy_slot(self, doctor_id, slot_key, available):
+        slots = self._legacy_slots.get(doctor_id, {})
+        if slot_key in slots:
+            slots[slot_key] = available
+
+    # The stored language, or 'en' if there is none, like COALESCE(u.language, 'en')
+    def _language(self, user_id):
+        user = self._users.get(user_id)
+        return user[3] if user and user[3] is not None else 'en'
+
+    def _store_outbox_row(self, row):
+        self._outbox[row['id']] = row
+        self._outbox_keys.add(row['dedup_key'])
+        if row['status'] in ('pending', 'sending'):
+            self._outbox_open.add(row['id'])
+        if row['status'] == 'pending':
+            heapq.heappush(self._outbox_queue, (row['priority'], row['id']))
+
+    # Same as enqueue_outbox_batch: a dedup_key that is already queued is ignored
+    def _enqueue_outbox(self, messages):
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for dedup_key, chat_id, text, priority, reply_markup, kind, booking_id in messages:
+            if dedup_key in self._outbox_keys:
+                continue
+            self._store_outbox_row({'id': self._new_id('outbox'), 'dedup_key': dedup_key, 'chat_id': chat_id, 'text': text,
+                                    'reply_markup': reply_markup.to_json() if reply_markup else None, 'priority': priority,
+                                    'kind': kind, 'booking_id': booking_id, 'status': 'pending', 'attempts': 0,
+                                    'last_error': None, 'created_at': created_at, 'sent_at': None})
+
+    def is_admin(self, user_id):
+        return user_id in self._admins
+
+    def get_admins(self):
+        return [(admin_id,) for admin_id in self._admins]
+
+    async def add_admin(self, admin_id):
+        self._admins.add(admin_id)
+
+    async def remove_admin(self, admin_id):
+        self._admins.discard(admin_id)
+
+    def get_user(self, user_id):
+        return self._users.get(user_id)
+
+    def get_users(self):
+        return list(self._users.values())
+
+    async def save_user(self, user_id, is_caregiver, linked_patient, language):
+        self._users[user_id] = (user_id, is_caregiver, linked_patient, language)
+
+    async def update_user(self, user_id, is_caregiver, linked_patient):
+        if user_id in self._users:
+            self._users[user_id] = (user_id, is_caregiver, linked_patient, self._users[user_id][3])
+
+    async def delete_user(self, user_id):
+        deleted = self._users.pop(user_id, None) is not None
+        for booking_id in list(self._bookings_by_user.get(user_id, ())):
+            booking, confirmed = self._bookings[booking_id]
+            if confirmed:
+                self._update_booking(booking_id, booking[7], False)
+        return deleted
+
+    def get_user_language(self, user_id):
+        user = self._users.get(user_id)
+        return user[3] if user and user[3] in LANGUAGES else 'en'
+
+    def get_user_languages(self, user_ids):
+        return {user_id: self.get_user_language(user_id) for user_id in user_ids}
+
+    async def set_user_language(self, user_id, language):
+        user = self._users.get(user_id, (user_id, None, None, None))
+        self._users[user_id] = user[:3] + (language,)
+
+    def get_patient_profiles(self, user_id):
+        profiles = sorted(self._patient_profiles.get(user_id, {}).items(), key=lambda item: (item[1][1], item[1][0]),
+                          reverse=True)[:PATIENT_PROFILE_LIMIT]
+        profiles = [(profile_id, name, dob) for (name, dob), (profile_id, _) in profiles]
+        user = self._users.get(user_id)
+        if user and user[2] and len(profiles) < PATIENT_PROFILE_LIMIT and all(profile[1] != user[2] for profile in profiles):
+            profiles.append((None, user[2], None))
+        return profiles
+
+    def get_patient_profile(self, user_id, profile_id):
+        for patient, (saved_id, _) in self._patient_profiles.get(user_id, {}).items():
+            if saved_id == profile_id:
+                return patient
+        return None
+
+    def _store_patient_profile(self, user_id, patient_name, patient_dob):
+        profiles = self._patient_profiles.setdefault(user_id, {})
+        saved = profiles.get((patient_name, patient_dob))
+        profile_id = saved[0] if saved else self._new_id('patient_profiles')
+        profiles[(patient_name, patient_dob)] = (profile_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    def get_doctors(self):
+        return list(self._doctors.items())
+
+    def get_doctor(self, doctor_id):
+        return (doctor_id, self._doctors[doctor_id]) if doctor_id in self._doctors else None
+
+    def get_doctor_id_by_name(self, name):
+        return next((doctor_id for doctor_id, doctor_name in self._doctors.items() if doctor_name == name), None)
+
+    async def add_doctor(self, doctor_id, name):
+        self._doctors.setdefault(doctor_id, name)
+
+    # Same rules as scheduled_slot_keys
+    def _scheduled_slot_keys(self, doctor_id, start_key, end_key):
+        first_day = start_key - start_key % 1440
+        open_keys = set()
+        hours = self._hours.get(doctor_id)
+        if hours:
+            for day_key in range(first_day, end_key, 1440):
+                open_keys.update(day_key + minutes for minutes in hours.get(from_slot_key(day_key).weekday(), ()))
+        open_keys.update(slot_key for slot_key, available in self._legacy_slots.get(doctor_id, {}).items()
+                         if available and start_key <= slot_key < end_key)
+        exceptions = self._exceptions.get(doctor_id, {})
+        for day_key in range(first_day, end_key, 1440):
+            for time_slot, kind in exceptions.get(day_key, ()):
+                if kind == 'off' and time_slot is None:
+                    open_keys = {slot_key for slot_key in open_keys if not day_key <= slot_key < day_key + 1440}
+                elif kind == 'off':
+                    open_keys.discard(day_key + time_slot_minutes(time_slot))
+            open_keys.update(day_key + time_slot_minutes(time_slot) for time_slot, kind in exceptions.get(day_key, ()) if kind == 'extra')
+        return {slot_key for slot_key in open_keys if start_key <= slot_key < end_key}
+
+    def _open_slot_keys(self, doctor_id, start_key, end_key):
+        confirmed = self._confirmed_slots.get(doctor_id, {})
+        return sorted(slot_key for slot_key in self._scheduled_slot_keys(doctor_id, start_key, end_key) if not confirmed.get(slot_key))
+
+    def _slot_is_open(self, doctor_id, slot_key):
+        return bool(self._open_slot_keys(doctor_id, slot_key, slot_key + 1))
+
+    def get_open_slots(self, doctor_ids, start_key, end_key):
+        doctor_ids = self._doctors if doctor_ids is None else [doctor_id for doctor_id in doctor_ids if doctor_id in self._doctors]
+        slots = [(slot_key, doctor_id, self._doctors[doctor_id]) for doctor_id in doctor_ids
+                 for slot_key in self._open_slot_keys(doctor_id, start_key, end_key)]
+        slots.sort(key=lambda slot: (slot[0], slot[2]))
+        return slots
+
+    def get_working_days(self, doctor_id, start_key, end_key):
+        return {slot_key // 1440 for slot_key in self._scheduled_slot_keys(doctor_id, start_key, end_key)}
+
+    async def set_doctor_hours(self, doctor_id, weekdays, time_slots):
+        hours = self._hours.setdefault(doctor_id, {})
+        for weekday in weekdays:
+            hours[weekday] = {time_slot_minutes(time_slot) for time_slot in time_slots}
+
+    async def add_slot_exception(self, doctor_id, day_key, time_slot, kind):
+        self._add_slot_exception(doctor_id, day_key, time_slot, kind)
+
+    def get_booking(self, booking_id):
+        entry = self._bookings.get(booking_id)
+        return entry[0] if entry else None
+
+    def get_user_bookings(self, user_id):
+        bookings = [self._bookings[booking_id] for booking_id in self._bookings_by_user.get(user_id, ())]
+        return sorted((booking for booking, confirmed in bookings if confirmed), key=lambda booking: booking[8])
+
+    def get_confirmed_bookings(self):
+        return sorted((booking for booking, confirmed in self._bookings.values() if confirmed), key=lambda booking: booking[8])
+
+    def get_pending_bookings(self, doctor_id, limit):
+        pending = [self._bookings[booking_id][0] for _, booking_id in self._pending_by_doctor.get(doctor_id, [])[:limit]]
+        return [(booking[0], booking[2], booking[5], booking[4]) for booking in pending]
+
+    # Words as the full-text index sees them: case and diacritics folded, split on anything but letters and digits
+    def _search_tokens(self, text):
+        tokens = self._search_words.get(text)
+        if tokens is None:
+            folded = unicodedata.normalize('NFKD', (text or '').casefold())
+            tokens = self._search_words[text] = re.findall(r'[^\W_]+', ''.join(char for char in folded if not unicodedata.combining(char)))
+        return tokens
+
+    def _index_words(self, table, row_id, text, add=True):
+        index = self._word_index[table]
+        for token in set(self._search_tokens(text)):
+            if add:
+                index.setdefault(token, set()).add(row_id)
+            else:
+                index[token].discard(row_id)
+
+    # Same matching as fts_query: every word of the query is a phrase whose last token is a prefix.
+    # Returns the matching ids, newest first; text_of gives the searched text of a row id.
+    def _search(self, table, text, text_of, limit, offset):
+        terms = [tokens for tokens in map(self._search_tokens, text.split()) if tokens]
+        if not terms:
+            return []
+        index = self._word_index[table]
+        candidates = None
+        for term in terms:
+            # Tokens before the last one of a phrase match whole words
+            if len(term) == 1:
+                ids = set().union(*(ids for word, ids in index.items() if word.startswith(term[0])))
+            else:
+                ids = index.get(term[0], set())
+            candidates = ids if candidates is None else candidates & ids
+
+        def matches(row_id):
+            tokens = self._search_tokens(text_of(row_id))
+            return all(any(tokens[i:i + len(term) - 1] == term[:-1] and tokens[i + len(term) - 1].startswith(term[-1])
+                           for i in range(len(tokens) - len(term) + 1))
+                       for term in terms)
+        return list(islice((row_id for row_id in sorted(candidates, reverse=True) if matches(row_id)), offset, offset + limit))
+
+    def search_bookings(self, text, limit, offset):
+        bookings = [self._bookings[booking_id][0]
+                    for booking_id in self._search('bookings', text, lambda booking_id: self._bookings[booking_id][0][2], limit, offset)]
+        return [(booking[0], booking[2], booking[5], booking[4], booking[7]) for booking in bookings]
+
+    async def create_booking(self, user_id, patient_name, patient_dob, doctor_id, slot_key, waitlist_id, notices):
+        if not self._slot_is_open(doctor_id, slot_key):
+            return None
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if waitlist_id:
+            entry = self._waitlist.get(waitlist_id)
+            if not (entry and entry['user_id'] == user_id and entry['offer_slot_key'] == slot_key and entry['status'] == 'offered'
+                    and entry['offer_expires_at'] > now):
+                return None
+        booking_id = self._new_id('bookings')
+        messages = notices(booking_id)
+        if waitlist_id:
+            entry['status'] = 'booked'
+        self._add_booking((booking_id, user_id, patient_name, patient_dob, from_slot_key(slot_key).strftime('%H:%M'),
+                           from_slot_key(slot_key).strftime('%Y-%m-%d'), doctor_id, 'pending', slot_key), False)
+        self._booking_created_at[booking_id] = now
+        self._index_words('bookings', booking_id, patient_name)
+        self._store_patient_profile(user_id, patient_name, patient_dob)
+        self._enqueue_outbox(messages)
+        return booking_id
+
+    async def decide_booking(self, booking_id, approve, notices):
+        entry = self._bookings.get(booking_id)
+        if not entry or entry[0][7] != 'pending':
+            return False
+        self._update_booking(booking_id, 'approved' if approve else 'rejected', approve)
+        if approve:
+            self._set_legacy_slot(entry[0][6], entry[0][8], False)
+        self._enqueue_outbox(notices)
+        return True
+
+    # Same rules as write_decisions
+    async def decide_bookings(self, doctor_id, booking_ids, approve):
+        doctor_name = self._doctors.get(doctor_id, "Doctor")
+        decided = sorted((self._bookings[booking_id][0] for booking_id in set(booking_ids)
+                          if booking_id in self._bookings and self._bookings[booking_id][0][6] == doctor_id
+                          and self._bookings[booking_id][0][7] == 'pending'),
+                         key=lambda booking: (booking[8], booking[0]))
+        if approve:
+            taken = {slot_key for slot_key, count in self._confirmed_slots.get(doctor_id, {}).items() if count}
+            approved = []
+            for booking in decided:
+                if booking[8] not in taken:
+                    taken.add(booking[8])
+                    approved.append(booking)
+            decided = approved
+        for booking in decided:
+            self._update_booking(booking[0], 'approved' if approve else 'rejected', approve)
+            if approve:
+                self._set_legacy_slot(doctor_id, booking[8], False)
+        self._enqueue_outbox([decision_notice(booking[0], booking[1], self._language(booking[1]), booking[2], booking[5], booking[4],
+                                              booking[8], doctor_name, approve)
+                              for booking in decided])
+        return [(booking[0], booking[8]) for booking in decided], len(booking_ids) - len(decided)
+
+    async def cancel_booking(self, booking_id, user_id=None, notify_doctor=False):
+        entry = self._bookings.get(booking_id)
+        if not entry or (user_id is not None and entry[0][1] != user_id):
+            logger.error(f"Booking ID {booking_id} not found" + (f" for user {user_id}" if user_id is not None else ""))
+            return False, "Booking not found."
+        booking, confirmed = entry
+        if not confirmed or booking[7] == 'cancelled':
+            logger.warning(f"Booking ID {booking_id} is already cancelled")
+            return False, "Booking is already cancelled."
+        self._update_booking(booking_id, 'cancelled', False)
+        self._set_legacy_slot(booking[6], booking[8], True)
+        if notify_doctor:
+            self._enqueue_outbox([cancel_notice(booking_id, booking[6], self.get_user_language(booking[6]), booking[2], booking[5], booking[4])])
+        return True, (booking[5], booking[4], booking[6], booking[7], int(confirmed), booking[2], booking[1], booking[8])
+
+    async def expire_pending_bookings(self, cutoff, limit):
+        pending = sorted((self._booking_created_at.get(booking_id) or '', booking_id) for booking_id, (booking, _) in self._bookings.items()
+                         if booking[7] == 'pending' and (self._booking_created_at.get(booking_id) or '') < cutoff)
+        expired = []
+        for _, booking_id in pending[:limit]:
+            booking = self._bookings[booking_id][0]
+            expired.append((booking_id, booking[1], booking[2], booking[4], booking[5], booking[6],
+                            self._language(booking[1]), self._language(booking[6])))
+            self._update_booking(booking_id, 'expired', False)
+        for booking_id, user_id, patient_name, time_slot, booking_date, doctor_id, user_lang, doctor_lang in expired:
+            self._enqueue_outbox(expiry_notices(booking_id, user_id, user_lang, doctor_id, doctor_lang, patient_name, booking_date, time_slot))
+        return expired
+
+    # Same selection as write_doctor_digests
+    async def queue_doctor_digests(self, day):
+        day_key = day_slot_key(day)
+        bookings = sorted((booking[6], booking[8], booking[0], booking) for booking, confirmed in self._bookings.values()
+                          if day_key <= booking[8] < day_key + 1440
+                          and (booking[7] == 'pending' or (booking[7] == 'approved' and confirmed)))
+        digests = [digest_notice(doctor_id, self._language(doctor_id), day,
+                                 [(booking[7], booking[4], booking[2], booking[3]) for _, _, _, booking in rows])
+                   for doctor_id, rows in groupby(bookings, key=lambda row: row[0])]
+        self._enqueue_outbox(digests)
+        return len(digests)
+
+    # Same rows as the SQLite archive; there is no writer to hold, so batch_size is not needed
+    async def archive_history(self, batch_size):
+        today_key = day_slot_key(date.today())
+        archived_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        finished = [booking_id for booking_id, (booking, _) in self._bookings.items()
+                    if booking[7] in ('cancelled', 'rejected', 'expired') or booking[8] < today_key]
+        for booking_id in finished:
+            booking, confirmed = self._remove_booking(booking_id)
+            self._index_words('bookings', booking_id, booking[2], add=False)
+            self._bookings_archive[booking_id] = (booking, confirmed, self._booking_created_at.pop(booking_id, None), archived_at)
+        slots = 0
+        for doctor_id, doctor_slots in self._legacy_slots.items():
+            for slot_key in [slot_key for slot_key in doctor_slots if slot_key < today_key]:
+                self._slots_archive.append((doctor_id, slot_key, doctor_slots.pop(slot_key), archived_at))
+                slots += 1
+        outbox_cutoff = (datetime.now() - timedelta(days=OUTBOX_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+        old_outbox = [row for row in self._outbox.values() if row['status'] in ('sent', 'failed') and row['created_at'] < outbox_cutoff]
+        for row in old_outbox:
+            del self._outbox[row['id']]
+            self._outbox_keys.discard(row['dedup_key'])
+        self._waitlist = {waitlist_id: entry for waitlist_id, entry in self._waitlist.items() if entry['day_key'] >= today_key}
+        for exceptions in self._exceptions.values():
+            for day_key in [day_key for day_key in exceptions if day_key < today_key]:
+                del exceptions[day_key]
+        return {'bookings': len(finished), 'slots': slots, 'outbox': len(old_outbox)}
+
+    def search_support_requests(self, text, limit, offset):
+        return [self._support_requests[request_id]
+                for request_id in self._search('support_requests', text, lambda request_id: self._support_requests[request_id][2], limit, offset)]
+
+    async def add_support_request(self, user_id, message):
+        request_id = self._new_id('support_requests')
+        self._support_requests[request_id] = (request_id, user_id, message, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'open')
+        self._index_words('support_requests', request_id, message)
+        return True
+
+    def get_system_stats(self):
+        return {'total_bookings': sum(1 for _, confirmed in self._bookings.values() if confirmed), 'active_users': len(self._users),
+                'total_admins': len(self._admins), 'total_doctors': len(self._doctors)}
+
+    def get_waitlist(self, day_key):
+        return [(entry['id'], entry['user_id'], entry['doctor_id'], entry['day_key']) for entry in self._waitlist.values()
+                if entry['status'] == 'waiting' and entry['day_key'] >= day_key]
+
+    async def add_waitlist_entry(self, user_id, doctor_id, day_key):
+        for entry in self._waitlist.values():
+            if (entry['doctor_id'], entry['day_key'], entry['user_id']) == (doctor_id, day_key, user_id) and entry['status'] in ('waiting', 'offered'):
+                return entry['id'], False
+        waitlist_id = self._new_id('waitlist')
+        self._waitlist[waitlist_id] = {'id': waitlist_id, 'user_id': user_id, 'doctor_id': doctor_id, 'day_key': day_key, 'status': 'waiting',
+                                       'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'offer_slot_key': None,
+                                       'offer_expires_at': None}
+        return waitlist_id, True
+
+    # Same as write_waitlist_offer
+    async def offer_waitlist_slot(self, doctor_id, slot_key):
+        if doctor_id not in self._doctors or not self._slot_is_open(doctor_id, slot_key):
+            return None
+        day_key = slot_key - slot_key % 1440
+        while True:
+            entry = waitlist_queue.pop(doctor_id, day_key)
+            if not entry:
+                return None
+            waitlist_id, user_id = entry
+            # Entries can be stale in memory, e.g. expired by the sweeper; the stored entry decides
+            waiting = self._waitlist.get(waitlist_id)
+            if waiting and waiting['status'] == 'waiting':
+                break
+        waiting.update(status='offered', offer_slot_key=slot_key,
+                       offer_expires_at=(datetime.now() + timedelta(minutes=WAITLIST_OFFER_MINUTES)).strftime('%Y-%m-%d %H:%M:%S'))
+        self._enqueue_outbox([waitlist_offer_notice(waitlist_id, user_id, self.get_user_language(user_id), self._doctors[doctor_id], slot_key)])
+        return waitlist_id, user_id
+
+    def get_waitlist_offer(self, waitlist_id, user_id):
+        entry = self._waitlist.get(waitlist_id)
+        if not (entry and entry['user_id'] == user_id and entry['status'] == 'offered'
+                and entry['offer_expires_at'] > datetime.now().strftime('%Y-%m-%d %H:%M:%S')):
+            return None
+        return (entry['doctor_id'], entry['offer_slot_key']) if self._slot_is_open(entry['doctor_id'], entry['offer_slot_key']) else None
+
+    async def expire_waitlist_offers(self):
+        now, today_key = datetime.now().strftime('%Y-%m-%d %H:%M:%S'), day_slot_key(date.today())
+        expired = []
+        for entry in self._waitlist.values():
+            if entry['status'] == 'offered' and entry['offer_expires_at'] <= now:
+                expired.append((entry['id'], entry['user_id'], entry['doctor_id'], entry['offer_slot_key']))
+                entry['status'] = 'expired'
+            elif entry['status'] == 'waiting' and entry['day_key'] < today_key:
+                entry['status'] = 'expired'
+        return expired
+
+    async def reset_outbox(self):
+        sending = [row for row in self._outbox.values() if row['status'] == 'sending']
+        for row in sending:
+            row['status'] = 'pending'
+            heapq.heappush(self._outbox_queue, (row['priority'], row['id']))
+        return len(sending)
+
+    async def claim_outbox(self, limit):
+        claimed = []
+        while self._outbox_queue and len(claimed) < limit:
+            _, outbox_id = heapq.heappop(self._outbox_queue)
+            row = self._outbox.get(outbox_id)
+            if row and row['status'] == 'pending':
+                row['status'] = 'sending'
+                row['attempts'] += 1
+                claimed.append((outbox_id, row['chat_id'], row['text'], row['reply_markup'], row['priority'], row['kind'], row['booking_id']))
+        return claimed
+
+    async def finish_outbox(self, outbox_id, error):
+        row = self._outbox.get(outbox_id)
+        if not row:
+            return
+        if error is None:
+            row.update(status='sent', sent_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), last_error=None)
+        else:
+            row.update(status='failed', last_error=error)
+        self._outbox_open.discard(outbox_id)
+
+    async def report_outbox_failure(self, booking_id, doctor_id, error):
+        booking = self.get_booking(booking_id)
+        patient = (booking[1], self._language(booking[1])) if booking else None
+        self._enqueue_outbox(notification_failure_notices(booking_id, doctor_id, error, patient))
+
+    def count_pending_outbox(self):
+        return len(self._outbox_open)
+
+storage = SQLiteStorage()
+
+# Check if user is admin
+def is_admin(user_id):
+    return storage.is_admin(user_id)
+
+# Get user's language preference
+def get_user_language(user_id):
+    return storage.get_user_language(user_id)
+
+# Fetch language preferences for many users in one query
+def get_user_languages(user_ids):
+    return storage.get_user_languages(user_ids)
+
+# Set user's language preference
+async def set_user_language(user_id, language):
+    await storage.set_user_language(user_id, language)
+
+# Get available doctor slots for a specific doctor as (booking_date, time_slot, doctor_name, slot_key)
+def get_available_slots(doctor_id, start_day=None, end_day=None):
+    slots = storage.get_open_slots([doctor_id], day_slot_key(start_day or date.today()), day_slot_key(end_day or horizon_end()))
+    return [(from_slot_key(slot_key).strftime('%Y-%m-%d'), from_slot_key(slot_key).strftime('%H:%M'), name, slot_key)
+            for slot_key, _, name in slots]
+
+# Day numbers in [start_day, end_day) on which the doctor works at all, whether or not the slots are taken
+def get_working_days(doctor_id, start_day, end_day):
+    return storage.get_working_days(doctor_id, day_slot_key(start_day), day_slot_key(end_day))
+
+# True if the doctor has any free slot before end_day; used when the first calendar page is empty
+def has_available_slots(doctor_id, start_day, end_day):
+    return bool(get_available_slots(doctor_id, start_day, end_day))
+
+# Get all doctors
+def get_all_doctors():
+    return storage.get_doctors()
+
+# Get doctor by ID
+def get_doctor_by_id(doctor_id):
+    return storage.get_doctor(doctor_id)
+
+# Get user bookings
+def get_user_bookings(user_id):
+    return storage.get_user_bookings(user_id)
+
+# Get all bookings
+def get_all_bookings():
+    return storage.get_confirmed_bookings()
+
+# Get booking by ID
+def get_booking_by_id(booking_id):
+    return storage.get_booking(booking_id)
+
+# Get all users
+def get_all_users():
+    return storage.get_users()
+
+# Get user by ID
+def get_user_by_id(user_id):
+    return storage.get_user(user_id)
+
+# Get available slots for all doctors
+def get_available_slots_for_all_doctors():
+    today = date.today()
+    slots = storage.get_open_slots(None, day_slot_key(today), day_slot_key(horizon_end(today)))
+    return [(from_slot_key(slot_key).strftime('%Y-%m-%d'), from_slot_key(slot_key).strftime('%H:%M'), name, slot_key)
+            for slot_key, _, name in slots]
+
+# Delete user
+async def delete_user(user_id):
+    return await storage.delete_user(user_id)
+
+# Get all admins
+def get_all_admins():
+    return storage.get_admins()
+
+# Add admin
+async def add_admin(admin_id):
+    await storage.add_admin(admin_id)
+
+# Remove admin
+async def remove_admin(admin_id):
+    await storage.remove_admin(admin_id)
+
+# Cancel booking
+async def cancel_booking(booking_id, user_id=None, notify_doctor=False):
+    return await storage.cancel_booking(booking_id, user_id, notify_doctor)
+
+# A doctor's pending requests, earliest slot first, as (id, patient_name, booking_date, time_slot)
+def get_pending_bookings(doctor_id, limit):
+    return storage.get_pending_bookings(doctor_id, limit)
+
+# Approve or reject several of a doctor's pending bookings in one transaction and queue the patients'
+# notices as one batch. Bookings that are no longer pending, belong to another doctor or (when approving)
+# whose slot is already confirmed are skipped. Returns ([(booking_id, slot_key), ...], skipped) or None on error.
+def write_decisions(c, doctor_id, booking_ids, approve):
+    c.execute('SELECT name FROM doctors WHERE user_id = ?', (doctor_id,))
+    doctor = c.fetchone()
+    doctor_name = doctor[0] if doctor else "Doctor"
+    placeholders = ','.join('?' * len(booking_ids))
+    c.execute(f'''SELECT b.id, b.user_id, b.patient_name, b.booking_date, b.time_slot, b.slot_key, COALESCE(u.language, 'en')
+                  FROM bookings b
+                  LEFT JOIN users u ON u.user_id = b.user_id
+                  WHERE b.id IN ({placeholders}) AND b.doctor_id = ? AND b.status = 'pending'
+                  ORDER BY b.slot_key, b.id''', (*booking_ids, doctor_id))
+    decided = c.fetchall()
+    if approve and decided:
+        # Only one booking per slot can be confirmed, including within the batch
+        c.execute(f"SELECT slot_key FROM bookings WHERE doctor_id = ? AND confirmed = 1 AND slot_key IN ({','.join('?' * len(decided))})",
+                  (doctor_id, *(row[5] for row in decided)))
+        taken = {row[0] for row in c.fetchall()}
+        approved = []
+        for row in decided:
+            if row[5] not in taken:
+                taken.add(row[5])
+                approved.append(row)
+        decided = approved
+    status, confirmed = ('approved', 1) if approve else ('rejected', 0)
+    if decided:
+        c.execute(f"UPDATE bookings SET status = ?, confirmed = ? WHERE id IN ({','.join('?' * len(decided))})",
+                  (status, confirmed, *(row[0] for row in decided)))
+        if approve:
+            c.executemany('UPDATE doctor_slots SET is_available = 0 WHERE doctor_id = ? AND slot_key = ?',
+                          [(doctor_id, row[5]) for row in decided])
+        enqueue_outbox_batch(c, [decision_notice(booking_id, user_id, user_lang, patient_name, booking_date, time_slot, slot_key,
+                                                 doctor_name, approve)
+                                 for booking_id, user_id, patient_name, booking_date, time_slot, slot_key, user_lang in decided])
+    return [(row[0], row[5]) for row in decided], len(booking_ids) - len(decided)
+
+async def decide_bookings(doctor_id, booking_ids, approve):
+    return await storage.decide_bookings(doctor_id, booking_ids, approve)
+
+# Log support request
+def write_support_request(c, user_id, message):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    c.execute('INSERT INTO support_requests (user_id, message, timestamp, status) VALUES (?, ?, ?, ?)',
+              (user_id, message, timestamp, 'open'))
+
+async def log_support_request(user_id, message):
+    return await storage.add_support_request(user_id, message)
+
+# Turn free text into an FTS5 query: every word must match, as a prefix
+def fts_query(text):
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+# Ordering by rowid lets FTS5 stop after one page instead of ranking every hit
+def read_booking_search(c, text, limit, offset):
+    c.execute('''SELECT b.id, b.patient_name, b.booking_date, b.time_slot, b.status
+                 FROM bookings_fts f JOIN bookings b ON b.id = f.rowid
+                 WHERE bookings_fts MATCH ?
+                 ORDER BY f.rowid DESC LIMIT ? OFFSET ?''', (fts_query(text), limit, offset))
+    return c.fetchall()
+
+def read_support_request_search(c, text, limit, offset):
+    c.execute('''SELECT s.id, s.user_id, s.message, s.timestamp, s.status
+                 FROM support_requests_fts f JOIN support_requests s ON s.id = f.rowid
+                 WHERE support_requests_fts MATCH ?
+                 ORDER BY f.rowid DESC LIMIT ? OFFSET ?''', (fts_query(text), limit, offset))
+    return c.fetchall()
+
+# Search bookings by patient name, newest first; fetches one extra row to detect a next page.
+def search_bookings(text, limit, offset=0):
+    return storage.search_bookings(text, limit, offset)
+
+# Search support request messages, newest first
+def search_support_requests(text, limit, offset=0):
+    return storage.search_support_requests(text, limit, offset)
+
+def read_system_stats(c):
+    stats = {}
+    for key, query in (('total_bookings', 'SELECT COUNT(*) FROM bookings WHERE confirmed = 1'),
+                       ('active_users', 'SELECT COUNT(*) FROM users'),
+                       ('total_admins', 'SELECT COUNT(*) FROM admins'),
+                       ('total_doctors', 'SELECT COUNT(*) FROM doctors')):
+        c.execute(query)
+        stats[key] = c.fetchone()[0]
+    return stats
+
+# Get system stats
+def get_system_stats():
+    return storage.get_system_stats()
+
+# Writer operations for archive_history; each batch is its own operation so the writer is never held for long.
+# Both return the number of rows moved.
+def write_bookings_archive_batch(c, today_key, archived_at, batch_size):
+    c.execute('''SELECT id FROM bookings
+                 WHERE status IN ('cancelled', 'rejected', 'expired') OR slot_key < ?
+                 LIMIT ?''', (today_key, batch_size))
+    ids = [row[0] for row in c.fetchall()]
+    if ids:
+        placeholders = ','.join('?' * len(ids))
+        c.execute(f'''INSERT OR REPLACE INTO bookings_archive
+                      (id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, confirmed, created_at, slot_key, archived_at)
+                      SELECT id, user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, confirmed, created_at, slot_key, ?
+                      FROM bookings WHERE id IN ({placeholders})''', (archived_at, *ids))
+        c.execute(f'DELETE FROM bookings WHERE id IN ({placeholders})', ids)
+    return len(ids)
+
+def write_slots_archive_batch(c, today_key, archived_at, batch_size):
+    c.execute('SELECT id FROM doctor_slots WHERE slot_key < ? LIMIT ?', (today_key, batch_size))
+    ids = [row[0] for row in c.fetchall()]
+    if ids:
+        placeholders = ','.join('?' * len(ids))
+        c.execute(f'''INSERT OR REPLACE INTO doctor_slots_archive
+                      (id, booking_date, time_slot, doctor_id, is_available, slot_key, archived_at)
+                      SELECT id, booking_date, time_slot, doctor_id, is_available, slot_key, ?
+                      FROM doctor_slots WHERE id IN ({placeholders})''', (archived_at, *ids))
+        c.execute(f'DELETE FROM doctor_slots WHERE id IN ({placeholders})', ids)
+    return len(ids)
+
+# Returns the number of outbox rows deleted
+def write_history_cleanup(c, today_key, outbox_cutoff):
+    # Delivered and failed notifications are only kept for troubleshooting
+    c.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?", (outbox_cutoff,))
+    deleted = c.rowcount
+    # Waitlist entries are only useful until their day has passed
+    c.execute('DELETE FROM waitlist WHERE day_key < ?', (today_key,))
+    c.execute('DELETE FROM slot_exceptions WHERE day_key < ?', (today_key,))
+    return deleted
+
+def write_incremental_vacuum(c):
+    c.execute('PRAGMA incremental_vacuum').fetchall()
+
+# Merge the full-text index segments left behind by a day of trigger updates
+def write_fts_optimize(c, table):
+    c.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('optimize')")
+
+# Move finished bookings and past slots into the archive tables in batches
+async def archive_history(batch_size=None):
+    return await storage.archive_history(batch_size or ARCHIVE_BATCH_SIZE)
+
+# Writer operation: expire pending bookings created before cutoff and queue both notices; returns the expired rows
+def write_pending_expiry(c, cutoff, limit):
+    c.execute('''SELECT b.id, b.user_id, b.patient_name, b.time_slot, b.booking_date, b.doctor_id,
+                        COALESCE(u.language, 'en'), COALESCE(d.language, 'en')
+                 FROM bookings b
+                 LEFT JOIN users u ON u.user_id = b.user_id
+                 LEFT JOIN users d ON d.user_id = b.doctor_id
+                 WHERE b.status = 'pending' AND b.created_at < ?
+                 ORDER BY b.created_at
+                 LIMIT ?''', (cutoff, limit))
+    expired = c.fetchall()
+    if expired:
+        c.execute(f"UPDATE bookings SET status = 'expired', confirmed = 0 WHERE id IN ({','.join('?' * len(expired))})",
+                  [row[0] for row in expired])
+    for booking_id, user_id, patient_name, time_slot, booking_date, doctor_id, user_lang, doctor_lang in expired:
+        enqueue_outbox_batch(c, expiry_notices(booking_id, user_id, user_lang, doctor_id, doctor_lang, patient_name, booking_date, time_slot))
+    return expired
+
+# Expire pending bookings the doctor never answered; returns the expired rows
+async def expire_stale_bookings(ttl_hours=None, limit=None):
+    ttl_hours = PENDING_TTL_HOURS if ttl_hours is None else ttl_hours
+    cutoff = (datetime.now() - timedelta(hours=ttl_hours)).strftime('%Y-%m-%d %H:%M:%S')
+    return await storage.expire_pending_bookings(cutoff, limit or PENDING_SWEEP_LIMIT)
+
+# Outbound priority lanes; lower values are sent first
+OUTBOUND_BOOKING, OUTBOUND_ADMIN, OUTBOUND_BROADCAST = range(3)
+OUTBOUND_LANES = {OUTBOUND_BOOKING: 'booking', OUTBOUND_ADMIN: 'admin', OUTBOUND_BROADCAST: 'broadcast'}
+
+# Single path for bot-initiated messages: priority lanes, global and per-chat rate limits,
+# RetryAfter handling and jittered retries for network errors.
+class OutboundSender:
+    def __init__(self, global_rate, chat_rate, workers, max_retries):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.workers = workers
+        self.max_retries = max_retries
+        self.counters = Counter()
+        self.latencies = deque(maxlen=1000)
+        self.depth = Counter()
+        self._bot = None
+        self._queue = None
+        self._tasks = []
+        self._seq = 0
+        self._tokens = global_rate
+        self._updated = 0.0
+        self._global_lock = None
+        self._chat_ready = {}
+        self._idle = None
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    async def start(self, bot):
+        if self.running:
+            return
+        self._bot = bot
+        self._ensure_queue()
+        self._global_lock = asyncio.Lock()
+        self._updated = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Outbound sender started with {self.workers} workers")
+
+    # Give queued messages up to `timeout` seconds to go out, then stop the workers
+    async def stop(self, timeout=10):
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Outbound sender stopped with {sum(self.depth.values())} messages still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def drain(self):
+        if self._idle:
+            await self._idle.wait()
+
+    # Messages submitted before start() (e.g. by a handler running ahead of post_init) wait here for the workers
+    def _ensure_queue(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._idle = asyncio.Event()
+            self._idle.set()
+
+    # Queue a message and return a future resolving to the sent Message
+    def submit(self, chat_id, text, priority=OUTBOUND_BOOKING, **kwargs):
+        self._ensure_queue()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._consume_exception)
+        self._seq += 1
+        self.depth[priority] += 1
+        self._idle.clear()
+        self._queue.put_nowait((priority, self._seq, chat_id, text, kwargs, future, time.monotonic(), 0))
+        return future
+
+    async def send(self, chat_id, text, priority=OUTBOUND_BOOKING, **kwargs):
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        return {
+            'queued': {name: self.depth[lane] for lane, name in OUTBOUND_LANES.items()},
+            'sent': self.counters['sent'],
+            'failed': self.counters['failed'],
+            'retried': self.counters['retried'],
+            'retry_after': self.counters['retry_after'],
+            'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+        }
+
+    # Failures are logged by the worker; fire-and-forget callers never read the exception
+    @staticmethod
+    def _consume_exception(future):
+        if not future.cancelled():
+            future.exception()
+
+    def _requeue(self, entry, delay):
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, entry)
+
+    def _finish(self, priority):
+        self.depth[priority] -= 1
+        if not any(self.depth.values()):
+            self._idle.set()
+
+    async def _acquire_global(self):
+        if not self.global_rate:
+            return
+        async with self._global_lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.global_rate, self._tokens + (now - self._updated) * self.global_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.global_rate)
+
+    async def _worker(self):
+        while True:
+            entry = await self._queue.get()
+            priority, seq, chat_id, text, kwargs, future, enqueued_at, attempts = entry
+            if future.cancelled():
+                self._finish(priority)
+                continue
+            # Another chat's message can go out while this one waits for its per-chat slot
+            now = time.monotonic()
+            ready_at = self._chat_ready.get(chat_id, 0)
+            if ready_at > now:
+                self._requeue(entry, ready_at - now)
+                continue
+            if self.chat_rate:
+                self._chat_ready[chat_id] = now + 1 / self.chat_rate
+                if len(self._chat_ready) > 10000:
+                    self._chat_ready = {chat: ready for chat, ready in self._chat_ready.items() if ready > now}
+            await self._acquire_global()
+            try:
+                message = await self._bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                self.counters['retry_after'] += 1
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Telegram asked to retry message to {chat_id} after {retry_after}s")
+                self._chat_ready[chat_id] = time.monotonic() + retry_after
+                self._requeue(entry, retry_after)
+                continue
+            except NetworkError as e:
+                if attempts < self.max_retries:
+                    self.counters['retried'] += 1
+                    delay = min(30, 2 ** attempts) * random.uniform(0.5, 1.5)
+                    logger.warning(f"Network error sending to {chat_id}, retry {attempts + 1} in {delay:.1f}s: {e}")
+                    self._requeue((priority, seq, chat_id, text, kwargs, future, enqueued_at, attempts + 1), delay)
+                    continue
+                self._fail(priority, chat_id, future, e)
+                continue
+            except Exception as e:
+                self._fail(priority, chat_id, future, e)
+                continue
+            self.counters['sent'] += 1
+            self.latencies.append(time.monotonic() - enqueued_at)
+            if not future.done():
+                future.set_result(message)
+            self._finish(priority)
+
+    def _fail(self, priority, chat_id, future, error):
+        self.counters['failed'] += 1
+        logger.error(f"Failed to send message to {chat_id}: {error}")
+        if not future.done():
+            future.set_exception(error)
+        self._finish(priority)
+
+outbound = OutboundSender(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES)
+
+async def start_delivery(application):
+    await db_writer.start()
+    await outbound.start(application.bot)
+    await outbox_relay.start()
+
+# Runs on post_stop, while the bot's HTTP client is still open
+async def stop_delivery(application):
+    await outbox_relay.stop()
+    await outbound.stop()
+    await db_writer.stop()
+    await asyncio.to_thread(db_reader.close)
+
+# An outbox message as enqueue_outbox_batch and the storage backends take it
+def outbox_message(dedup_key, chat_id, text, priority=OUTBOUND_BOOKING, reply_markup=None, kind=None, booking_id=None):
+    return dedup_key, chat_id, text, priority, reply_markup, kind, booking_id
+
+# Add a notification to the outbox using the caller's cursor, so it commits or rolls back with
+# the caller's transaction. A dedup_key that is already queued is ignored.
+def enqueue_outbox(c, dedup_key, chat_id, text, priority=OUTBOUND_BOOKING, reply_markup=None, kind=None, booking_id=None):
+    enqueue_outbox_batch(c, [outbox_message(dedup_key, chat_id, text, priority, reply_markup, kind, booking_id)])
+
+# Several outbox rows in one statement; messages are (dedup_key, chat_id, text, priority, reply_markup, kind, booking_id)
+def enqueue_outbox_batch(c, messages):
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    c.executemany('''INSERT OR IGNORE INTO outbox (dedup_key, chat_id, text, reply_markup, priority, kind, booking_id, created_at)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                  [(dedup_key, chat_id, text, reply_markup.to_json() if reply_markup else None, priority, kind, booking_id, created_at)
+                   for dedup_key, chat_id, text, priority, reply_markup, kind, booking_id in messages])
+
+# Notices the storage backends queue with their writes, so both word them the same way
+def cancel_notice(booking_id, doctor_id, doctor_lang, patient_name, booking_date, time_slot):
+    return outbox_message(f"booking:{booking_id}:cancelled:doctor", doctor_id,
+                          get_message('doctor_cancel_notification', doctor_lang,
+                                      patient_name=patient_name, date=booking_date, time=time_slot),
+                          booking_id=booking_id)
+
+def decision_notice(booking_id, user_id, user_lang, patient_name, booking_date, time_slot, slot_key, doctor_name, approve):
+    user_lang = user_lang if user_lang in LANGUAGES else 'en'
+    if approve:
+        day_name = calendar.day_name[from_slot_key(slot_key).weekday()]
+        date_display = "today" if slot_key // 1440 == day_slot_key(date.today()) // 1440 else f"on {booking_date} ({day_name})"
+        return outbox_message(f"booking:{booking_id}:approved:patient", user_id,
+                              get_message('booking_approved', user_lang, doctor_name=doctor_name, date_display=date_display, time=time_slot),
+                              booking_id=booking_id)
+    return outbox_message(f"booking:{booking_id}:rejected:patient", user_id,
+                          get_message('booking_rejected', user_lang, patient_name=patient_name, date=booking_date, time=time_slot),
+                          booking_id=booking_id)
+
+def expiry_notices(booking_id, user_id, user_lang, doctor_id, doctor_lang, patient_name, booking_date, time_slot):
+    return [outbox_message(f"booking:{booking_id}:expired:patient", user_id,
+                           get_message('booking_expired', user_lang, patient_name=patient_name, date=booking_date, time=time_slot),
+                           booking_id=booking_id),
+            outbox_message(f"booking:{booking_id}:expired:doctor", doctor_id,
+                           get_message('doctor_booking_expired', doctor_lang, patient_name=patient_name, date=booking_date, time=time_slot),
+                           booking_id=booking_id)]
+
+# A doctor's agenda for `day`; bookings are (status, time_slot, patient_name, patient_dob) in slot order
+def digest_notice(doctor_id, doctor_lang, day, bookings):
+    doctor_lang = doctor_lang if doctor_lang in LANGUAGES else 'en'
+    booking_date = day.strftime('%Y-%m-%d')
+    lines = [get_message('doctor_digest_header', doctor_lang, date=booking_date, day_name=calendar.day_name[day.weekday()])]
+    for status, time_slot, patient_name, patient_dob in bookings:
+        lines.append(get_message('doctor_digest_line', doctor_lang, icon='✅' if status == 'approved' else '⏳',
+                                 time=time_slot, patient_name=patient_name, dob=patient_dob))
+    approved = sum(1 for booking in bookings if booking[0] == 'approved')
+    lines.append(get_message('doctor_digest_footer', doctor_lang, approved=approved, pending=len(bookings) - approved))
+    return outbox_message(f"digest:{doctor_id}:{booking_date}", doctor_id, "\n".join(lines), OUTBOUND_ADMIN, kind='digest')
+
+def waitlist_offer_notice(waitlist_id, user_id, user_lang, doctor_name, slot_key):
+    booking_date, time_slot = from_slot_key(slot_key).strftime('%Y-%m-%d'), from_slot_key(slot_key).strftime('%H:%M')
+    return outbox_message(f"waitlist:{waitlist_id}:offer", user_id,
+                          get_message('waitlist_offer', user_lang, doctor_name=doctor_name, date=booking_date,
+                                      time=time_slot, minutes=int(WAITLIST_OFFER_MINUTES)),
+                          reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                              get_message('waitlist_offer_button', user_lang, time=time_slot),
+                              callback_data=f"wo:{to_base36(waitlist_id)}")]]),
+                          kind='waitlist_offer')
+
+# patient is (user_id, language) of the booking's patient, or None if the booking is gone
+def notification_failure_notices(booking_id, doctor_id, error, patient):
+    notices = []
+    if patient:
+        user_id, user_lang = patient
+        reason = error
+        if "chat not found" in error.lower():
+            reason = "Doctor's Telegram account not found. Please ensure the doctor has started the bot."
+        elif "blocked" in error.lower():
+            reason = "Bot is blocked by the doctor. Please contact the doctor to unblock the bot."
+        notices.append(outbox_message(f"booking:{booking_id}:notify_failed:patient", user_id,
+                                      get_message('doctor_notification_error', user_lang, reason=reason), booking_id=booking_id))
+    for admin_id in configured_admin_ids():
+        notices.append(outbox_message(f"booking:{booking_id}:notify_failed:admin:{admin_id}", admin_id,
+                                      f"⚠️ Notification error for booking ID {booking_id}: Failed to notify doctor ID {doctor_id}: {error}",
+                                      OUTBOUND_ADMIN, booking_id=booking_id))
+    return notices
+
+# Put rows left in 'sending' by a previous process back in the queue; delivery is at-least-once
+def write_outbox_reset(c):
+    c.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+    return c.rowcount
+
+# Mark up to `limit` pending rows as 'sending' and return them, highest priority first
+def write_outbox_claim(c, limit):
+    c.execute('''UPDATE outbox SET status = 'sending', attempts = attempts + 1
+                 WHERE id IN (SELECT id FROM outbox WHERE status = 'pending' ORDER BY priority, id LIMIT ?)
+                 RETURNING id, chat_id, text, reply_markup, priority, kind, booking_id''', (limit,))
+    return sorted(c.fetchall(), key=lambda row: (row[4], row[0]))
+
+def write_outbox_result(c, outbox_id, error):
+    if error is None:
+        c.execute("UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                  (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), outbox_id))
+    else:
+        c.execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, outbox_id))
+
+def read_pending_outbox_count(c):
+    c.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')")
+    return c.fetchone()[0]
+
+# Permanent failure of a doctor notification: queue notices to the patient and the admins
+def write_outbox_failure(c, booking_id, doctor_id, error):
+    c.execute('''SELECT b.user_id, COALESCE(u.language, 'en') FROM bookings b
+                 LEFT JOIN users u ON u.user_id = b.user_id WHERE b.id = ?''', (booking_id,))
+    enqueue_outbox_batch(c, notification_failure_notices(booking_id, doctor_id, error, c.fetchone()))
+
+# Outbox bookkeeping for OutboxRelay; on SQLite it runs on the writer, so the updates for a burst of
+# deliveries share one commit
+async def reset_outbox():
+    return await storage.reset_outbox()
+
+async def claim_outbox(limit):
+    return await storage.claim_outbox(limit)
+
+async def finish_outbox(outbox_id, error=None):
+    await storage.finish_outbox(outbox_id, error)
+
+async def count_pending_outbox():
+    return await storage.fetch('count_pending_outbox')
+
+async def report_outbox_failure(booking_id, doctor_id, error):
+    await storage.report_outbox_failure(booking_id, doctor_id, error)
+
+# Drains the outbox through the outbound sender. Handlers call wake() after committing;
+# otherwise the table is polled every OUTBOX_POLL_SECONDS.
+class OutboxRelay:
+    def __init__(self, batch_size, poll_seconds):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.counters = Counter()
+        self._in_flight = set()
+        self._wake = None
+        self._task = None
+        self._stopping = False
+
+    async def start(self):
+        if self._task:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        reset = await reset_outbox()
+        if reset:
+            logger.info(f"Re-queued {reset} outbox messages left in flight by the previous run")
+        self._task = asyncio.create_task(self._run())
+
+    # Stop claiming rows and give deliveries in flight up to `timeout` seconds; rows still
+    # unfinished stay in 'sending' and are re-queued on the next start
+    async def stop(self, timeout=10):
+        if not self._task:
+            return
+        # On Python 3.11 wait_for() can swallow a cancel that races with wake(), so the loop also checks a flag
+        self._stopping = True
+        self._task.cancel()
+        self.wake()
+        await asyncio.gather(self._task, return_exceptions=True)
+        if self._in_flight:
+            await asyncio.wait(set(self._in_flight), timeout=timeout)
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self._task = None
+
+    def wake(self):
+        if self._wake:
+            self._wake.set()
+
+    # Wait until every queued row has been delivered or has failed
+    async def drain(self):
+        while self._in_flight or await count_pending_outbox():
+            self.wake()
+            await asyncio.sleep(0.01)
+
+    async def _run(self):
+        while not self._stopping:
+            rows = []
+            if len(self._in_flight) < self.batch_size:
+                rows = await claim_outbox(self.batch_size - len(self._in_flight))
+            for row in rows:
+                task = asyncio.create_task(self._deliver(*row))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            if not rows:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def _deliver(self, outbox_id, chat_id, text, reply_markup, priority, kind, booking_id):
+        kwargs = {}
+        if reply_markup:
+            kwargs['reply_markup'] = InlineKeyboardMarkup.de_json(json.loads(reply_markup), None)
+        try:
+            await outbound.send(chat_id, text, priority, **kwargs)
+        except Exception as e:
+            self.counters['failed'] += 1
+            await finish_outbox(outbox_id, str(e))
+            if kind == 'doctor_notification':
+                await report_outbox_failure(booking_id, chat_id, str(e))
+        else:
+            self.counters['sent'] += 1
+            await finish_outbox(outbox_id)
+        self.wake()
+
+outbox_relay = OutboxRelay(OUTBOX_BATCH_SIZE, OUTBOX_POLL_SECONDS)
+
+# Scheduled sweeper for stale pending bookings; the notices were queued in the outbox with the update.
+# A pending booking never took its slot, so expiring one frees nothing for the waitlist.
+async def expire_pending_job(context: ContextTypes.DEFAULT_TYPE):
+    expired = await expire_stale_bookings()
+    if not expired:
+        return
+    logger.info(f"Expired {len(expired)} stale pending bookings")
+    outbox_relay.wake()
+
+# Writer operation: queue one agenda message per doctor with approved or pending bookings on `day`.
+# A single ordered query covers all doctors; the digests are written to the outbox in one transaction.
+def write_doctor_digests(c, day):
+    day_key = day_slot_key(day)
+    c.execute('''SELECT b.doctor_id, COALESCE(u.language, 'en'), b.status, b.time_slot, b.patient_name, b.patient_dob
+                 FROM bookings b
+                 LEFT JOIN users u ON u.user_id = b.doctor_id
+                 WHERE b.slot_key >= ? AND b.slot_key < ?
+                   AND (b.status = 'pending' OR (b.status = 'approved' AND b.confirmed = 1))
+                 ORDER BY b.doctor_id, b.slot_key''', (day_key, day_key + 1440))
+    digests = [digest_notice(doctor_id, doctor_lang, day, [row[2:] for row in bookings])
+               for (doctor_id, doctor_lang), bookings in groupby(c.fetchall(), key=lambda row: (row[0], row[1]))]
+    enqueue_outbox_batch(c, digests)
+    return len(digests)
+
+# Returns the number of doctors whose agenda was queued
+async def queue_doctor_digests(day):
+    return await storage.queue_doctor_digests(day)
+
+# Zone with DST rules for jobs that run on the local clock; falls back to the current fixed offset
+def local_timezone():
+    try:
+        if BOT_TIMEZONE:
+            return ZoneInfo(BOT_TIMEZONE)
+        with open('/etc/localtime', 'rb') as f:
+            return ZoneInfo.from_file(f, key='localtime')
+    except (OSError, ValueError, ZoneInfoNotFoundError) as e:
+        logger.warning(f"Could not load local time zone ({e}); scheduled jobs will use a fixed UTC offset")
+        return datetime.now().astimezone().tzinfo
+
+# Scheduled daily agenda for doctors
+async def doctor_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    queued = await queue_doctor_digests(date.today())
+    if queued:
+        logger.info(f"Queued daily agenda for {queued} doctors")
+        outbox_relay.wake()
+
+def read_waitlist(c, day_key):
+    c.execute("SELECT id, user_id, doctor_id, day_key FROM waitlist WHERE status = 'waiting' AND day_key >= ?", (day_key,))
+    return c.fetchall()
+
+# Waiting entries for today and later, used to fill waitlist_queue; None on error
+def load_waitlist():
+    return storage.get_waitlist(day_slot_key(date.today()))
+
+def ensure_waitlist_loaded():
+    if not waitlist_queue.loaded:
+        rows = load_waitlist()
+        if rows is not None:
+            waitlist_queue.load(rows)
+
+# Writer operation for join_waitlist; returns (waitlist_id, joined)
+def write_waitlist_entry(c, user_id, doctor_id, day_key):
+    c.execute('''SELECT id FROM waitlist WHERE doctor_id = ? AND day_key = ? AND user_id = ?
+                 AND status IN ('waiting', 'offered')''', (doctor_id, day_key, user_id))
+    existing = c.fetchone()
+    if existing:
+        return existing[0], False
+    c.execute('INSERT INTO waitlist (user_id, doctor_id, day_key, created_at) VALUES (?, ?, ?, ?)',
+              (user_id, doctor_id, day_key, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return c.lastrowid, True
+
+# Put the user on the waitlist for a doctor/day; returns (waitlist_id, joined), joined is False if already waiting
+async def join_waitlist(user_id, doctor_id, day_key):
+    if not waitlist_queue.loaded:
+        await asyncio.to_thread(ensure_waitlist_loaded)
+    waitlist_id, joined = await storage.add_waitlist_entry(user_id, doctor_id, day_key)
+    if joined:
+        waitlist_queue.push(doctor_id, day_key, waitlist_id, user_id)
+    return waitlist_id, joined
+
+# Writer operation: offer a slot that just became free to the next waiter for its doctor/day. The offer
+# is written to the outbox in the same transaction; returns (waitlist_id, user_id), or None if nobody was offered it.
+def write_waitlist_offer(c, doctor_id, slot_key):
+    c.execute('SELECT name FROM doctors WHERE user_id = ?', (doctor_id,))
+    doctor = c.fetchone()
+    if not doctor or not slot_is_open(c, doctor_id, slot_key):
+        return None
+    day_key = slot_key - slot_key % 1440
+    expires_at = (datetime.now() + timedelta(minutes=WAITLIST_OFFER_MINUTES)).strftime('%Y-%m-%d %H:%M:%S')
+    entry = None
+    try:
+        while True:
+            entry = waitlist_queue.pop(doctor_id, day_key)
+            if not entry:
+                return None
+            waitlist_id, user_id = entry
+            # Entries can be stale in memory, e.g. expired by the sweeper; the row decides
+            c.execute('''UPDATE waitlist SET status = 'offered', offer_slot_key = ?, offer_expires_at = ?
+                         WHERE id = ? AND status = 'waiting' ''', (slot_key, expires_at, waitlist_id))
+            if c.rowcount:
+                break
+        enqueue_outbox_batch(c, [waitlist_offer_notice(waitlist_id, user_id, read_user_language(c, user_id), doctor[0], slot_key)])
+        return waitlist_id, user_id
+    except sqlite3.Error:
+        if entry:
+            waitlist_queue.push(doctor_id, day_key, *entry)
+        raise
+
+# Offer a slot freed by a cancelled or released confirmed booking to the waitlist. Runs on the writer,
+# off the event loop; returns the waitlist id, or None if nobody was offered it.
+async def offer_freed_slot(doctor_id, slot_key):
+    if slot_key <= int((datetime.now() - SLOT_EPOCH).total_seconds()) // 60:
+        return None
+    if not waitlist_queue.loaded:
+        await asyncio.to_thread(ensure_waitlist_loaded)
+    if not waitlist_queue.has_waiters(doctor_id, slot_key - slot_key % 1440) or slot_holds.holder(doctor_id, slot_key) is not None:
+        return None
+    offer = await storage.offer_waitlist_slot(doctor_id, slot_key)
+    if not offer:
+        return None
+    waitlist_id, user_id = offer
+    # Keep the slot out of other calendars while the offer is open
+    slot_holds.hold_offer(waitlist_id, user_id, doctor_id, slot_key, WAITLIST_OFFER_MINUTES * 60)
+    logger.info(f"Offered slot {from_slot_key(slot_key)} of doctor {doctor_id} to waitlisted user {user_id}")
+    outbox_relay.wake()
+    return waitlist_id
+
+def read_waitlist_offer(c, waitlist_id, user_id):
+    c.execute('''SELECT doctor_id, offer_slot_key FROM waitlist
+                 WHERE id = ? AND user_id = ? AND status = 'offered' AND offer_expires_at > ?''',
+              (waitlist_id, user_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    offer = c.fetchone()
+    return offer if offer and slot_is_open(c, *offer) else None
+
+# (doctor_id, slot_key, booking_date, time_slot) of a live offer for user_id whose slot is still free, else None
+def get_waitlist_offer(waitlist_id, user_id):
+    offer = storage.get_waitlist_offer(waitlist_id, user_id)
+    if not offer:
+        return None
+    doctor_id, slot_key = offer
+    return doctor_id, slot_key, from_slot_key(slot_key).strftime('%Y-%m-%d'), from_slot_key(slot_key).strftime('%H:%M')
+
+# Writer operation for expire_waitlist_offers
+def write_waitlist_expiry(c):
+    c.execute('''SELECT id, user_id, doctor_id, offer_slot_key FROM waitlist
+                 WHERE status = 'offered' AND offer_expires_at <= ?''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+    expired = c.fetchall()
+    if expired:
+        c.execute(f"UPDATE waitlist SET status = 'expired' WHERE id IN ({','.join('?' * len(expired))})",
+                  [row[0] for row in expired])
+    c.execute("UPDATE waitlist SET status = 'expired' WHERE status = 'waiting' AND day_key < ?",
+              (day_slot_key(date.today()),))
+    return expired
+
+# Expire unanswered offers and waiting entries for past days; returns (waitlist_id, user_id, doctor_id, slot_key) of the expired offers
+async def expire_waitlist_offers():
+    return await storage.expire_waitlist_offers()
+
+# Scheduled waitlist sweep; a slot whose offer lapsed goes to the next waiter
+async def waitlist_job(context: ContextTypes.DEFAULT_TYPE):
+    expired = await expire_waitlist_offers()
+    waitlist_queue.discard_before(day_slot_key(date.today()))
+    offered = []
+    for expired_id, user_id, doctor_id, slot_key in expired:
+        slot_holds.release_offer(expired_id)
+        if slot_holds.holder(doctor_id, slot_key) == user_id:
+            slot_holds.release(user_id)
+        waitlist_id = await offer_freed_slot(doctor_id, slot_key)
+        if waitlist_id:
+            offered.append(waitlist_id)
+    if expired:
+        logger.info(f"Expired {len(expired)} waitlist offers, passed {len(offered)} on")
+
+# Scheduled archival job
+async def archive_job(context: ContextTypes.DEFAULT_TYPE):
+    archived = await archive_history()
+    if archived['bookings'] or archived['slots']:
+        logger.info(f"Archived {archived['bookings']} bookings and {archived['slots']} doctor slots")
+
+# Language selection command
+async def language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    logger.info(f"User {user_id} issued /language command")
+    keyboard = [[InlineKeyboardButton(name, callback_data=f'lang_{code}')] for code, name in LANGUAGES.items()]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    lang = context.user_data.get('language', get_user_language(user_id))
+    await update.message.reply_text(
+        get_message('select_language', lang),
+        reply_markup=reply_markup
+    )
+    return SELECT_LANGUAGE
+
+# Start command
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    logger.info(f"User {user_id} started the bot")
+    context.user_data.clear()  # Reset state on /start
+    slot_holds.release(user_id)
+    
+    # Check if user exists and has a language preference
+    user = get_user_by_id(user_id)
+    if user and user[3]:  # user[3] is the language column
+        context.user_data['language'] = user[3]
+        await show_main_menu(update, context)
+    else:
+        # Prompt for language selection
+        keyboard = [[InlineKeyboardButton(name, callback_data=f'lang_{code}')] for code, name in LANGUAGES.items()]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            get_message('select_language', 'en'),
+            reply_markup=reply_markup
+        )
+        return SELECT_LANGUAGE
+
+# Menus and other navigation screens replace the message whose button was tapped instead of stacking new
+# ones: an unchanged text only gets its keyboard swapped, and an identical screen costs no API call. A message
+# that can no longer be edited (deleted, too old) gets the screen as a new reply, as do plain messages.
+async def show_screen(update, text, reply_markup=None):
+    query = update.callback_query
+    if not query or not query.message:
+        return await update.effective_message.reply_text(text, reply_markup=reply_markup)
+    message = query.message
+    try:
+        if message.text == text.strip():
+            if message.reply_markup == reply_markup:
+                return message
+            return await query.edit_message_reply_markup(reply_markup=reply_markup)
+        return await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if 'not modified' in str(e).lower():
+            return message
+        logger.info(f"Sending a new message instead of editing message {message.message_id} for user {query.from_user.id}: {e}")
+    return await message.reply_text(text, reply_markup=reply_markup)
+
+# Show main menu based on user/admin status
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    lang = context.user_data.get('language', get_user_language(user_id))
+    
+    try:
+        if is_admin(user_id):
+            keyboard = [
+                [InlineKeyboardButton("Admin Panel", callback_data='admin_panel')],
+                [InlineKeyboardButton("Access User Features", callback_data='user_mode')]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            welcome_message = get_message('welcome_admin', lang)
+        else:
+            keyboard = [
+                [InlineKeyboardButton("Book Now", callback_data='book')],
+                [InlineKeyboardButton("Cancel Booking", callback_data='cancel_booking')],
+                [InlineKeyboardButton("Service Info", callback_data='info')],
+                [InlineKeyboardButton("Contact Support", callback_data='support')]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            welcome_message = get_message('welcome_user', lang)
+        
+        await show_screen(update, welcome_message, reply_markup)
+    except Exception as e:
+        logger.error(f"Error sending main menu to user {user_id}: {e}", exc_info=True)
+        await (update.callback_query.message if update.callback_query else update.message).reply_text(
+            get_message('error_occurred', lang)
+        )
+
+# Cancel command
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    lang = context.user_data.get('language', get_user_language(user_id))
+    logger.info(f"User {user_id} issued /cancel command")
+    context.user_data.clear()  # Reset conversation state
+    slot_holds.release(user_id)
+    try:
+        await update.message.reply_text(get_message('conversation_reset', lang))
+    except Exception as e:
+        logger.error(f"Error sending cancel response to user {user_id}: {e}")
+    return ConversationHandler.END
+
+# Keys remembered for a fixed time. All keys share one TTL, so the dict stays in expiry order and
+# expired keys are dropped from the front.
+class ExpiringSet:
+    def __init__(self, ttl_seconds, max_size=100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._expiries = OrderedDict()
+
+    def _evict(self, now):
+        while self._expiries:
+            expires_at = next(iter(self._expiries.values()))
+            if expires_at > now and len(self._expiries) < self.max_size:
+                break
+            self._expiries.popitem(last=False)
+
+    # Remember key for another ttl_seconds; True if it was already there
+    def add(self, key):
+        now = time.monotonic()
+        self._evict(now)
+        seen = key in self._expiries
+        self._expiries[key] = now + self.ttl_seconds
+        self._expiries.move_to_end(key)
+        return seen
+
+    def __contains__(self, key):
+        expires_at = self._expiries.get(key)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def __len__(self):
+        return len(self._expiries)
+
+# Per-user token buckets checked before any handler touches the database
+class FloodControl:
+    def __init__(self, rate, burst, duplicate_seconds, max_users=50000):
+        self.rate = rate
+        self.burst = burst
+        self.duplicate_seconds = duplicate_seconds
+        self.max_users = max_users
+        self.counters = Counter()
+        self._buckets = {}
+        self._last_callbacks = {}
+        self._warned = set()
+
+    # Forget users whose bucket has refilled completely; they carry no state
+    def _prune(self, now):
+        idle = [user_id for user_id, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for user_id in idle:
+            del self._buckets[user_id]
+            self._last_callbacks.pop(user_id, None)
+            self._warned.discard(user_id)
+
+    # callback_key is (callback_data, message_id). Only a repeat of the user's previous tap counts: screens are
+    # edited in place, so paging A -> B -> A taps the same button on the same message and must go through
+    def is_duplicate(self, user_id, callback_key):
+        now = time.monotonic()
+        last = self._last_callbacks.get(user_id)
+        self._last_callbacks[user_id] = (callback_key, now)
+        return bool(last) and last[0] == callback_key and now - last[1] < self.duplicate_seconds
+
+    def allow(self, user_id):
+        now = time.monotonic()
+        if user_id not in self._buckets and len(self._buckets) >= self.max_users:
+            self._prune(now)
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+        self._warned.discard(user_id)
+        return True
+
+    # True only for the first rejected update of a burst, so the user is told once
+    def should_warn(self, user_id):
+        if user_id in self._warned:
+            return False
+        self._warned.add(user_id)
+        return True
+
+flood_control = FloodControl(FLOOD_RATE, FLOOD_BURST, FLOOD_DUPLICATE_SECONDS)
+
+# (user_id, callback_data, message_id) of state-changing buttons that already ran: approving, rejecting or
+# cancelling a booking and deleting a user. Tapping one again only gets a short answer from flood_guard.
+handled_callbacks = ExpiringSet(CALLBACK_HANDLED_MINUTES * 60)
+
+def mark_handled(query):
+    if query.message:
+        handled_callbacks.add((query.from_user.id, query.data, query.message.message_id))
+
+# Runs in handler group -1 and stops excess updates before button_callback, handle_message or commands
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user:
+        return
+    query = update.callback_query
+    if query and query.message and (user.id, query.data, query.message.message_id) in handled_callbacks:
+        flood_control.counters['coalesced'] += 1
+        lang = context.user_data.get('language', 'en') if context.user_data is not None else 'en'
+        try:
+            await query.answer(get_message('action_already_done', lang))
+        except Exception as e:
+            logger.debug(f"Failed to answer repeated callback from user {user.id}: {e}")
+        raise ApplicationHandlerStop
+    if query and query.message and flood_control.is_duplicate(user.id, (query.data, query.message.message_id)):
+        flood_control.counters['coalesced'] += 1
+        try:
+            await query.answer()
+        except Exception as e:
+            logger.debug(f"Failed to answer duplicate callback from user {user.id}: {e}")
+        raise ApplicationHandlerStop
+    if flood_control.allow(user.id):
+        flood_control.counters['allowed'] += 1
+        return
+    flood_control.counters['dropped'] += 1
+    # Only the cached language is used here; looking it up would cost the query we are trying to save
+    lang = context.user_data.get('language', 'en') if context.user_data is not None else 'en'
+    try:
+        if query:
+            await query.answer(get_message('too_many_requests', lang))
+        elif update.effective_message and flood_control.should_warn(user.id):
+            await update.effective_message.reply_text(get_message('too_many_requests', lang))
+    except Exception as e:
+        logger.debug(f"Failed to send flood warning to user {user.id}: {e}")
+    logger.info(f"Throttled update from user {user.id}")
+    raise ApplicationHandlerStop
 
-# Show main menu based on user/admin status
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Last activity per conversation key (chat_id, user_id) on a timer wheel. touch() files a new key under the
+# tick of its earliest possible expiry; a sweep only visits the buckets that came due and re-files keys that
+# were active since or whose state allows a longer idle time, so its cost follows the expiring keys, not all users.
+class IdleSessions:
+    def __init__(self, default_timeout, state_timeouts, tick_seconds, wheel_size=256):
+        self.default_timeout = default_timeout
+        self.state_timeouts = state_timeouts
+        self.tick_seconds = tick_seconds
+        self.counters = Counter()
+        self._min_timeout = min([default_timeout, *state_timeouts.values()])
+        self._wheel = [set() for _ in range(wheel_size)]
+        self._last_seen = {}
+        self._tick = int(time.monotonic() // tick_seconds)
+
+    def timeout(self, state):
+        return self.state_timeouts.get(state, self.default_timeout)
+
+    # Deadlines beyond the wheel land in its last bucket and are re-filed when it comes round
+    def _schedule(self, key, deadline):
+        tick = max(int(deadline // self.tick_seconds) + 1, self._tick + 1)
+        tick = min(tick, self._tick + len(self._wheel) - 1)
+        self._wheel[tick % len(self._wheel)].add(key)
+
+    def touch(self, key):
+        now = time.monotonic()
+        if key not in self._last_seen:
+            self._schedule(key, now + self._min_timeout)
+        self._last_seen[key] = now
+
+    # Keys idle for longer than the timeout of their current state; state_of(key) may return None
+    def expire(self, state_of):
+        now = time.monotonic()
+        current = int(now // self.tick_seconds)
+        # After a long stall every bucket is visited once, which covers all keys
+        self._tick = max(self._tick, current - len(self._wheel))
+        expired = []
+        while self._tick < current:
+            self._tick += 1
+            index = self._tick % len(self._wheel)
+            bucket, self._wheel[index] = self._wheel[index], set()
+            for key in bucket:
+                deadline = self._last_seen[key] + self.timeout(state_of(key))
+                if deadline <= now:
+                    del self._last_seen[key]
+                    expired.append(key)
+                else:
+                    self.counters['refiled'] += 1
+                    self._schedule(key, deadline)
+        self.counters['expired'] += len(expired)
+        return expired
+
+    def __len__(self):
+        return len(self._last_seen)
+
+idle_sessions = IdleSessions(CONVERSATION_IDLE_MINUTES * 60, parse_state_idle_timeouts(CONVERSATION_STATE_IDLE_MINUTES),
+                             IDLE_SWEEP_SECONDS)
+
+# Runs in handler group -2, before flood_guard, so even throttled users count as active
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat and update.effective_user:
+        idle_sessions.touch((update.effective_chat.id, update.effective_user.id))
+
+# State restored from persistence starts its idle clock at startup, so users who never come back are still evicted
+async def track_restored_sessions(context: ContextTypes.DEFAULT_TYPE):
+    keys = set(context.job.data._conversations) | {(user_id, user_id) for user_id in context.application.user_data}
+    for key in keys:
+        idle_sessions.touch(key)
+    logger.info(f"Tracking {len(keys)} restored conversations for idle eviction")
+
+# End conversations nobody touched for their state's idle timeout and drop the user_data they left behind.
+# The language cached in user_data is read back from the users table on the next update.
+async def idle_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    # ConversationHandler has no public way to read or end a conversation outside of an update, so this uses
+    # its private _conversations dict as of python-telegram-bot 20.7 (pinned in requirements.txt);
+    # build_application checks that it still exists before scheduling the sweep
+    conversations = context.job.data._conversations
+    expired = idle_sessions.expire(conversations.get)
+    for key in expired:
+        chat_id, user_id = key
+        conversations.pop(key, None)
+        # Waitlist offer holds are kept apart and stay until the offer is booked or lapses
+        slot_holds.release(user_id)
+        context.application.drop_user_data(user_id)
+    if expired:
+        logger.info(f"Evicted {len(expired)} idle conversations; {len(idle_sessions)} users still tracked")
+
+# Send one page of /search results; the query itself stays in user_data so buttons only carry the page
+async def send_search_page(message, context, lang, page):
+    text = context.user_data.get('search_query')
+    if not text:
+        await message.reply_text(get_message('search_usage', lang))
+        return
+    offset = page * SEARCH_PAGE_SIZE
+    bookings = search_bookings(text, SEARCH_PAGE_SIZE + 1, offset)
+    requests = search_support_requests(text, SEARCH_PAGE_SIZE + 1, offset)
+    if not bookings and not requests:
+        await message.reply_text(get_message('search_no_results', lang, query=text))
+        return
+    has_next = len(bookings) > SEARCH_PAGE_SIZE or len(requests) > SEARCH_PAGE_SIZE
+    bookings, requests = bookings[:SEARCH_PAGE_SIZE], requests[:SEARCH_PAGE_SIZE]
+    lines = [get_message('search_results', lang, query=text, page=page + 1)]
+    if requests:
+        lines.append(get_message('search_support_header', lang))
+        for request_id, request_user_id, request_message, timestamp, status in requests:
+            preview = request_message if len(request_message) <= 80 else request_message[:77] + '...'
+            lines.append(f"#{request_id} {timestamp} · User {request_user_id} · {status}\n{preview}")
+    if bookings:
+        lines.append(get_message('search_bookings_header', lang))
+    keyboard = [[InlineKeyboardButton(f"ID: {booking_id} - {patient_name} ({booking_date} {time_slot}, {status})",
+                                      callback_data=booking_callback('admin_view', booking_id))]
+                for booking_id, patient_name, booking_date, time_slot, status in bookings]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(get_message('search_prev', lang), callback_data=f'search:{page - 1}'))
+    if has_next:
+        navigation.append(InlineKeyboardButton(get_message('search_next', lang), callback_data=f'search:{page + 1}'))
+    if navigation:
+        keyboard.append(navigation)
+    await message.reply_text("\n\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None)
+
+# Admin full-text search over bookings and support requests
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang = context.user_data.get('language', get_user_language(user_id))
-    
+    if not is_admin(user_id):
+        try:
+            await update.message.reply_text(get_message('unauthorized', lang))
+        except Exception as e:
+            logger.error(f"Error sending unauthorized message to user {user_id}: {e}")
+        return
     try:
-        if is_admin(user_id):
-            keyboard = [
-                [InlineKeyboardButton("Admin Panel", callback_data='admin_panel')],
-                [InlineKeyboardButton("Access User Features", callback_data='user_mode')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            welcome_message = get_message('welcome_admin', lang)
-        else:
-            keyboard = [
-                [InlineKeyboardButton("Book Now", callback_data='book')],
-                [InlineKeyboardButton("Cancel Booking", callback_data='cancel_booking')],
-                [InlineKeyboardButton("Service Info", callback_data='info')],
-                [InlineKeyboardButton("Contact Support", callback_data='support')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            welcome_message = get_message('welcome_user', lang)
-        
-        if update.callback_query:
-            await update.callback_query.message.reply_text(welcome_message, reply_markup=reply_markup)
-        else:
-            await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+        if not context.args:
+            await update.message.reply_text(get_message('search_usage', lang))
+            return
+        context.user_data['search_query'] = ' '.join(context.args)
+        await send_search_page(update.message, context, lang, 0)
     except Exception as e:
-        logger.error(f"Error sending main menu to user {user_id}: {e}", exc_info=True)
-        await (update.callback_query.message if update.callback_query else update.message).reply_text(
-            get_message('error_occurred', lang)
-        )
+        logger.error(f"Search failed for user {user_id}: {e}", exc_info=True)
+        try:
+            await update.message.reply_text(get_message('error_occurred', lang))
+        except Exception as reply_error:
+            logger.error(f"Failed to send search error to user {user_id}: {reply_error}")
 
-# Cancel command
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Doctor's pending queue with multi-select. The listed requests and the selection live in user_data,
+# so toggling a request only edits the keyboard and does not touch the database.
+def load_pending_queue(context, doctor_id):
+    context.user_data['pending_queue'] = get_pending_bookings(doctor_id, PENDING_QUEUE_SIZE)
+    context.user_data['pending_selected'] = []
+
+def pending_queue_text(context, lang, notice=None):
+    queue = context.user_data.get('pending_queue', [])
+    text = get_message('pending_queue', lang, count=len(queue)) if queue else get_message('pending_queue_empty', lang)
+    return f"{notice}\n\n{text}" if notice else text
+
+def pending_queue_markup(context, lang):
+    queue = context.user_data.get('pending_queue', [])
+    if not queue:
+        return None
+    selected = context.user_data.get('pending_selected', [])
+    keyboard = [[InlineKeyboardButton(f"{'☑️' if booking_id in selected else '⬜'} {booking_date} {time_slot} · {patient_name}",
+                                      callback_data=f"pq:t:{to_base36(booking_id)}")]
+                for booking_id, patient_name, booking_date, time_slot in queue]
+    keyboard.append([InlineKeyboardButton(get_message('pending_select_all', lang), callback_data='pq:all')])
+    keyboard.append([InlineKeyboardButton(get_message('pending_approve_selected', lang, count=len(selected)), callback_data='pq:ok'),
+                     InlineKeyboardButton(get_message('pending_reject_selected', lang, count=len(selected)), callback_data='pq:no')])
+    return InlineKeyboardMarkup(keyboard)
+
+async def pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang = context.user_data.get('language', get_user_language(user_id))
-    logger.info(f"User {user_id} issued /cancel command")
-    context.user_data.clear()  # Reset conversation state
     try:
-        await update.message.reply_text(get_message('conversation_reset', lang))
+        if not get_doctor_by_id(user_id):
+            await update.message.reply_text(get_message('unauthorized', lang))
+            return
+        load_pending_queue(context, user_id)
+        await update.message.reply_text(pending_queue_text(context, lang), reply_markup=pending_queue_markup(context, lang))
     except Exception as e:
-        logger.error(f"Error sending cancel response to user {user_id}: {e}")
-    return ConversationHandler.END
+        logger.error(f"Error sending pending queue to doctor {user_id}: {e}", exc_info=True)
+        try:
+            await update.message.reply_text(get_message('error_occurred', lang))
+        except Exception as reply_error:
+            logger.error(f"Failed to send error message to user {user_id}: {reply_error}")
 
 # Health check command
 async def health(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -893,12 +3923,21 @@ async def health(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         stats = get_system_stats()
-        conn = sqlite3.connect('doctomed.db', timeout=10)
-        conn.close()
         health_status = get_message('health_status', lang,
                                     total_bookings=stats['total_bookings'],
                                     active_users=stats['active_users'],
                                     total_doctors=stats['total_doctors'])
+        health_status += "\n" + get_message('health_throttle', lang,
+                                             dropped=flood_control.counters['dropped'],
+                                             coalesced=flood_control.counters['coalesced'])
+        outbound_metrics = outbound.metrics()
+        health_status += "\n" + get_message('health_outbound', lang,
+                                             queued=", ".join(f"{lane} {count}" for lane, count in outbound_metrics['queued'].items()),
+                                             sent=outbound_metrics['sent'],
+                                             failed=outbound_metrics['failed'],
+                                             retry_after=outbound_metrics['retry_after'],
+                                             p50=outbound_metrics['p50_ms'],
+                                             p95=outbound_metrics['p95_ms'])
         await update.message.reply_text(health_status)
     except Exception as e:
         logger.error(f"Health check failed for user {user_id}: {e}", exc_info=True)
@@ -920,10 +3959,7 @@ async def select_doctor(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         keyboard = [[InlineKeyboardButton(f"{doctor[1]}", callback_data=f'doctor_{doctor[0]}')] for doctor in doctors]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.callback_query.message.reply_text(
-            get_message('select_doctor', lang),
-            reply_markup=reply_markup
-        )
+        await show_screen(update, get_message('select_doctor', lang), reply_markup)
     except Exception as e:
         logger.error(f"Error sending doctor selection to user {user_id}: {e}", exc_info=True)
         try:
@@ -934,8 +3970,24 @@ async def select_doctor(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     return SELECT_DOCTOR
 
+# Waitlist buttons for the days in [start_day, end_day) that are not in free_days (day numbers, slot_key // 1440).
+# Only days the doctor works can free up a slot, so days off get no button.
+def waitlist_buttons(doctor_id, start_day, end_day, free_days):
+    buttons = []
+    if all(day_number in free_days for day_number in range(day_slot_key(start_day) // 1440, day_slot_key(end_day) // 1440)):
+        return buttons
+    working_days = get_working_days(doctor_id, start_day, end_day)
+    day = start_day
+    while day < end_day:
+        day_number = day_slot_key(day) // 1440
+        if day_number not in free_days and day_number in working_days:
+            buttons.append(InlineKeyboardButton(f"🔔 {calendar.day_abbr[day.weekday()]} {day.strftime('%d.%m')}",
+                                                callback_data=f"wl:{doctor_id}:{day_number}"))
+        day += timedelta(days=1)
+    return [buttons[i:i + 4] for i in range(0, len(buttons), 4)]
+
 # Show calendar
-async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE, doctor_id):
+async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE, doctor_id, page=0):
     user_id = update.effective_user.id
     lang = context.user_data.get('language', get_user_language(user_id))
     try:
@@ -945,42 +3997,73 @@ async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE, doct
             await update.callback_query.message.reply_text(get_message('doctor_not_found', lang))
             return ConversationHandler.END
         
-        available_slots = get_available_slots(doctor_id)
-        if not available_slots:
+        today = date.today()
+        page_range = calendar_page_range(page, today)
+        if not page_range:
+            # A paging button sent on an earlier day can point past today's horizon
+            page, page_range = 0, calendar_page_range(0, today)
+        start_day, end_day = page_range
+        # Only the visible week is queried; pages come from the cache when a prefetch already loaded them
+        available_slots = slot_page_cache.get(doctor_id, start_day)
+        if available_slots is None:
+            available_slots = get_available_slots(doctor_id, start_day, end_day)
+            slot_page_cache.put(doctor_id, start_day, available_slots)
+        # Slots other patients are in the middle of booking are hidden; the cache holds the unfiltered page
+        held = slot_holds.held_by_others(doctor_id, user_id)
+        if held:
+            available_slots = [slot for slot in available_slots if slot[3] not in held]
+        if not available_slots and page == 0 and not has_available_slots(doctor_id, end_day, horizon_end(today)):
             logger.info(f"No available slots for doctor {doctor_id}")
-            await update.callback_query.message.reply_text(
-                get_message('no_slots', lang, doctor_name=doctor[1])
-            )
-            return ConversationHandler.END
+            keyboard = waitlist_buttons(doctor_id, start_day, end_day, set())
+            keyboard.append([InlineKeyboardButton(get_message('back_to_doctors', lang), callback_data='select_doctor')])
+            await show_screen(update, get_message('no_slots', lang, doctor_name=doctor[1]) + "\n\n" + get_message('waitlist_hint', lang),
+                              InlineKeyboardMarkup(keyboard))
+            return SELECT_DOCTOR
+        next_range = calendar_page_range(page + 1, today)
+        if next_range:
+            create_background_task(context.application, prefetch_calendar_page(doctor_id, *next_range))
         
-        slots_by_date = {}
-        for slot in available_slots:
-            booking_date = slot[0]
-            if booking_date not in slots_by_date:
-                slots_by_date[booking_date] = []
-            slots_by_date[booking_date].append(slot[1])
+        # Slots arrive ordered by slot_key, so grouping by day needs no sorting or date parsing
+        slots_by_day = {}
+        for booking_date, time_slot, _, slot_key in available_slots:
+            slots_by_day.setdefault(slot_key // 1440, (booking_date, []))[1].append((time_slot, slot_key))
         
-        message = get_message('schedule_header', lang, doctor_name=doctor[1])
-        for booking_date in sorted(slots_by_date.keys()):
-            booking_date_dt = datetime.strptime(booking_date, '%Y-%m-%d')
-            day_name = calendar.day_name[booking_date_dt.weekday()]
+        message = get_message('schedule_header', lang, doctor_name=doctor[1], start=start_day.strftime('%Y-%m-%d'),
+                              end=(end_day - timedelta(days=1)).strftime('%Y-%m-%d'))
+        if not available_slots:
+            message += get_message('no_slots_week', lang) + "\n\n"
+        for booking_date, day_slots in slots_by_day.values():
+            day_name = calendar.day_name[from_slot_key(day_slots[0][1]).weekday()]
             message += f"🗓️ {booking_date} ({day_name})\n"
-            for time_slot in sorted(slots_by_date[booking_date]):
+            for time_slot, _ in day_slots:
                 message += f"- {time_slot} ✅\n"
             message += "\n"
         
+        # Slot buttons carry a short server-side token, so several fit on one row
         keyboard = []
-        for booking_date in sorted(slots_by_date.keys()):
-            for time_slot in sorted(slots_by_date[booking_date]):
-                callback_data = f"slot_{time_slot}_{booking_date}_{doctor_id}"
-                keyboard.append([InlineKeyboardButton(time_slot, callback_data=callback_data)])
+        for booking_date, day_slots in slots_by_day.values():
+            for i in range(0, len(day_slots), SLOT_BUTTONS_PER_ROW):
+                row = []
+                for time_slot, slot_key in day_slots[i:i + SLOT_BUTTONS_PER_ROW]:
+                    token = callback_tokens.issue(user_id, (int(doctor_id), slot_key, booking_date, time_slot))
+                    label = f"{calendar.day_abbr[from_slot_key(slot_key).weekday()]} {time_slot}"
+                    row.append(InlineKeyboardButton(label, callback_data=f"s:{token}"))
+                keyboard.append(row)
+        # Fully booked days of this page can be waitlisted
+        waitlist_rows = waitlist_buttons(doctor_id, start_day, end_day, slots_by_day)
+        if waitlist_rows:
+            message += get_message('waitlist_hint', lang) + "\n\n"
+            keyboard.extend(waitlist_rows)
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(get_message('calendar_prev_week', lang), callback_data=f'cal:{doctor_id}:{page - 1}'))
+        if next_range:
+            navigation.append(InlineKeyboardButton(get_message('calendar_next_week', lang), callback_data=f'cal:{doctor_id}:{page + 1}'))
+        if navigation:
+            keyboard.append(navigation)
         keyboard.append([InlineKeyboardButton(get_message('back_to_doctors', lang), callback_data='select_doctor')])
         reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.callback_query.message.reply_text(
-            message + get_message('select_slot', lang),
-            reply_markup=reply_markup
-        )
+        await show_screen(update, message + get_message('select_slot', lang), reply_markup)
     except Exception as e:
         logger.error(f"Error sending calendar for doctor {doctor_id} to user {user_id}: {e}", exc_info=True)
         try:
@@ -991,6 +4074,17 @@ async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE, doct
         return ConversationHandler.END
     return SELECT_DOCTOR
 
+# Ask who the booking is for once a slot is held: saved patients are one tap, typing a name still works
+async def prompt_patient(message, user_id, lang):
+    profiles = await storage.fetch('get_patient_profiles', user_id)
+    if not profiles:
+        await message.reply_text(get_message('patient_name_prompt', lang))
+        return
+    keyboard = [[InlineKeyboardButton(f"👤 {patient_name} ({patient_dob})" if patient_dob else f"👤 {patient_name}",
+                                      callback_data=f"pp:{to_base36(profile_id)}" if profile_id else 'pp:l')]
+                for profile_id, patient_name, patient_dob in profiles]
+    await message.reply_text(get_message('patient_profile_prompt', lang), reply_markup=InlineKeyboardMarkup(keyboard))
+
 # Button callback
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1002,11 +4096,12 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         is_user_admin = is_admin(user_id)
+        booking_action, callback_booking_id = parse_booking_callback(query.data)
         if query.data.startswith('lang_'):
             lang_code = query.data.split('_')[1]
             if lang_code in LANGUAGES:
                 context.user_data['language'] = lang_code
-                set_user_language(user_id, lang_code)
+                await set_user_language(user_id, lang_code)
                 await query.message.reply_text(
                     get_message('language_changed', lang_code, language=LANGUAGES[lang_code])
                 )
@@ -1024,10 +4119,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [InlineKeyboardButton("Back to Admin Panel", callback_data='admin_panel')]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(
-                get_message('welcome_user', lang),
-                reply_markup=reply_markup
-            )
+            await show_screen(update, get_message('welcome_user', lang), reply_markup)
             return
         elif query.data == 'book' and not (is_user_admin and 'admin_panel' in query.data):
             await select_doctor(update, context)
@@ -1039,6 +4131,44 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             doctor_id = int(query.data.split('_')[1])
             await show_calendar(update, context, doctor_id)
             return SELECT_DOCTOR
+        elif query.data.startswith('cal:') and not (is_user_admin and 'admin_panel' in query.data):
+            _, doctor_id, page = query.data.split(':')
+            await show_calendar(update, context, int(doctor_id), int(page))
+            return SELECT_DOCTOR
+        elif query.data.startswith('wl:') and not (is_user_admin and 'admin_panel' in query.data):
+            _, doctor_id, day_number = query.data.split(':')
+            doctor_id, day = int(doctor_id), SLOT_EPOCH.date() + timedelta(days=int(day_number))
+            doctor = get_doctor_by_id(doctor_id)
+            if not doctor or not date.today() <= day < horizon_end():
+                await query.message.reply_text(get_message('invalid_action', lang))
+                return SELECT_DOCTOR
+            waitlist_id, joined = await join_waitlist(user_id, doctor_id, day_slot_key(day))
+            if not waitlist_id:
+                await query.message.reply_text(get_message('error_occurred', lang))
+            else:
+                logger.info(f"User {user_id} joined the waitlist of doctor {doctor_id} for {day}")
+                await query.message.reply_text(get_message('waitlist_joined' if joined else 'waitlist_already', lang,
+                                                           doctor_name=doctor[1], date=day.strftime('%Y-%m-%d')))
+            return SELECT_DOCTOR
+        elif query.data.startswith('wo:') and not (is_user_admin and 'admin_panel' in query.data):
+            waitlist_id = int(query.data[3:], 36)
+            offer = get_waitlist_offer(waitlist_id, user_id)
+            if not offer:
+                await query.message.reply_text(get_message('waitlist_offer_expired', lang))
+                return ConversationHandler.END
+            doctor_id, slot_key, booking_date, slot = offer
+            if not slot_holds.hold(user_id, doctor_id, slot_key):
+                await query.message.reply_text(get_message('waitlist_offer_expired', lang))
+                return ConversationHandler.END
+            context.user_data['selected_slot'] = slot
+            context.user_data['selected_date'] = booking_date
+            context.user_data['selected_slot_key'] = slot_key
+            context.user_data['selected_doctor_id'] = doctor_id
+            context.user_data['waitlist_id'] = waitlist_id
+            context.user_data['state'] = PATIENT_NAME
+            logger.info(f"User {user_id} accepted waitlist offer {waitlist_id} for {slot} on {booking_date}")
+            await prompt_patient(query.message, user_id, lang)
+            return PATIENT_NAME
         elif query.data == 'cancel_booking' and not (is_user_admin and 'admin_panel' in query.data):
             bookings = get_user_bookings(user_id)
             if not bookings:
@@ -1051,34 +4181,28 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 booking_date = b[BOOKING_FIELDS['booking_date']]
                 booking_id = b[BOOKING_FIELDS['id']]
                 button_text = f"{patient_name} at {time_slot} on {booking_date}"
-                callback_data = f'cancel_{booking_id}'
+                callback_data = booking_callback('cancel', booking_id)
                 keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(get_message('select_booking_to_cancel', lang), reply_markup=reply_markup)
-        elif query.data.startswith('cancel_') and not (is_user_admin and 'admin_panel' in query.data):
-            booking_id = int(query.data.split('_')[1])
-            success, result = cancel_booking(booking_id)
+            await show_screen(update, get_message('select_booking_to_cancel', lang), reply_markup)
+        elif booking_action == 'cancel' and not (is_user_admin and 'admin_panel' in query.data):
+            booking_id = callback_booking_id
+            # Admins may cancel any booking from here; everyone else only their own
+            success, result = await cancel_booking(booking_id, None if is_user_admin else user_id, notify_doctor=True)
             if success:
+                mark_handled(query)
                 booking = result
+                slot_page_cache.invalidate(booking[2])
+                if booking[4]:
+                    await offer_freed_slot(booking[2], booking[7])
+                # The doctor's notice was queued with the cancellation
+                outbox_relay.wake()
                 await query.message.reply_text(
                     get_message('booking_cancelled', lang,
                                 patient_name=booking[5],
                                 date=booking[0],
                                 time=booking[1])
                 )
-                try:
-                    doctor = get_doctor_by_id(booking[2])
-                    doctor_lang = get_user_language(booking[2])
-                    await context.bot.send_message(
-                        chat_id=booking[2],
-                        text=get_message('doctor_cancel_notification', doctor_lang,
-                                         patient_name=booking[5],
-                                         date=booking[0],
-                                         time=booking[1])
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify doctor ID {booking[2]} about cancellation: {e}")
-                    await query.message.reply_text(get_message('failed_to_notify_doctor', lang))
             else:
                 await query.message.reply_text(get_message('failed_to_cancel', lang, reason=result))
         elif query.data == 'info' and not (is_user_admin and 'admin_panel' in query.data):
@@ -1110,7 +4234,45 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(get_message('admin_panel', lang), reply_markup=reply_markup)
+            await show_screen(update, get_message('admin_panel', lang), reply_markup)
+        elif query.data.startswith('pq:'):
+            # decide_bookings only touches the tapping doctor's own bookings, so no role lookup is needed here
+            action = query.data[3:]
+            if 'pending_queue' not in context.user_data:
+                load_pending_queue(context, user_id)
+            queue_ids = [row[0] for row in context.user_data['pending_queue']]
+            selected = context.user_data.setdefault('pending_selected', [])
+            if action.startswith('t:'):
+                booking_id = int(action[2:], 36)
+                if booking_id in selected:
+                    selected.remove(booking_id)
+                elif booking_id in queue_ids:
+                    selected.append(booking_id)
+                await query.edit_message_reply_markup(reply_markup=pending_queue_markup(context, lang))
+            elif action == 'all':
+                selected[:] = [] if len(selected) == len(queue_ids) else queue_ids
+                await query.edit_message_reply_markup(reply_markup=pending_queue_markup(context, lang))
+            elif action in ('ok', 'no'):
+                if not selected:
+                    await query.message.reply_text(get_message('pending_none_selected', lang))
+                    return
+                result = await decide_bookings(user_id, selected, action == 'ok')
+                if result is None:
+                    await query.message.reply_text(get_message('error_occurred', lang))
+                    return
+                decided, skipped = result
+                logger.info(f"Doctor {user_id} {'approved' if action == 'ok' else 'rejected'} {len(decided)} bookings, skipped {skipped}")
+                if decided:
+                    # Rejected requests were pending and never took their slots, so nothing is offered to the waitlist
+                    slot_page_cache.invalidate(user_id)
+                    outbox_relay.wake()
+                notice = get_message('pending_approved' if action == 'ok' else 'pending_rejected', lang,
+                                     count=len(decided), skipped=skipped)
+                load_pending_queue(context, user_id)
+                await query.edit_message_text(pending_queue_text(context, lang, notice),
+                                              reply_markup=pending_queue_markup(context, lang))
+        elif query.data.startswith('search:') and is_user_admin:
+            await send_search_page(query.message, context, lang, int(query.data.split(':')[1]))
         elif query.data == 'back_to_start' and is_user_admin:
             await start(update, context)
         elif query.data == 'admin_bookings' and is_user_admin:
@@ -1125,16 +4287,16 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 booking_date = b[BOOKING_FIELDS['booking_date']]
                 time_slot = b[BOOKING_FIELDS['time_slot']]
                 button_text = f"ID: {booking_id} - {patient_name} ({booking_date} {time_slot})"
-                callback_data = f'admin_booking_{booking_id}'
+                callback_data = booking_callback('admin_view', booking_id)
                 keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
             reply_markup = InlineKeyboardMarkup(keyboard)
             await query.message.reply_text(get_message('admin_bookings', lang), reply_markup=reply_markup)
-        elif query.data.startswith('admin_booking_') and is_user_admin:
-            booking_id = int(query.data.split('_')[2])
+        elif booking_action == 'admin_view' and is_user_admin:
+            booking_id = callback_booking_id
             booking = get_booking_by_id(booking_id)
             if booking:
                 keyboard = [
-                    [InlineKeyboardButton(get_message('admin_cancel_booking', lang), callback_data=f'admin_cancel_{booking_id}')],
+                    [InlineKeyboardButton(get_message('admin_cancel_booking', lang), callback_data=booking_callback('admin_cancel', booking_id))],
                     [InlineKeyboardButton(get_message('back_to_bookings', lang), callback_data='admin_bookings')]
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1150,10 +4312,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                 status=booking[BOOKING_FIELDS['status']]),
                     reply_markup=reply_markup
                 )
-        elif query.data.startswith('admin_cancel_') and is_user_admin:
-            booking_id = int(query.data.split('_')[2])
-            success, result = cancel_booking(booking_id)
+        elif booking_action == 'admin_cancel' and is_user_admin:
+            booking_id = callback_booking_id
+            success, result = await cancel_booking(booking_id)
             if success:
+                slot_page_cache.invalidate(result[2])
+                if result[4]:
+                    await offer_freed_slot(result[2], result[7])
                 await query.message.reply_text(get_message('admin_booking_cancelled', lang, id=booking_id))
             else:
                 await query.message.reply_text(get_message('failed_to_cancel', lang, reason=result))
@@ -1188,8 +4353,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return USER_EDIT
         elif query.data.startswith('admin_delete_user_') and is_user_admin:
             user_id = int(query.data.split('_')[3])
-            delete_user(user_id)
-            await query.message.reply_text(get_message('user_deleted', lang, id=user_id))
+            deleted = await delete_user(user_id)
+            mark_handled(query)
+            await query.message.reply_text(get_message('user_deleted' if deleted else 'user_not_found', lang, id=user_id))
         elif query.data == 'admin_add' and is_user_admin:
             await query.message.reply_text(get_message('admin_add_prompt', lang))
             return ADMIN_ADD
@@ -1203,16 +4369,18 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.message.reply_text(get_message('admin_remove', lang), reply_markup=reply_markup)
         elif query.data.startswith('admin_remove_id_') and is_user_admin:
             admin_id = int(query.data.split('_')[3])
-            remove_admin(admin_id)
+            await remove_admin(admin_id)
             await query.message.reply_text(get_message('admin_removed', lang, id=admin_id))
         elif query.data == 'admin_slots' and is_user_admin:
             keyboard = [
+                [InlineKeyboardButton(get_message('admin_set_hours', lang), callback_data='admin_set_hours')],
+                [InlineKeyboardButton(get_message('admin_slot_exception', lang), callback_data='admin_slot_exception')],
                 [InlineKeyboardButton(get_message('admin_add_slot', lang), callback_data='admin_add_slot')],
                 [InlineKeyboardButton(get_message('view_slots', lang), callback_data='admin_view_slots')],
                 [InlineKeyboardButton(get_message('back_to_admin', lang), callback_data='admin_panel')]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(get_message('admin_slots', lang), reply_markup=reply_markup)
+            await show_screen(update, get_message('admin_slots', lang), reply_markup)
         elif query.data == 'admin_doctors' and is_user_admin:
             keyboard = [
                 [InlineKeyboardButton(get_message('admin_add_doctor', lang), callback_data='admin_add_doctor')],
@@ -1220,11 +4388,19 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [InlineKeyboardButton(get_message('back_to_admin', lang), callback_data='admin_panel')]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(get_message('admin_doctors', lang), reply_markup=reply_markup)
+            await show_screen(update, get_message('admin_doctors', lang), reply_markup)
         elif query.data == 'admin_add_slot' and is_user_admin:
             context.user_data['state'] = ADMIN_ADD_SLOT
             await query.message.reply_text(get_message('admin_add_slot_prompt', lang))
             return ADMIN_ADD_SLOT
+        elif query.data == 'admin_set_hours' and is_user_admin:
+            context.user_data['state'] = ADMIN_SET_HOURS
+            await query.message.reply_text(get_message('admin_set_hours_prompt', lang, time_slots=' '.join(TIME_SLOTS)))
+            return ADMIN_SET_HOURS
+        elif query.data == 'admin_slot_exception' and is_user_admin:
+            context.user_data['state'] = ADMIN_SLOT_EXCEPTION
+            await query.message.reply_text(get_message('admin_slot_exception_prompt', lang))
+            return ADMIN_SLOT_EXCEPTION
         elif query.data == 'admin_add_doctor' and is_user_admin:
             context.user_data['state'] = ADMIN_ADD_DOCTOR
             await query.message.reply_text(get_message('admin_add_doctor_prompt', lang))
@@ -1236,8 +4412,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             message = get_message('slots_list', lang)
             for slot in slots:
-                booking_date = datetime.strptime(slot[0], '%Y-%m-%d')
-                day_name = calendar.day_name[booking_date.weekday()]
+                day_name = calendar.day_name[from_slot_key(slot[3]).weekday()]
                 message += f"{slot[0]} ({day_name}), {slot[1]} with {slot[2]}\n"
             await query.message.reply_text(message)
         elif query.data == 'admin_view_doctors' and is_user_admin:
@@ -1261,130 +4436,163 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif query.data == 'admin_broadcast' and is_user_admin:
             await query.message.reply_text(get_message('broadcast_prompt', lang))
             return BROADCAST
-        elif query.data.startswith('slot_') and not (is_user_admin and 'admin_panel' in query.data):
-            parts = query.data.split('_')
-            slot = parts[1]
-            booking_date = parts[2]
-            doctor_id = parts[3]
+        elif query.data.startswith(('s:', 'slot_')) and not (is_user_admin and 'admin_panel' in query.data):
+            selection = callback_tokens.resolve(user_id, query.data[2:]) if query.data.startswith('s:') else None
+            if not selection:
+                # Expired token or a pre-token button; the schedule has to be fetched again
+                await query.message.reply_text(get_message('slot_selection_expired', lang))
+                return await select_doctor(update, context)
+            doctor_id, slot_key, booking_date, slot = selection
+            if not slot_holds.hold(user_id, doctor_id, slot_key):
+                await query.message.reply_text(get_message('slot_unavailable', lang))
+                return await show_calendar(update, context, doctor_id)
             context.user_data['selected_slot'] = slot
             context.user_data['selected_date'] = booking_date
-            context.user_data['selected_doctor_id'] = int(doctor_id)
+            context.user_data['selected_slot_key'] = slot_key
+            context.user_data['selected_doctor_id'] = doctor_id
             context.user_data['state'] = PATIENT_NAME
             logger.info(f"User {user_id} selected slot {slot} on {booking_date} for doctor {doctor_id}")
-            await query.message.reply_text(get_message('patient_name_prompt', lang))
+            await prompt_patient(query.message, user_id, lang)
             return PATIENT_NAME
+        elif query.data.startswith('pp:') and not (is_user_admin and 'admin_panel' in query.data):
+            if context.user_data.get('state') != PATIENT_NAME or 'selected_slot_key' not in context.user_data:
+                await query.message.reply_text(get_message('invalid_action', lang))
+                return
+            if query.data == 'pp:l':
+                user = storage.get_user(user_id)
+                profile = (user[2], None) if user and user[2] else None
+            else:
+                profile = await storage.fetch('get_patient_profile', user_id, int(query.data[3:], 36))
+            if not profile:
+                await query.message.reply_text(get_message('invalid_action', lang))
+                return PATIENT_NAME
+            patient_name, patient_dob = profile
+            context.user_data['patient_name'] = patient_name
+            if not patient_dob:
+                # A linked patient that has never been booked still needs a date of birth
+                context.user_data['state'] = PATIENT_DOB
+                await query.message.reply_text(get_message('patient_dob_prompt', lang))
+                return PATIENT_DOB
+            return await submit_booking(update, context, patient_name, patient_dob, lang)
         elif query.data == 'book_self' and not (is_user_admin and 'admin_panel' in query.data):
-            conn = sqlite3.connect('doctomed.db', timeout=10)
-            conn.execute('PRAGMA journal_mode=WAL')
             try:
-                c = conn.cursor()
-                c.execute('INSERT OR REPLACE INTO users (user_id, is_caregiver, linked_patient, language) VALUES (?, ?, ?, ?)',
-                          (user_id, 0, None, lang))
-                conn.commit()
+                await storage.save_user(user_id, 0, None, lang)
             except sqlite3.Error as e:
                 logger.error(f"Error registering user {user_id} as self: {e}")
                 await query.message.reply_text(get_message('error_occurred', lang))
                 return
-            finally:
-                conn.close()
             await select_doctor(update, context)
             return SELECT_DOCTOR
         elif query.data == 'book_caregiver' and not (is_user_admin and 'admin_panel' in query.data):
             context.user_data['state'] = CAREGIVER_LINK
             await query.message.reply_text(get_message('caregiver_patient_prompt', lang))
             return CAREGIVER_LINK
-        elif query.data.startswith('approve_booking_'):
-            booking_id = int(query.data.split('_')[2])
-            booking = get_booking_by_id(booking_id)
+        elif booking_action == 'approve':
+            booking_id = callback_booking_id
+            try:
+                booking = await storage.fetch('get_booking', booking_id)
+            except sqlite3.Error as e:
+                logger.error(f"Error fetching booking {booking_id}: {e}")
+                booking = None
             if not booking:
                 await query.message.reply_text(get_message('booking_not_found', lang))
                 return
-            conn = sqlite3.connect('doctomed.db', timeout=10)
-            conn.execute('PRAGMA journal_mode=WAL')
+            if booking[BOOKING_FIELDS['status']] == 'expired':
+                await query.message.reply_text(
+                    get_message('doctor_booking_expired', lang,
+                                patient_name=booking[BOOKING_FIELDS['patient_name']],
+                                date=booking[BOOKING_FIELDS['booking_date']],
+                                time=booking[BOOKING_FIELDS['time_slot']])
+                )
+                return
+            # Only pending requests can be decided; a second tap or a late one after another decision changes nothing
+            if booking[BOOKING_FIELDS['status']] != 'pending':
+                mark_handled(query)
+                await query.message.reply_text(get_message('booking_already_decided', lang, id=booking_id))
+                return
+            # The doctor and both languages only depend on the booking, so they are looked up side by side
             try:
-                c = conn.cursor()
-                c.execute('UPDATE bookings SET status = ?, confirmed = 1 WHERE id = ?', ('approved', booking_id))
-                c.execute('UPDATE doctor_slots SET is_available = 0 WHERE booking_date = ? AND time_slot = ? AND doctor_id = ?',
-                          (booking[BOOKING_FIELDS['booking_date']], booking[BOOKING_FIELDS['time_slot']], booking[BOOKING_FIELDS['doctor_id']]))
-                conn.commit()
+                doctor, user_lang, doctor_lang = await asyncio.gather(
+                    storage.fetch('get_doctor', booking[BOOKING_FIELDS['doctor_id']]),
+                    storage.fetch('get_user_language', booking[BOOKING_FIELDS['user_id']]),
+                    storage.fetch('get_user_language', booking[BOOKING_FIELDS['doctor_id']]))
             except sqlite3.Error as e:
-                logger.error(f"Error approving booking {booking_id}: {e}")
+                logger.error(f"Error loading details for booking {booking_id}: {e}")
                 await query.message.reply_text(get_message('error_occurred', lang))
                 return
-            finally:
-                conn.close()
-            doctor = get_doctor_by_id(booking[BOOKING_FIELDS['doctor_id']])
             doctor_name = doctor[1] if doctor else "Doctor"
-            user_lang = get_user_language(booking[BOOKING_FIELDS['user_id']])
-            doctor_lang = get_user_language(booking[BOOKING_FIELDS['doctor_id']])
-            booking_date = str(booking[BOOKING_FIELDS['booking_date']])
-            try:
-                booking_date_dt = datetime.strptime(booking_date, '%Y-%m-%d')
-            except ValueError as e:
-                logger.error(f"Date parsing error for booking {booking_id} in approve_booking: {e}, booking data: {booking}")
+            slot_key = booking[BOOKING_FIELDS['slot_key']]
+            if slot_key is None:
+                logger.error(f"Missing slot key for booking {booking_id} in approve_booking, booking data: {booking}")
                 await query.message.reply_text(get_message('invalid_booking_date', lang))
                 return
-            day_name = calendar.day_name[booking_date_dt.weekday()]
-            current_date = date.today().strftime('%Y-%m-%d')
-            date_display = "today" if booking[BOOKING_FIELDS['booking_date']] == current_date else f"on {booking[BOOKING_FIELDS['booking_date']]} ({day_name})"
-            try:
-                await context.bot.send_message(
-                    chat_id=booking[BOOKING_FIELDS['user_id']],
-                    text=get_message('booking_approved', user_lang,
-                                     doctor_name=doctor_name,
-                                     date_display=date_display,
-                                     time=booking[BOOKING_FIELDS['time_slot']])
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify user {booking[BOOKING_FIELDS['user_id']]} about approval: {e}")
+            notices = [decision_notice(booking_id, booking[BOOKING_FIELDS['user_id']], user_lang, booking[BOOKING_FIELDS['patient_name']],
+                                       booking[BOOKING_FIELDS['booking_date']], booking[BOOKING_FIELDS['time_slot']], slot_key,
+                                       doctor_name, True)]
+            if not (DOCTOR_DIGEST_ONLY and DOCTOR_DIGEST_TIME):
+                notices.append(outbox_message(f"booking:{booking_id}:approved:doctor", booking[BOOKING_FIELDS['doctor_id']],
+                                              get_message('doctor_approve_notification', doctor_lang,
+                                                          patient_name=booking[BOOKING_FIELDS['patient_name']],
+                                                          date=booking[BOOKING_FIELDS['booking_date']],
+                                                          day_name=calendar.day_name[from_slot_key(slot_key).weekday()],
+                                                          time=booking[BOOKING_FIELDS['time_slot']],
+                                                          dob=booking[BOOKING_FIELDS['patient_dob']],
+                                                          user_id=booking[BOOKING_FIELDS['user_id']]),
+                                              booking_id=booking_id))
+
             try:
-                await context.bot.send_message(
-                    chat_id=booking[BOOKING_FIELDS['doctor_id']],
-                    text=get_message('doctor_approve_notification', doctor_lang,
-                                     patient_name=booking[BOOKING_FIELDS['patient_name']],
-                                     date=booking[BOOKING_FIELDS['booking_date']],
-                                     day_name=day_name,
-                                     time=booking[BOOKING_FIELDS['time_slot']],
-                                     dob=booking[BOOKING_FIELDS['patient_dob']],
-                                     user_id=booking[BOOKING_FIELDS['user_id']])
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify doctor {booking[BOOKING_FIELDS['doctor_id']]} about approval: {e}")
+                approved = await storage.decide_booking(booking_id, True, notices)
+            except sqlite3.Error as e:
+                logger.error(f"Error approving booking {booking_id}: {e}")
+                await query.message.reply_text(get_message('error_occurred', lang))
+                return
+            mark_handled(query)
+            if not approved:
+                await query.message.reply_text(get_message('booking_already_decided', lang, id=booking_id))
+                return
+            slot_page_cache.invalidate(booking[BOOKING_FIELDS['doctor_id']])
+            outbox_relay.wake()
             await query.message.reply_text(get_message('booking_approved_admin', lang, id=booking_id))
-        elif query.data.startswith('reject_booking_'):
-            booking_id = int(query.data.split('_')[2])
+        elif booking_action == 'reject':
+            booking_id = callback_booking_id
             booking = get_booking_by_id(booking_id)
             if not booking:
                 await query.message.reply_text(get_message('booking_not_found', lang))
                 return
-            conn = sqlite3.connect('doctomed.db', timeout=10)
-            conn.execute('PRAGMA journal_mode=WAL')
+            if booking[BOOKING_FIELDS['status']] == 'expired':
+                await query.message.reply_text(
+                    get_message('doctor_booking_expired', lang,
+                                patient_name=booking[BOOKING_FIELDS['patient_name']],
+                                date=booking[BOOKING_FIELDS['booking_date']],
+                                time=booking[BOOKING_FIELDS['time_slot']])
+                )
+                return
+            # Only pending requests can be decided; a second tap or a late one after another decision changes nothing
+            if booking[BOOKING_FIELDS['status']] != 'pending':
+                mark_handled(query)
+                await query.message.reply_text(get_message('booking_already_decided', lang, id=booking_id))
+                return
+            user_lang = get_user_language(booking[BOOKING_FIELDS['user_id']])
+            notices = [decision_notice(booking_id, booking[BOOKING_FIELDS['user_id']], user_lang, booking[BOOKING_FIELDS['patient_name']],
+                                       booking[BOOKING_FIELDS['booking_date']], booking[BOOKING_FIELDS['time_slot']],
+                                       booking[BOOKING_FIELDS['slot_key']], None, False)]
+
             try:
-                c = conn.cursor()
-                c.execute('UPDATE bookings SET status = ?, confirmed = 0 WHERE id = ?', ('rejected', booking_id))
-                conn.commit()
+                rejected = await storage.decide_booking(booking_id, False, notices)
             except sqlite3.Error as e:
                 logger.error(f"Error rejecting booking {booking_id}: {e}")
                 await query.message.reply_text(get_message('error_occurred', lang))
                 return
-            finally:
-                conn.close()
-            user_lang = get_user_language(booking[BOOKING_FIELDS['user_id']])
-            try:
-                await context.bot.send_message(
-                    chat_id=booking[BOOKING_FIELDS['user_id']],
-                    text=get_message('booking_rejected', user_lang,
-                                     patient_name=booking[BOOKING_FIELDS['patient_name']],
-                                     date=booking[BOOKING_FIELDS['booking_date']],
-                                     time=booking[BOOKING_FIELDS['time_slot']])
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify user {booking[BOOKING_FIELDS['user_id']]} about rejection: {e}")
+            mark_handled(query)
+            if not rejected:
+                await query.message.reply_text(get_message('booking_already_decided', lang, id=booking_id))
+                return
+            outbox_relay.wake()
             await query.message.reply_text(get_message('booking_rejected_admin', lang, id=booking_id))
         else:
             await query.message.reply_text(get_message('invalid_action', lang))
     except Exception as e:
-        if "429" in str(e):
+        if isinstance(e, RetryAfter):
             logger.warning(f"Rate limit exceeded for user {user_id}: {e}")
             try:
                 await query.message.reply_text(get_message('rate_limit_exceeded', lang))
@@ -1403,13 +4611,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_booking_start(query, context):
     user_id = query.from_user.id
     lang = context.user_data.get('language', get_user_language(user_id))
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
     try:
-        c = conn.cursor()
-        c.execute('SELECT is_caregiver FROM users WHERE user_id = ?', (user_id,))
-        user = c.fetchone()
-        if not user:
+        if not storage.get_user(user_id):
             keyboard = [
                 [InlineKeyboardButton(get_message('book_self', lang), callback_data='book_self')],
                 [InlineKeyboardButton(get_message('book_caregiver', lang), callback_data='book_caregiver')]
@@ -1430,23 +4633,106 @@ async def handle_booking_start(query, context):
             logger.error(f"Failed to send error message to user {user_id}: {reply_error}")
         context.user_data.clear()
         return
-    finally:
-        conn.close()
+
+# Request the held slot for a patient: the typed date of birth or a saved profile
+async def submit_booking(update, context, patient_name, patient_dob, lang):
+    user_id = update.effective_user.id
+    time_slot = context.user_data['selected_slot']
+    booking_date = context.user_data['selected_date']
+    slot_key = context.user_data['selected_slot_key']
+    doctor_id = context.user_data['selected_doctor_id']
+    username = update.effective_user.username or "N/A"
+    day_name = calendar.day_name[from_slot_key(slot_key).weekday()]
+    doctor_lang = get_user_language(doctor_id)
+    waitlist_id = context.user_data.get('waitlist_id')
+
+    # The doctor's notification commits with the booking; if it later fails for good,
+    # OutboxRelay tells the patient and the admins
+    def notices(booking_id):
+        return [outbox_message(f"booking:{booking_id}:doctor_notification", doctor_id,
+                               get_message('doctor_notification', doctor_lang,
+                                           patient_name=patient_name,
+                                           dob=patient_dob,
+                                           date=booking_date,
+                                           day_name=day_name,
+                                           time=time_slot,
+                                           user_id=user_id,
+                                           username=username),
+                               reply_markup=InlineKeyboardMarkup([
+                                   [InlineKeyboardButton(get_message('approve', doctor_lang), callback_data=booking_callback('approve', booking_id)),
+                                    InlineKeyboardButton(get_message('reject', doctor_lang), callback_data=booking_callback('reject', booking_id))]
+                               ]),
+                               kind='doctor_notification', booking_id=booking_id)]
+
+    booking_id = None
+    if not slot_holds.is_held_by_other(doctor_id, slot_key, user_id):
+        try:
+            booking_id = await storage.create_booking(user_id, patient_name, patient_dob, doctor_id, slot_key, waitlist_id, notices)
+        except sqlite3.Error as e:
+            logger.error(f"Error inserting booking for user {user_id}: {e}")
+            await update.effective_message.reply_text(get_message('booking_error', lang))
+            context.user_data.clear()
+            slot_holds.release(user_id)
+            return ConversationHandler.END
+    if booking_id is None:
+        await update.effective_message.reply_text(get_message('waitlist_offer_expired' if waitlist_id else 'slot_unavailable', lang))
+        context.user_data.clear()
+        slot_holds.release(user_id)
+        return ConversationHandler.END
+    slot_holds.release(user_id)
+    if waitlist_id:
+        slot_holds.release_offer(waitlist_id)
+    outbox_relay.wake()
+
+    await update.effective_message.reply_text(
+        get_message('booking_submitted', lang,
+                    patient_name=patient_name,
+                    dob=patient_dob,
+                    date=booking_date,
+                    time=time_slot)
+    )
+
+    context.user_data.clear()
+    return ConversationHandler.END
 
 # Get doctor ID by name
 def get_doctor_id_by_name(name):
-    conn = sqlite3.connect('doctomed.db', timeout=10)
-    conn.execute('PRAGMA journal_mode=WAL')
+    return storage.get_doctor_id_by_name(name)
+
+# Admin IDs from ADMIN_IDS as integers, skipping blanks and typos
+def configured_admin_ids():
+    admin_ids = []
+    for admin_id in ADMIN_IDS:
+        try:
+            admin_ids.append(int(admin_id.strip()))
+        except ValueError:
+            if admin_id.strip():
+                logger.warning(f"Invalid admin ID in ADMIN_IDS: {admin_id}")
+    return admin_ids
+
+# Send a message to every configured admin; make_text(lang) builds the text in each admin's language.
+# Runs as a background task so the user who triggered it is answered first.
+async def notify_admins(make_text, description):
+    admin_ids = configured_admin_ids()
+    languages = await asyncio.to_thread(get_user_languages, admin_ids)
+    results = await asyncio.gather(
+        *(outbound.submit(admin_id, make_text(languages[admin_id]), OUTBOUND_ADMIN) for admin_id in admin_ids),
+        return_exceptions=True
+    )
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to notify admin ID {admin_id} about {description}: {result}")
+
+# Wait for a queued broadcast and report the outcome to the admin who sent it
+async def report_broadcast(message, deliveries, lang):
+    results = await asyncio.gather(*deliveries, return_exceptions=True)
+    failure_count = sum(1 for result in results if isinstance(result, Exception))
     try:
-        c = conn.cursor()
-        c.execute('SELECT user_id FROM doctors WHERE name = ?', (name,))
-        doctor = c.fetchone()
-        return doctor[0] if doctor else None
-    except sqlite3.Error as e:
-        logger.error(f"Error fetching doctor by name {name}: {e}")
-        return None
-    finally:
-        conn.close()
+        await message.reply_text(
+            get_message('broadcast_result', lang, success=len(results) - failure_count, failed=failure_count)
+        )
+    except Exception as e:
+        logger.error(f"Failed to send broadcast result to admin {message.chat_id}: {e}")
 
 # Handle message
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -1458,19 +4744,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         is_user_admin = is_admin(user_id)
         if context.user_data.get('state') == CAREGIVER_LINK and not is_user_admin:
-            conn = sqlite3.connect('doctomed.db', timeout=10)
-            conn.execute('PRAGMA journal_mode=WAL')
             try:
-                c = conn.cursor()
-                c.execute('INSERT OR REPLACE INTO users (user_id, is_caregiver, linked_patient, language) VALUES (?, ?, ?, ?)',
-                          (user_id, 1, text, lang))
-                conn.commit()
+                await storage.save_user(user_id, 1, text, lang)
             except sqlite3.Error as e:
                 logger.error(f"Error registering caregiver for user {user_id}: {e}")
                 await update.message.reply_text(get_message('error_occurred', lang))
                 return ConversationHandler.END
-            finally:
-                conn.close()
             context.user_data.pop('state', None)
             await update.message.reply_text(
                 get_message('caregiver_registered', lang, patient_name=text)
@@ -1485,102 +4764,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         elif context.user_data.get('state') == PATIENT_DOB and not is_user_admin:
             try:
                 patient_dob = datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d')
-                patient_name = context.user_data['patient_name']
-                time_slot = context.user_data['selected_slot']
-                booking_date = context.user_data['selected_date']
-                doctor_id = context.user_data['selected_doctor_id']
-                
-                try:
-                    datetime.strptime(booking_date, '%Y-%m-%d')
-                except ValueError:
-                    logger.error(f"Invalid booking_date: {booking_date}")
-                    await update.message.reply_text(get_message('error_occurred', lang))
-                    context.user_data.clear()
-                    return ConversationHandler.END
-                
-                conn = sqlite3.connect('doctomed.db', timeout=10)
-                conn.execute('PRAGMA journal_mode=WAL')
-                try:
-                    c = conn.cursor()
-                    c.execute('SELECT is_available FROM doctor_slots WHERE booking_date = ? AND time_slot = ? AND doctor_id = ?', 
-                              (booking_date, time_slot, doctor_id))
-                    slot = c.fetchone()
-                    if not slot or slot[0] == 0:
-                        await update.message.reply_text(get_message('slot_unavailable', lang))
-                        context.user_data.clear()
-                        return ConversationHandler.END
-                    
-                    c.execute('INSERT INTO bookings (user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, status, confirmed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                              (user_id, patient_name, patient_dob, time_slot, booking_date, doctor_id, 'pending', 0))
-                    booking_id = c.lastrowid
-                    conn.commit()
-                except sqlite3.Error as e:
-                    logger.error(f"Error inserting booking for user {user_id}: {e}")
-                    await update.message.reply_text(get_message('booking_error', lang))
-                    context.user_data.clear()
-                    return ConversationHandler.END
-                finally:
-                    conn.close()
-                
-                username = update.message.from_user.username or "N/A"
-                booking_date_dt = datetime.strptime(booking_date, '%Y-%m-%d')
-                day_name = calendar.day_name[booking_date_dt.weekday()]
-                doctor_lang = get_user_language(doctor_id)
-                try:
-                    await context.bot.send_message(
-                        chat_id=doctor_id,
-                        text=get_message('doctor_notification', doctor_lang,
-                                         patient_name=patient_name,
-                                         dob=patient_dob,
-                                         date=booking_date,
-                                         day_name=day_name,
-                                         time=time_slot,
-                                         user_id=user_id,
-                                         username=username),
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton(get_message('approve', doctor_lang), callback_data=f'approve_booking_{booking_id}'),
-                             InlineKeyboardButton(get_message('reject', doctor_lang), callback_data=f'reject_booking_{booking_id}')]
-                        ])
-                    )
-                except Exception as e:
-                    error_message = f"Failed to notify doctor ID {doctor_id}: {e}"
-                    logger.error(error_message)
-                    user_message = get_message('doctor_notification_error', lang, reason=str(e))
-                    if "chat not found" in str(e).lower():
-                        user_message = get_message('doctor_notification_error', lang, reason="Doctor's Telegram account not found. Please ensure the doctor has started the bot.")
-                    elif "blocked" in str(e).lower():
-                        user_message = get_message('doctor_notification_error', lang, reason="Bot is blocked by the doctor. Please contact the doctor to unblock the bot.")
-                    await update.message.reply_text(user_message)
-                    for admin_id in ADMIN_IDS:
-                        try:
-                            admin_lang = get_user_language(int(admin_id))
-                            await context.bot.send_message(
-                                chat_id=int(admin_id),
-                                text=f"⚠️ Notification error for booking ID {booking_id}: {error_message}"
-                            )
-                            await asyncio.sleep(0.1)  # Rate limit delay
-                        except Exception as admin_error:
-                            logger.error(f"Failed to notify admin {admin_id}: {admin_error}")
-                    context.user_data.clear()
-                    return ConversationHandler.END
-                
-                await update.message.reply_text(
-                    get_message('booking_submitted', lang,
-                                patient_name=patient_name,
-                                dob=patient_dob,
-                                date=booking_date,
-                                time=time_slot)
-                )
-                
-                context.user_data.clear()
-                return ConversationHandler.END
             except ValueError:
                 await update.message.reply_text(get_message('invalid_date_format', lang))
                 return PATIENT_DOB
+            return await submit_booking(update, context, context.user_data['patient_name'], patient_dob, lang)
         elif context.user_data.get('state') == ADMIN_ADD and is_user_admin:
             try:
                 new_admin_id = int(text)
-                add_admin(new_admin_id)
+                await add_admin(new_admin_id)
                 await update.message.reply_text(get_message('admin_added', lang, id=new_admin_id))
             except ValueError:
                 await update.message.reply_text(get_message('invalid_admin_id', lang))
@@ -1592,19 +4783,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 is_caregiver, linked_patient = text.split(',')
                 is_caregiver = int(is_caregiver.strip())
                 linked_patient = linked_patient.strip() or None
-                conn = sqlite3.connect('doctomed.db', timeout=10)
-                conn.execute('PRAGMA journal_mode=WAL')
                 try:
-                    c = conn.cursor()
-                    c.execute('UPDATE users SET is_caregiver = ?, linked_patient = ? WHERE user_id = ?',
-                              (is_caregiver, linked_patient, edit_user_id))
-                    conn.commit()
+                    await storage.update_user(edit_user_id, is_caregiver, linked_patient)
                 except sqlite3.Error as e:
                     logger.error(f"Error updating user {edit_user_id}: {e}")
                     await update.message.reply_text(get_message('error_occurred', lang))
                     return ConversationHandler.END
-                finally:
-                    conn.close()
                 await update.message.reply_text(get_message('user_updated', lang, id=edit_user_id))
             except ValueError:
                 await update.message.reply_text(get_message('invalid_user_format', lang))
@@ -1613,20 +4797,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return ConversationHandler.END
         elif context.user_data.get('state') == BROADCAST and is_user_admin:
             users = get_all_users()
-            success_count = 0
-            failure_count = 0
+            deliveries = []
             for user in users:
                 user_lang = user[3] if user[3] in LANGUAGES else 'en'
-                try:
-                    await context.bot.send_message(chat_id=user[0], text=f"📢 {get_message('announcement', user_lang, default='Announcement')}: {text}")
-                    success_count += 1
-                    await asyncio.sleep(0.1)  # Rate limit delay
-                except Exception as e:
-                    logger.error(f"Failed to send broadcast to User ID {user[0]}: {e}")
-                    failure_count += 1
-            await update.message.reply_text(
-                get_message('broadcast_result', lang, success=success_count, failed=failure_count)
-            )
+                deliveries.append(outbound.submit(user[0], f"📢 {get_message('announcement', user_lang, default='Announcement')}: {text}",
+                                                  OUTBOUND_BROADCAST))
+            # Broadcasts go out in the lowest lane; the admin gets the result once the queue has sent them
+            create_background_task(context.application, report_broadcast(update.message, deliveries, lang))
+            await update.message.reply_text(get_message('broadcast_queued', lang, count=len(deliveries)))
             context.user_data.pop('state', None)
             return ConversationHandler.END
         elif context.user_data.get('state') == ADMIN_ADD_SLOT and is_user_admin:
@@ -1635,28 +4813,22 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 booking_date = booking_date.strip()
                 time_slot = time_slot.strip()
                 doctor_id = int(doctor_id.strip())
-                datetime.strptime(booking_date, '%Y-%m-%d')
                 if time_slot not in TIME_SLOTS:
                     raise ValueError
-                conn = sqlite3.connect('doctomed.db', timeout=10)
-                conn.execute('PRAGMA journal_mode=WAL')
-                try:
-                    c = conn.cursor()
-                    c.execute('SELECT user_id FROM doctors WHERE user_id = ?', (doctor_id,))
-                    if not c.fetchone():
-                        raise ValueError
-                    c.execute('INSERT OR IGNORE INTO doctor_slots (booking_date, time_slot, doctor_id, is_available) VALUES (?, ?, ?, ?)',
-                              (booking_date, time_slot, doctor_id, 1))
-                    conn.commit()
-                except ValueError:
+                slot_key = to_slot_key(booking_date, time_slot)
+                booking_date = from_slot_key(slot_key).strftime('%Y-%m-%d')
+                if not storage.get_doctor(doctor_id):
                     await update.message.reply_text(get_message('invalid_doctor_id', lang))
                     return ADMIN_ADD_SLOT
+                try:
+                    # A one-off slot is an 'extra' exception; it no longer needs its own doctor_slots row
+                    await storage.add_slot_exception(doctor_id, slot_key - slot_key % 1440, time_slot, 'extra')
                 except sqlite3.Error as e:
                     logger.error(f"Error adding doctor slot: {e}")
                     await update.message.reply_text(get_message('error_occurred', lang))
                     return ConversationHandler.END
-                finally:
-                    conn.close()
+                slot_page_cache.invalidate(doctor_id)
+                await offer_freed_slot(doctor_id, slot_key)
                 await update.message.reply_text(
                     get_message('slot_added', lang, date=booking_date, time=time_slot, doctor_id=doctor_id)
                 )
@@ -1665,23 +4837,86 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 return ADMIN_ADD_SLOT
             context.user_data.pop('state', None)
             return ConversationHandler.END
+        elif context.user_data.get('state') == ADMIN_SET_HOURS and is_user_admin:
+            try:
+                doctor_id, days, times = (part.strip() for part in text.split(','))
+                doctor_id = int(doctor_id)
+                weekdays = set()
+                for part in days.split():
+                    first, _, last = part.partition('-')
+                    weekdays.update(range(int(first) - 1, int(last or first)))
+                times = TIME_SLOTS if times == '*' else [] if times == '-' else times.split()
+                if not weekdays or not weekdays <= set(range(7)) or not set(times) <= set(TIME_SLOTS):
+                    raise ValueError
+                if not storage.get_doctor(doctor_id):
+                    await update.message.reply_text(get_message('invalid_doctor_id', lang))
+                    return ADMIN_SET_HOURS
+                today = date.today()
+                horizon = (day_slot_key(today), day_slot_key(horizon_end(today)))
+                try:
+                    open_before = {slot[0] for slot in storage.get_open_slots([doctor_id], *horizon)}
+                    # The given weekdays are replaced as a whole; other days keep their hours
+                    await storage.set_doctor_hours(doctor_id, weekdays, times)
+                    opened = [slot[0] for slot in storage.get_open_slots([doctor_id], *horizon) if slot[0] not in open_before]
+                except sqlite3.Error as e:
+                    logger.error(f"Error setting hours for doctor {doctor_id}: {e}")
+                    await update.message.reply_text(get_message('error_occurred', lang))
+                    return ConversationHandler.END
+                slot_page_cache.invalidate(doctor_id)
+                # Newly opened slots go to waitlisted patients the same way a one-off extra slot does
+                for slot_key in opened:
+                    await offer_freed_slot(doctor_id, slot_key)
+                await update.message.reply_text(
+                    get_message('hours_set', lang, doctor_id=doctor_id,
+                                days=', '.join(calendar.day_abbr[weekday] for weekday in sorted(weekdays)),
+                                times=' '.join(sorted(set(times))) or '-')
+                )
+            except ValueError:
+                await update.message.reply_text(get_message('invalid_hours_format', lang))
+                return ADMIN_SET_HOURS
+            context.user_data.pop('state', None)
+            return ConversationHandler.END
+        elif context.user_data.get('state') == ADMIN_SLOT_EXCEPTION and is_user_admin:
+            try:
+                parts = [part.strip() for part in text.split(',')]
+                if len(parts) not in (3, 4) or parts[2] not in ('off', 'extra') or (parts[2] == 'extra' and len(parts) == 3):
+                    raise ValueError
+                doctor_id, kind = int(parts[0]), parts[2]
+                day = datetime.strptime(parts[1], '%Y-%m-%d').date()
+                time_slot = datetime.strptime(parts[3], '%H:%M').strftime('%H:%M') if len(parts) == 4 else None
+                if not storage.get_doctor(doctor_id):
+                    await update.message.reply_text(get_message('invalid_doctor_id', lang))
+                    return ADMIN_SLOT_EXCEPTION
+                try:
+                    await storage.add_slot_exception(doctor_id, day_slot_key(day), time_slot, kind)
+                except sqlite3.Error as e:
+                    logger.error(f"Error adding slot exception for doctor {doctor_id}: {e}")
+                    await update.message.reply_text(get_message('error_occurred', lang))
+                    return ConversationHandler.END
+                slot_page_cache.invalidate(doctor_id)
+                if kind == 'extra':
+                    slot_key = day_slot_key(day) + time_slot_minutes(time_slot)
+                    await offer_freed_slot(doctor_id, slot_key)
+                await update.message.reply_text(
+                    get_message('exception_added', lang, doctor_id=doctor_id, date=day.strftime('%Y-%m-%d'),
+                                kind=kind, time=time_slot or get_message('whole_day', lang))
+                )
+            except ValueError:
+                await update.message.reply_text(get_message('invalid_exception_format', lang))
+                return ADMIN_SLOT_EXCEPTION
+            context.user_data.pop('state', None)
+            return ConversationHandler.END
         elif context.user_data.get('state') == ADMIN_ADD_DOCTOR and is_user_admin:
             try:
                 user_id, name = text.split(',')
                 user_id = int(user_id.strip())
                 name = name.strip()
-                conn = sqlite3.connect('doctomed.db', timeout=10)
-                conn.execute('PRAGMA journal_mode=WAL')
                 try:
-                    c = conn.cursor()
-                    c.execute('INSERT OR IGNORE INTO doctors (user_id, name) VALUES (?, ?)', (user_id, name))
-                    conn.commit()
+                    await storage.add_doctor(user_id, name)
                 except sqlite3.Error as e:
                     logger.error(f"Error adding doctor: {e}")
                     await update.message.reply_text(get_message('error_occurred', lang))
                     return ConversationHandler.END
-                finally:
-                    conn.close()
                 await update.message.reply_text(
                     get_message('doctor_added', lang, name=name, id=user_id)
                 )
@@ -1691,23 +4926,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             context.user_data.pop('state', None)
             return ConversationHandler.END
         elif context.user_data.get('state') == SUPPORT_REQUEST and not is_user_admin:
-            if log_support_request(user_id, text):
-                for admin_id in ADMIN_IDS:
-                    try:
-                        admin_lang = get_user_language(int(admin_id))
-                        username = update.message.from_user.username or "N/A"
-                        await context.bot.send_message(
-                            chat_id=int(admin_id),
-                            text=(
-                                f"🔔 {get_message('new_support_request', admin_lang, default='New support request')} "
-                                f"from User ID {user_id} (Username: {username}):\n"
-                                f"Message: {text}"
-                            )
-                        )
-                        await asyncio.sleep(0.1)  # Rate limit delay
-                    except Exception as e:
-                        logger.error(f"Failed to notify admin ID {admin_id} about support request: {e}")
+            if await log_support_request(user_id, text):
+                username = update.message.from_user.username or "N/A"
                 await update.message.reply_text(get_message('support_submitted', lang))
+                context.application.create_task(notify_admins(
+                    lambda admin_lang: (
+                        f"🔔 {get_message('new_support_request', admin_lang, default='New support request')} "
+                        f"from User ID {user_id} (Username: {username}):\n"
+                        f"Message: {text}"
+                    ),
+                    'support request'
+                ))
             else:
                 await update.message.reply_text(get_message('support_failed', lang))
             context.user_data.pop('state', None)
@@ -1716,7 +4945,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text(get_message('invalid_action', lang))
             return ConversationHandler.END
     except Exception as e:
-        if "429" in str(e):
+        if isinstance(e, RetryAfter):
             logger.warning(f"Rate limit exceeded for user {user_id}: {e}")
             try:
                 await update.message.reply_text(get_message('rate_limit_exceeded', lang))
@@ -1731,6 +4960,212 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data.clear()
         return ConversationHandler.END
 
+# Persistence for user_data and the conversation states in doctomed.db. update_* calls only record the
+# latest JSON of an entry; everything marked during one Application.update_persistence() run is written
+# in a single transaction, so a flush costs the changed entries rather than all of user_data.
+class SQLitePersistence(BasePersistence):
+    def __init__(self, path='doctomed.db', update_interval=60):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.path = path
+        self.counters = Counter()
+        self._dirty = {}
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    def _load(self, kind):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        try:
+            c = conn.cursor()
+            c.execute('SELECT key, data FROM persistence WHERE kind = ?', (kind,))
+            return c.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error loading persisted {kind} data: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def _write(self, batch):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        try:
+            c = conn.cursor()
+            updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            c.executemany('''INSERT INTO persistence (kind, key, data, updated_at) VALUES (?, ?, ?, ?)
+                             ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at''',
+                          [(kind, key, data, updated_at) for (kind, key), data in batch.items() if data is not None])
+            c.executemany('DELETE FROM persistence WHERE kind = ? AND key = ?',
+                          [(kind, key) for (kind, key), data in batch.items() if data is None])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error writing {len(batch)} persistence entries: {e}")
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+
+    # Record the newest state of an entry; None deletes it. The write happens once the current batch of updates is done.
+    def _mark(self, kind, key, data):
+        self._dirty[(kind, key)] = data
+        if not self._flush_task:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    def _dump(self, kind, key, data):
+        try:
+            self._mark(kind, key, json.dumps(data))
+        except (TypeError, ValueError) as e:
+            logger.error(f"Not persisting {kind} data for {key}: {e}")
+
+    async def _flush_soon(self):
+        # update_persistence() gathers all update_* calls; yielding once lets the whole run land in one batch
+        await asyncio.sleep(0)
+        self._flush_task = None
+        await self._flush_dirty()
+
+    async def _flush_dirty(self):
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            started = time.perf_counter()
+            if await asyncio.to_thread(self._write, batch):
+                self.counters['flushes'] += 1
+                self.counters['entries'] += len(batch)
+                logger.debug(f"Persisted {len(batch)} entries in {(time.perf_counter() - started) * 1000:.1f} ms")
+            else:
+                # Keep the batch for the next flush unless a newer state was recorded meanwhile
+                for key, data in batch.items():
+                    self._dirty.setdefault(key, data)
+
+    async def get_user_data(self):
+        rows = await asyncio.to_thread(self._load, 'user')
+        return {int(key): json.loads(data) for key, data in rows}
+
+    async def get_chat_data(self):
+        rows = await asyncio.to_thread(self._load, 'chat')
+        return {int(key): json.loads(data) for key, data in rows}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(self._load, f'conversation:{name}')
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            self._mark(f'conversation:{name}', json.dumps(list(key)), None)
+        else:
+            self._dump(f'conversation:{name}', json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._dump('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._dump('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._mark('user', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark('chat', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task:
+            await self._flush_task
+        await self._flush_dirty()
+
+# Build the application with all handlers registered
+def build_application():
+    builder = Application.builder().token(BOT_TOKEN)
+    if TELEGRAM_API_URL:
+        api_url = TELEGRAM_API_URL.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    # In-flight bookings survive restarts; the interval is how long changed state may wait before it is written
+    builder = builder.persistence(SQLitePersistence(update_interval=PERSISTENCE_INTERVAL_SECONDS))
+    application = builder.post_init(start_delivery).post_stop(stop_delivery).build()
+    application.add_handler(TypeHandler(Update, track_activity), group=-2)
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
+
+    conv_handler = ConversationHandler(
+        name='main',
+        persistent=True,
+        entry_points=[
+            CallbackQueryHandler(button_callback),
+            MessageHandler(Text() & ~COMMAND, handle_message),
+        ],
+        states={
+            SELECT_LANGUAGE: [CallbackQueryHandler(button_callback, pattern='^lang_')],
+            SELECT_DOCTOR: [CallbackQueryHandler(button_callback, pattern='^(doctor_|slot_|s:|cal:|wl:|wo:|select_doctor)')],
+            PATIENT_NAME: [MessageHandler(Text() & ~COMMAND, handle_message), CallbackQueryHandler(button_callback, pattern='^pp:')],
+            PATIENT_DOB: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            CAREGIVER_LINK: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            CANCEL_BOOKING: [CallbackQueryHandler(button_callback, pattern='^(cancel_|c:)')],
+            ADMIN_ADD: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            USER_EDIT: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            BROADCAST: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            ADMIN_ADD_SLOT: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            ADMIN_ADD_DOCTOR: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            ADMIN_SET_HOURS: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            ADMIN_SLOT_EXCEPTION: [MessageHandler(Text() & ~COMMAND, handle_message)],
+            SUPPORT_REQUEST: [MessageHandler(Text() & ~COMMAND, handle_message)],
+        },
+        fallbacks=[
+            CommandHandler('start', start),
+            CommandHandler('cancel', cancel),
+            CommandHandler('language', language)
+        ]
+    )
+
+    application.add_handler(CommandHandler('start', start))
+    application.add_handler(CommandHandler('cancel', cancel))
+    application.add_handler(CommandHandler('language', language))
+    application.add_handler(CommandHandler('health', health))
+    application.add_handler(CommandHandler('search', search))
+    application.add_handler(CommandHandler('pending', pending))
+    application.add_handler(conv_handler)
+
+    if application.job_queue:
+        application.job_queue.run_repeating(archive_job, interval=ARCHIVE_INTERVAL_HOURS * 3600, first=60)
+        application.job_queue.run_repeating(expire_pending_job, interval=PENDING_SWEEP_INTERVAL_MINUTES * 60, first=30)
+        application.job_queue.run_repeating(waitlist_job, interval=60, first=45)
+        if isinstance(getattr(conv_handler, '_conversations', None), dict):
+            application.job_queue.run_once(track_restored_sessions, when=0, data=conv_handler)
+            application.job_queue.run_repeating(idle_sweep_job, interval=IDLE_SWEEP_SECONDS, first=IDLE_SWEEP_SECONDS, data=conv_handler)
+        else:
+            logger.error("ConversationHandler no longer exposes _conversations; idle conversations will not be evicted")
+        if DOCTOR_DIGEST_TIME:
+            try:
+                hour, minute = (int(part) for part in DOCTOR_DIGEST_TIME.split(':'))
+                # Slot keys are local time, so the digest runs on the local clock too
+                digest_time = dtime(hour, minute, tzinfo=local_timezone())
+                application.job_queue.run_daily(doctor_digest_job, time=digest_time)
+            except ValueError:
+                logger.error(f"Invalid DOCTOR_DIGEST_TIME {DOCTOR_DIGEST_TIME!r}; expected HH:MM")
+    else:
+        logger.warning("JobQueue not available; install python-telegram-bot[job-queue] to enable archival and pending expiry")
+    return application
+
 # Main function
 def main():
     init_db()
@@ -1740,39 +5175,7 @@ def main():
         return
     
     try:
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        conv_handler = ConversationHandler(
-            entry_points=[
-                CallbackQueryHandler(button_callback),
-                MessageHandler(Text() & ~COMMAND, handle_message),
-            ],
-            states={
-                SELECT_LANGUAGE: [CallbackQueryHandler(button_callback, pattern='^lang_')],
-                SELECT_DOCTOR: [CallbackQueryHandler(button_callback, pattern='^(doctor_|slot_|select_doctor)')],
-                PATIENT_NAME: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                PATIENT_DOB: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                CAREGIVER_LINK: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                CANCEL_BOOKING: [CallbackQueryHandler(button_callback, pattern='^cancel_')],
-                ADMIN_ADD: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                USER_EDIT: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                BROADCAST: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                ADMIN_ADD_SLOT: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                ADMIN_ADD_DOCTOR: [MessageHandler(Text() & ~COMMAND, handle_message)],
-                SUPPORT_REQUEST: [MessageHandler(Text() & ~COMMAND, handle_message)],
-            },
-            fallbacks=[
-                CommandHandler('start', start),
-                CommandHandler('cancel', cancel),
-                CommandHandler('language', language)
-            ]
-        )
-        
-        application.add_handler(CommandHandler('start', start))
-        application.add_handler(CommandHandler('cancel', cancel))
-        application.add_handler(CommandHandler('language', language))
-        application.add_handler(CommandHandler('health', health))
-        application.add_handler(conv_handler)
+        application = build_application()
         
         logger.info("Starting bot polling")
         application.run_polling(poll_interval=1.0, timeout=10)
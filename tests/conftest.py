@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+# Make bot.py importable when pytest is run from any directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import bot
+
+DOCTOR_ID = 900000
+USER_ID = 100000
+OTHER_USER_ID = 100001
+
+# A fresh doctomed.db in a temporary directory with one doctor working 09:00 and 10:00 every day
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot, 'waitlist_queue', bot.WaitlistQueue())
+    bot.init_db()
+    conn = bot.sqlite3.connect('doctomed.db')
+    try:
+        conn.execute('INSERT INTO doctors (user_id, name) VALUES (?, ?)', (DOCTOR_ID, 'Dr. Test'))
+        conn.executemany('INSERT INTO users (user_id, is_caregiver, linked_patient, language) VALUES (?, 0, NULL, ?)',
+                         [(DOCTOR_ID, 'en'), (USER_ID, 'en'), (OTHER_USER_ID, 'de')])
+        conn.executemany('INSERT INTO doctor_hours (doctor_id, weekday, time_slot) VALUES (?, ?, ?)',
+                         [(DOCTOR_ID, weekday, time_slot) for weekday in range(7) for time_slot in ('09:00', '10:00')])
+        conn.commit()
+    finally:
+        conn.close()
+    yield tmp_path / 'doctomed.db'
+    bot.db_reader.close()
+
+# Both backends, loaded from the same database
+@pytest.fixture(params=['sqlite', 'memory'])
+def storage(request, database):
+    return bot.SQLiteStorage() if request.param == 'sqlite' else bot.MemoryStorage.load()
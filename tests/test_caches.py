@@ -0,0 +1,40 @@
+import bot
+
+def test_slot_page_cache_invalidate_drops_pages():
+    cache = bot.SlotPageCache(ttl_seconds=60)
+    cache.put(1, 10, ['a'])
+    cache.put(2, 10, ['b'])
+    cache.invalidate(1)
+    assert cache.get(1, 10) is None
+    assert cache.get(2, 10) == ['b']
+
+# A prefetch that read before an invalidation must not bring the old page back
+def test_slot_page_cache_ignores_pages_from_an_older_generation():
+    cache = bot.SlotPageCache(ttl_seconds=60)
+    generation = cache.generation(1)
+    cache.invalidate(1)
+    cache.put(1, 10, ['stale'], generation)
+    assert cache.get(1, 10) is None
+    cache.put(1, 10, ['fresh'], cache.generation(1))
+    assert cache.get(1, 10) == ['fresh']
+
+def test_slot_page_cache_expires_pages():
+    cache = bot.SlotPageCache(ttl_seconds=0)
+    cache.put(1, 10, ['a'])
+    assert cache.get(1, 10) is None
+
+def test_flood_control_drops_only_consecutive_identical_taps():
+    flood = bot.FloodControl(rate=1, burst=10, duplicate_seconds=60)
+    assert not flood.is_duplicate(1, ('page:a', 5))
+    assert flood.is_duplicate(1, ('page:a', 5))
+    # Paging A -> B -> A taps the same button on the same message again
+    assert not flood.is_duplicate(1, ('page:b', 5))
+    assert not flood.is_duplicate(1, ('page:a', 5))
+    # The same button on another message, or by another user, is a new tap
+    assert not flood.is_duplicate(1, ('page:a', 6))
+    assert not flood.is_duplicate(2, ('page:a', 6))
+
+def test_flood_control_allows_a_repeat_after_the_window():
+    flood = bot.FloodControl(rate=1, burst=10, duplicate_seconds=0)
+    assert not flood.is_duplicate(1, ('page:a', 5))
+    assert not flood.is_duplicate(1, ('page:a', 5))
@@ -0,0 +1,70 @@
+import asyncio
+import sqlite3
+import time
+
+import bot
+
+def store_note(c, note):
+    c.execute('INSERT INTO support_requests (user_id, message, timestamp, status) VALUES (1, ?, ?, ?)', (note, '', 'open'))
+    return c.lastrowid
+
+def slow_store_note(c, note):
+    time.sleep(0.2)
+    return store_note(c, note)
+
+def failing_store_note(c, note):
+    store_note(c, note)
+    raise sqlite3.IntegrityError('rejected')
+
+def notes(database):
+    conn = sqlite3.connect(database)
+    try:
+        return sorted(row[0] for row in conn.execute('SELECT message FROM support_requests'))
+    finally:
+        conn.close()
+
+def test_submit_before_start_and_after_stop_commits(database):
+    async def run():
+        writer = bot.DbWriter()
+        await writer.submit(store_note, 'before start')
+        await writer.start()
+        await writer.submit(store_note, 'running')
+        await writer.stop()
+        await writer.submit(store_note, 'after stop')
+
+    asyncio.run(run())
+    assert notes(database) == ['after stop', 'before start', 'running']
+
+# A submit made once the writer has taken stop()'s sentinel, before stop() returns, must not be queued
+# where nothing will ever run it
+def test_submit_while_stopping_does_not_hang(database):
+    async def run():
+        writer = bot.DbWriter()
+        await writer.start()
+
+        async def busy_then_late():
+            await writer.submit(slow_store_note, 'busy')
+            # The writer took the sentinel right after finishing 'busy'; stop() has not resumed yet
+            await writer.submit(store_note, 'late')
+
+        submits = asyncio.create_task(busy_then_late())
+        await asyncio.sleep(0.05)
+        await asyncio.wait_for(asyncio.gather(writer.stop(), submits), timeout=5)
+
+    asyncio.run(run())
+    assert notes(database) == ['busy', 'late']
+
+def test_failed_operation_rolls_back_alone(database):
+    async def run():
+        writer = bot.DbWriter()
+        await writer.start()
+        try:
+            return await asyncio.gather(writer.submit(store_note, 'kept'), writer.submit(failing_store_note, 'dropped'),
+                                        return_exceptions=True)
+        finally:
+            await writer.stop()
+
+    kept, dropped = asyncio.run(run())
+    assert isinstance(kept, int)
+    assert isinstance(dropped, sqlite3.IntegrityError)
+    assert notes(database) == ['kept']
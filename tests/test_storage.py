@@ -0,0 +1,82 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+import bot
+from conftest import DOCTOR_ID, OTHER_USER_ID, USER_ID
+
+def tomorrow_slot(time_slot='09:00'):
+    return bot.to_slot_key((date.today() + timedelta(days=1)).strftime('%Y-%m-%d'), time_slot)
+
+def request_notice(booking_id):
+    return [bot.outbox_message(f"booking:{booking_id}:new:doctor", DOCTOR_ID, f"New booking {booking_id}", booking_id=booking_id)]
+
+async def book(storage, slot_key, waitlist_id=None, user_id=USER_ID):
+    return await storage.create_booking(user_id, 'Test Patient', '01/01/1980', DOCTOR_ID, slot_key, waitlist_id, request_notice)
+
+async def queued_booking_ids(storage):
+    return sorted(row[6] for row in await storage.claim_outbox(100))
+
+def decision(booking_id, slot_key, approve):
+    return [bot.decision_notice(booking_id, USER_ID, 'en', 'Test Patient', '2030-01-01', '09:00', slot_key, 'Dr. Test', approve)]
+
+@pytest.mark.parametrize('approve', [True, False])
+def test_second_decision_changes_nothing(storage, approve):
+    async def run():
+        slot_key = tomorrow_slot()
+        booking_id = await book(storage, slot_key)
+        first = await storage.decide_booking(booking_id, approve, decision(booking_id, slot_key, approve))
+        second = await storage.decide_booking(booking_id, approve, decision(booking_id, slot_key, approve))
+        other = await storage.decide_booking(booking_id, not approve, decision(booking_id, slot_key, not approve))
+        return booking_id, first, second, other, await queued_booking_ids(storage)
+
+    booking_id, first, second, other, queued = asyncio.run(run())
+    assert (first, second, other) == (True, False, False)
+    assert storage.get_booking(booking_id)[7] == ('approved' if approve else 'rejected')
+    # The request notice and a single decision notice
+    assert queued == [booking_id, booking_id]
+
+def test_cancel_is_owner_only_and_idempotent(storage):
+    async def run():
+        slot_key = tomorrow_slot()
+        booking_id = await book(storage, slot_key)
+        await storage.decide_booking(booking_id, True, [])
+        await storage.claim_outbox(100)
+        results = [await storage.cancel_booking(booking_id, OTHER_USER_ID, notify_doctor=True),
+                   await storage.cancel_booking(booking_id, USER_ID, notify_doctor=True),
+                   await storage.cancel_booking(booking_id, USER_ID, notify_doctor=True)]
+        return booking_id, slot_key, results, await storage.claim_outbox(100)
+
+    booking_id, slot_key, (other, owner, again), queued = asyncio.run(run())
+    assert other == (False, "Booking not found.")
+    assert owner[0] is True
+    assert again == (False, "Booking is already cancelled.")
+    assert [(row[1], row[6]) for row in queued] == [(DOCTOR_ID, booking_id)]
+    assert slot_key in [slot[0] for slot in storage.get_open_slots([DOCTOR_ID], slot_key, slot_key + 1)]
+
+def offer_slot(storage, slot_key):
+    async def run():
+        waitlist_id, joined = await storage.add_waitlist_entry(USER_ID, DOCTOR_ID, slot_key - slot_key % 1440)
+        assert joined
+        bot.waitlist_queue.push(DOCTOR_ID, slot_key - slot_key % 1440, waitlist_id, USER_ID)
+        return await storage.offer_waitlist_slot(DOCTOR_ID, slot_key)
+    return asyncio.run(run())
+
+def test_booking_through_a_live_offer(storage):
+    slot_key = tomorrow_slot()
+    waitlist_id, user_id = offer_slot(storage, slot_key)
+    assert user_id == USER_ID
+    assert storage.get_waitlist_offer(waitlist_id, USER_ID) == (DOCTOR_ID, slot_key)
+    assert asyncio.run(book(storage, slot_key, waitlist_id, OTHER_USER_ID)) is None
+    assert asyncio.run(book(storage, slot_key, waitlist_id)) is not None
+    # The offer is used up
+    assert storage.get_waitlist_offer(waitlist_id, USER_ID) is None
+
+def test_booking_through_an_expired_offer_is_rejected(storage, monkeypatch):
+    monkeypatch.setattr(bot, 'WAITLIST_OFFER_MINUTES', -1)
+    slot_key = tomorrow_slot()
+    waitlist_id, _ = offer_slot(storage, slot_key)
+    assert storage.get_waitlist_offer(waitlist_id, USER_ID) is None
+    assert asyncio.run(book(storage, slot_key, waitlist_id)) is None
+    assert storage.get_pending_bookings(DOCTOR_ID, 10) == []